@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+# usage : python3 archive.py list -f list1.yml
+#         python3 archive.py show spine1 --format set --at 2023-01-31-23-00-00
+#         python3 archive.py restore --format set --at 2023-01-31-23-00-00 --dir /tmp/configs
+# Reads configs saved by get_config.py --archive. "restore" writes <dir>/<device name>.<format> for every device
+# which can be used directly as --config_file_dir for set_config.py
+
+import argparse, yaml
+import os, time
+from utils.archive import ConfigArchive, TIME_FORMAT
+from utils.presets import config_filter, preset_xpaths
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='''List, show or restore configs from the archive written by
+                                    get_config.py --archive''')
+    parser.add_argument('action', choices=['list', 'show', 'restore'], help='avaiable options: list, show, restore')
+    parser.add_argument('device', nargs='?', help='device name for list and show. Default for list is all devices', default=None)
+    parser.add_argument('--file','-f', help='A yaml formatted file to read dump_path from. Default is list.yml', default = 'list.yml')
+    parser.add_argument('--format', help='format can be xml or set or text. Default is "text"', choices=['xml', 'text', 'set'], default = 'text')
+    parser.add_argument('--filter', action='append', help='''config xpath filters the backups were taken with. Default is
+                        root hierarchy''', default = None)
+    parser.add_argument('--preset', action='append', help='presets the backups were taken with', default = None)
+    parser.add_argument('--at', help='point in time as YYYY-mm-dd-HH-MM-SS. Default is the latest version', default = None)
+    parser.add_argument('--dir', help='directory to restore configs into', default = 'restored_configs')
+    args = parser.parse_args()
+    if args.action == 'show' and not args.device:
+        parser.error('show needs a device name')
+    if args.at:
+        try:
+            time.strptime(args.at, TIME_FORMAT)
+        except ValueError:
+            parser.error(f'--at {args.at} is not a point in time as YYYY-mm-dd-HH-MM-SS')
+    return args
+
+def main():
+    args = parse_args()
+    try:
+        with open(args.file, 'r') as f:
+            data = yaml.safe_load(f)
+    except FileNotFoundError:
+        data = {}
+    archive = ConfigArchive(data.get('dump_path') or os.path.dirname(os.path.realpath(__file__)))
+    # the same filter string get_config.py stored the versions with
+    args.filter = config_filter((args.filter or []) + preset_xpaths(data, args.preset or []))
+    if args.action == 'list':
+        for name in [args.device] if args.device else archive.devices():
+            for version in archive.versions(name, conf_xpath=args.filter):
+                print("{:<24} {:<20} {:<5} {}".format(name, version['timestamp'], version['format'], version['sha256'][:12]))
+    elif args.action == 'show':
+        contents = archive.materialize(args.device, args.format, args.at, args.filter)
+        if contents is None:
+            print(f"No {args.format} config archived for {args.device}")
+        else:
+            print(contents)
+    else:
+        os.makedirs(args.dir, exist_ok=True)
+        for name in archive.devices():
+            contents = archive.materialize(name, args.format, args.at, args.filter)
+            if contents is not None:
+                with open(args.dir + '/' + name + '.' + args.format, 'w') as f:
+                    f.write(contents)
+                print(f"Restored {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+# usage : python3 benchmark/bench.py --devices 200 --latency 0.05 --ops get_config,get_facts,show_config
+#         python3 benchmark/bench.py --devices 200 --save baseline.json
+#         python3 benchmark/bench.py --devices 200 --baseline baseline.json --tolerance 0.2
+# Starts netconf_sim.py with the given number of simulated devices and runs jberry operations against them
+# through JunosDevice and the Scheduler like the scripts do. Reports devices/second, p50/p99/max latency per
+# device, peak RSS and peak thread count for every operation. With --baseline the run fails (exit code 1)
+# when throughput drops by more than --tolerance compared to a saved run.
+
+import argparse, ipaddress, json, os, resource, statistics, subprocess, sys, tempfile, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.junosDevice import JunosDevice, SessionPool
+from utils.scheduler import make_scheduler
+from utils.collectors import COLLECTORS
+
+OPS = ['get_config', 'get_facts', 'set_config', 'show_config']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark jberry operations against simulated NETCONF devices')
+    parser.add_argument('--devices', '-n', type=int, help='Number of simulated devices. Default is 50', default=50)
+    parser.add_argument('--ops', help='Comma separated operations out of ' + ','.join(OPS) + '. Default is all',
+                        default=','.join(OPS))
+    parser.add_argument('--latency', type=float, help='Simulated seconds per rpc. Default is 0', default=0.0)
+    parser.add_argument('--config_lines', type=int, help='Approximate size of every config. Default is 1000', default=1000)
+    parser.add_argument('--connect_failure_rate', type=float, help='Share of connections dropped. Default is 0', default=0.0)
+    parser.add_argument('--rpc_failure_rate', type=float, help='Share of rpcs answered with an error. Default is 0', default=0.0)
+    parser.add_argument('--max_workers', type=int, help='concurrency.max_workers for the run. Default is 32', default=32)
+    parser.add_argument('--engine', choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--pool', action='store_true', help='Share sessions between operations through the session pool')
+    parser.add_argument('--base_ip', help='Address of the first simulated device. Default is 127.0.1.1', default='127.0.1.1')
+    parser.add_argument('--save', help='Write the results as json to this file', default=None)
+    parser.add_argument('--baseline', help='Compare against results saved with --save', default=None)
+    parser.add_argument('--tolerance', type=float, help='Allowed throughput drop against --baseline. Default is 0.2',
+                        default=0.2)
+    return parser.parse_args()
+
+
+def start_simulator(args):
+    sim = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'netconf_sim.py'),
+                            '--devices', str(args.devices), '--base_ip', args.base_ip, '--latency', str(args.latency),
+                            '--config_lines', str(args.config_lines),
+                            '--connect_failure_rate', str(args.connect_failure_rate),
+                            '--rpc_failure_rate', str(args.rpc_failure_rate)],
+                           stdout=subprocess.PIPE, text=True)
+    line = sim.stdout.readline()
+    if not line.startswith('READY'):
+        sim.kill()
+        sys.exit("Simulator failed to start")
+    return sim
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError):
+        # peak of the whole run where /proc is not available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Monitor:
+    '''Samples RSS and thread count in the background while an operation runs.'''
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_threads = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, rss_mb())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def timed(fn, *args):
+    start = time.monotonic()
+    result = fn(*args)
+    return time.monotonic() - start, result
+
+
+def failed(result):
+    code = result[0] if isinstance(result, tuple) else result
+    return code is not None and code < 0
+
+
+def op_args(op, JD):
+    if op == 'get_config':
+        return JD.get_config, ('text', None)
+    if op == 'get_facts':
+        return JD.get_facts, ('hostname',)
+    if op == 'set_config':
+        rendered = 'system {\n    host-name ' + JD.name + '-bench;\n}\n'
+        return JD.set_config, (None, None, None, 1, 'text', True, rendered)
+    return JD.collect, ([COLLECTORS['interfaces_list'], COLLECTORS['bgp_sessions']],)
+
+
+def run(op, data, engine):
+    scheduler = make_scheduler(data, engine)
+    for name, options in data['devices'].items():
+        JD = JunosDevice(name, data['user'], data['password'], options['ip'])
+        fn, args = op_args(op, JD)
+        scheduler.submit(timed, fn, *args, name=name)
+    latencies, failures = [], 0
+    start = time.monotonic()
+    with Monitor() as monitor:
+        for fu in scheduler.as_completed():
+            try:
+                elapsed, result = fu.result()
+                latencies.append(elapsed)
+                failures += failed(result)
+            except Exception:
+                failures += 1
+    total = time.monotonic() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else 0
+    return {'op': op, 'devices': len(data['devices']), 'failed': failures, 'seconds': round(total, 3),
+            'devices_per_second': round(len(data['devices']) / total, 2) if total else 0,
+            'p50': round(statistics.median(latencies), 3) if latencies else 0, 'p99': round(pick(0.99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0, 'peak_rss_mb': round(monitor.peak_rss, 1),
+            'peak_threads': monitor.peak_threads}
+
+
+def compare(results, baseline_file, tolerance):
+    with open(baseline_file) as f:
+        baseline = {r['op']: r for r in json.load(f)['results']}
+    regressions = []
+    for r in results:
+        before = baseline.get(r['op'])
+        if before and r['devices_per_second'] < before['devices_per_second'] * (1 - tolerance):
+            regressions.append("{}: {} devices/s, baseline {}".format(r['op'], r['devices_per_second'],
+                                                                       before['devices_per_second']))
+    return regressions
+
+
+def main():
+    args = parse_args()
+    ops = [op for op in args.ops.split(',') if op]
+    for op in ops:
+        if op not in OPS:
+            sys.exit("Unknown operation {}. Choose from {}".format(op, ','.join(OPS)))
+    sim = start_simulator(args)
+    first = ipaddress.ip_address(args.base_ip)
+    ips = [str(first + i) for i in range(args.devices)]
+    data = {'user': 'bench', 'password': 'bench', 'concurrency': {'max_workers': args.max_workers, 'timeout': 60},
+            'devices': {'sim{}'.format(i): {'ip': ip} for i, ip in enumerate(ips)}}
+    results = []
+    with tempfile.TemporaryDirectory() as dump_path:
+        JunosDevice.dump_path = dump_path
+        JunosDevice.device_list_file = 'bench.yml'
+        JunosDevice.timestamp = time.strftime("%Y-%m-%d-%H-%M-%S")
+        if args.pool:
+            JunosDevice.session_pool = SessionPool(max_sessions=args.devices)
+        try:
+            print("{:<12} {:>7} {:>6} {:>9} {:>10} {:>7} {:>7} {:>7} {:>8} {:>8}".format(
+                'op', 'devices', 'failed', 'seconds', 'devices/s', 'p50', 'p99', 'max', 'rss MB', 'threads'))
+            for op in ops:
+                r = run(op, data, args.engine)
+                results.append(r)
+                print("{op:<12} {devices:>7} {failed:>6} {seconds:>9} {devices_per_second:>10} {p50:>7} {p99:>7} "
+                      "{max:>7} {peak_rss_mb:>8} {peak_threads:>8}".format(**r))
+        finally:
+            if JunosDevice.session_pool is not None:
+                JunosDevice.session_pool.close_all()
+            sim.terminate()
+            sim.wait()
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
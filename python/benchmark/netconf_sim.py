@@ -0,0 +1,346 @@
+#!/usr/bin/python3
+# usage : python3 benchmark/netconf_sim.py --devices 200 --latency 0.05
+#         python3 benchmark/netconf_sim.py --devices 10 --rtt 0.3
+# Simulates junos devices speaking NETCONF over SSH, one per loopback address (127.0.1.1, 127.0.1.2, ...) on
+# port 830, for benchmarks and load tests of jberry without lab devices. Supports what the jberry scripts use:
+# get-configuration (text/set/xml and rollback compare), lock/load/commit/unlock, checksum and commit history,
+# show version, interfaces and bgp summary. Binding port 830 needs root or CAP_NET_BIND_SERVICE.
+
+import argparse, fnmatch, hashlib, ipaddress, queue, random, selectors, socket, sys, threading, time
+from xml.sax.saxutils import escape
+import paramiko
+from lxml import etree
+
+EOM = b']]>]]>'
+NS = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+HELLO = ('<?xml version="1.0" encoding="UTF-8"?><hello xmlns="' + NS + '"><capabilities>'
+         '<capability>urn:ietf:params:netconf:base:1.0</capability>'
+         '<capability>urn:ietf:params:netconf:capability:candidate:1.0</capability>'
+         '<capability>http://xml.juniper.net/netconf/junos/1.0</capability>'
+         '</capabilities><session-id>{}</session-id></hello>')
+DETAIL = ('<traffic-statistics><input-bytes>123456789</input-bytes><input-bps>1000</input-bps>'
+          '<output-bytes>987654321</output-bytes><output-bps>2000</output-bps><input-packets>123456</input-packets>'
+          '<input-pps>10</input-pps><output-packets>654321</output-packets><output-pps>20</output-pps>'
+          '</traffic-statistics><input-error-list><input-errors>0</input-errors><input-drops>0</input-drops>'
+          '<framing-errors>0</framing-errors><input-runts>0</input-runts><input-discards>0</input-discards>'
+          '</input-error-list><output-error-list><carrier-transitions>1</carrier-transitions><output-errors>0'
+          '</output-errors><output-drops>0</output-drops><mtu-errors>0</mtu-errors></output-error-list>'
+          '<logical-interface><name>{}.0</name><if-config-flags><iff-up/><iff-snmp-traps/></if-config-flags>'
+          '<encapsulation>ENET2</encapsulation><traffic-statistics><input-packets>1234</input-packets>'
+          '<output-packets>4321</output-packets></traffic-statistics><address-family><address-family-name>inet'
+          '</address-family-name><mtu>1500</mtu></address-family></logical-interface>')
+REPLY = ('<rpc-reply xmlns="' + NS + '" xmlns:junos="http://xml.juniper.net/junos/21.4R1/junos" '
+         'message-id="{}">{}</rpc-reply>')
+RPC_ERROR = ('<rpc-error><error-type>protocol</error-type><error-tag>operation-failed</error-tag>'
+             '<error-severity>error</error-severity><error-message>{}</error-message></rpc-error>')
+
+
+def make_config(name, lines):
+    '''Text config of about the given number of lines.'''
+    stanzas = ['system {\n    host-name ' + name + ';\n}\n', 'interfaces {\n']
+    for i in range(max(lines // 4, 1)):
+        stanzas.append('    ge-0/0/{} {{\n        description "{} port {}";\n    }}\n'.format(i, name, i))
+    stanzas.append('}\n')
+    return ''.join(stanzas)
+
+
+def to_set(config):
+    out, path = [], []
+    for line in config.splitlines():
+        line = line.strip()
+        if line.endswith('{'):
+            path.append(line[:-1].strip())
+        elif line == '}':
+            path.pop()
+        elif line:
+            out.append('set ' + ' '.join(path + [line.rstrip(';')]))
+    return '\n'.join(out) + '\n'
+
+
+def to_xml(config):
+    root = etree.Element('configuration')
+    stack = [root]
+    for line in config.splitlines():
+        line = line.strip()
+        if line.endswith('{'):
+            element = etree.SubElement(stack[-1], 'item')
+            element.set('name', line[:-1].strip())
+            stack.append(element)
+        elif line == '}':
+            stack.pop()
+        elif line:
+            key, _, value = line.rstrip(';').partition(' ')
+            etree.SubElement(stack[-1], key).text = value.strip('"')
+    return etree.tostring(root, encoding='unicode')
+
+
+class SimDevice:
+    '''State of one simulated device. Every session on the device shares the running config.'''
+    def __init__(self, name, config_lines, interfaces, peers):
+        self.name = name
+        self.running = make_config(name, config_lines)
+        self.interfaces = interfaces
+        self.peers = peers
+        self.commits = 0
+        self.lock = threading.Lock()
+
+
+class _Server(paramiko.ServerInterface):
+    def __init__(self, user, password):
+        self.user = user
+        self.password = password
+        self.netconf = threading.Event()
+
+    def check_auth_password(self, username, password):
+        if username == self.user and password == self.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED if kind == 'session' else paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name == 'netconf':
+            self.netconf.set()
+            return True
+        return False
+
+
+class Session:
+    '''One NETCONF session (base:1.0 framing) on a simulated device.'''
+    ids = iter(range(1, 1 << 31))
+
+    def __init__(self, sim, device, channel):
+        self.sim = sim
+        self.device = device
+        self.channel = channel
+        self.candidate = None
+        self.outbox = None
+        if sim.rtt:
+            self.outbox = queue.Queue()
+            threading.Thread(target=self._deliver, daemon=True).start()
+
+    def _deliver(self):
+        # the link delays every reply by the round trip time without holding back the requests behind it
+        while True:
+            due, data = self.outbox.get()
+            time.sleep(max(0, due - time.monotonic()))
+            self.channel.sendall(data)
+            self.outbox.task_done()
+
+    def send(self, data):
+        if self.outbox is None:
+            self.channel.sendall(data)
+        else:
+            self.outbox.put((time.monotonic() + self.sim.rtt, data))
+
+    def run(self):
+        self.channel.sendall(HELLO.format(next(Session.ids)).encode() + EOM)
+        buffer = b''
+        while True:
+            while EOM not in buffer:
+                data = self.channel.recv(65536)
+                if not data:
+                    return
+                buffer += data
+            message, buffer = buffer.split(EOM, 1)
+            root = etree.fromstring(message.strip())
+            if etree.QName(root).localname == 'hello':
+                continue
+            if self.sim.latency:
+                time.sleep(self.sim.latency * random.uniform(0.5, 1.5))
+            rpc = root[0]
+            name = etree.QName(rpc).localname
+            if random.random() < self.sim.rpc_failure_rate:
+                body = RPC_ERROR.format('simulated failure')
+            else:
+                handler = getattr(self, 'rpc_' + name.replace('-', '_'), None)
+                body = handler(rpc) if handler else RPC_ERROR.format('syntax error, expecting &lt;command&gt;')
+            self.send(REPLY.format(root.get('message-id'), body).encode() + EOM)
+            if name == 'close-session':
+                if self.outbox is not None:
+                    self.outbox.join()
+                return
+
+    def rpc_get_configuration(self, rpc):
+        config = self.candidate if self.candidate is not None else self.device.running
+        if rpc.get('compare') == 'rollback':
+            if config == self.device.running:
+                diff = '\n'
+            else:
+                diff = '\n[edit]\n' + ''.join('+  ' + line + '\n' for line in config.splitlines()[:20])
+            return '<configuration-information><configuration-output>{}</configuration-output>' \
+                   '</configuration-information>'.format(escape(diff))
+        form = rpc.get('format', 'xml')
+        if form == 'text':
+            return '<configuration-text>{}</configuration-text>'.format(escape(config))
+        if form == 'set':
+            return '<configuration-set>{}</configuration-set>'.format(escape(to_set(config)))
+        return to_xml(config)
+
+    def rpc_get_checksum_information(self, rpc):
+        checksum = hashlib.md5(self.device.running.encode()).hexdigest()
+        return '<checksum-information><file-checksum><computation-method>MD5</computation-method>' \
+               '<input-file>/config/juniper.conf.gz</input-file><checksum>{}</checksum></file-checksum>' \
+               '</checksum-information>'.format(checksum)
+
+    def rpc_get_commit_information(self, rpc):
+        return '<commit-information><commit-history><sequence-number>0</sequence-number><user>bench</user>' \
+               '<client>netconf</client><date-time>{}</date-time></commit-history></commit-information>' \
+               .format(self.device.commits)
+
+    def rpc_get_software_information(self, rpc):
+        return '<software-information><host-name>{}</host-name><product-model>vsrx</product-model>' \
+               '<product-name>vsrx</product-name><junos-version>21.4R1.12</junos-version>' \
+               '</software-information>'.format(self.device.name)
+
+    def rpc_command(self, rpc):
+        if (rpc.text or '').startswith('show version'):
+            return self.rpc_get_software_information(rpc)
+        return RPC_ERROR.format('syntax error')
+
+    def rpc_get_interface_information(self, rpc):
+        # terse leaves out the statistics and logical interfaces, interface-name limits the reply to matching ports
+        terse = rpc.find('terse') is not None
+        pattern = rpc.findtext('interface-name')
+        rows = []
+        for i in range(self.device.interfaces):
+            name = 'ge-0/0/{}'.format(i)
+            if pattern and not fnmatch.fnmatchcase(name, pattern):
+                continue
+            row = '<physical-interface><name>\n{}\n</name><admin-status>up</admin-status><oper-status>{}</oper-status>' \
+                  .format(name, 'down' if i % 7 == 6 else 'up')
+            if not terse:
+                row += '<mtu>1514</mtu><speed>1000mbps</speed>' + DETAIL.format(name)
+            rows.append(row + '</physical-interface>')
+        return '<interface-information>' + ''.join(rows) + '</interface-information>'
+
+    def rpc_get_bgp_summary_information(self, rpc):
+        rows = ''.join('<bgp-peer><peer-address>10.0.{}.1</peer-address><peer-as>{}</peer-as>'
+                       '<peer-state>Established</peer-state><flap-count>0</flap-count></bgp-peer>'
+                       .format(i, 65000 + i) for i in range(self.device.peers))
+        return '<bgp-information><peer-count>{}</peer-count>'.format(self.device.peers) + rows + '</bgp-information>'
+
+    def rpc_lock(self, rpc):
+        self.candidate = self.device.running
+        return '<ok/>'
+
+    def rpc_unlock(self, rpc):
+        self.candidate = None
+        return '<ok/>'
+
+    rpc_lock_configuration = rpc_lock
+    rpc_unlock_configuration = rpc_unlock
+
+    def rpc_load_configuration(self, rpc):
+        loaded = rpc.findtext('{*}configuration-text') or rpc.findtext('configuration-text') or \
+            rpc.findtext('{*}configuration-set') or rpc.findtext('configuration-set') or ''
+        self.candidate = loaded if loaded.endswith('\n') else loaded + '\n'
+        return '<load-configuration-results><ok/></load-configuration-results>'
+
+    def rpc_commit_configuration(self, rpc):
+        with self.device.lock:
+            if self.candidate is not None:
+                self.device.running = self.candidate
+            self.device.commits += 1
+        return '<commit-results><routing-engine><name>re0</name><commit-success/></routing-engine></commit-results>'
+
+    def rpc_close_session(self, rpc):
+        return '<ok/>'
+
+
+class Simulator:
+    def __init__(self, devices, base_ip='127.0.1.1', port=830, latency=0.0, config_lines=1000, interfaces=48,
+                 peers=8, connect_failure_rate=0.0, rpc_failure_rate=0.0, user='bench', password='bench', rtt=0.0):
+        first = ipaddress.ip_address(base_ip)
+        self.devices = {str(first + i): SimDevice('sim{}'.format(i), config_lines, interfaces, peers)
+                        for i in range(devices)}
+        self.port = port
+        self.latency = latency
+        self.rtt = rtt
+        self.connect_failure_rate = connect_failure_rate
+        self.rpc_failure_rate = rpc_failure_rate
+        self.user = user
+        self.password = password
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.selector = selectors.DefaultSelector()
+        self.stopped = threading.Event()
+
+    def start(self):
+        for address in self.devices:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((address, self.port))
+            sock.listen(128)
+            sock.setblocking(False)
+            self.selector.register(sock, selectors.EVENT_READ, address)
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _accept(self):
+        while not self.stopped.is_set():
+            for key, _ in self.selector.select(timeout=0.5):
+                try:
+                    conn, _ = key.fileobj.accept()
+                except BlockingIOError:
+                    continue
+                conn.setblocking(True)
+                threading.Thread(target=self._serve, args=(conn, self.devices[key.data]), daemon=True).start()
+
+    def _serve(self, conn, device):
+        if random.random() < self.connect_failure_rate:
+            conn.close()
+            return
+        transport = paramiko.Transport(conn)
+        transport.add_server_key(self.host_key)
+        server = _Server(self.user, self.password)
+        try:
+            transport.start_server(server=server)
+            channel = transport.accept(30)
+            if channel is None or not server.netconf.wait(30):
+                return
+            Session(self, device, channel).run()
+        except (paramiko.SSHException, EOFError, OSError, etree.XMLSyntaxError):
+            pass
+        finally:
+            transport.close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simulated junos devices speaking NETCONF over SSH')
+    parser.add_argument('--devices', '-n', type=int, help='Number of simulated devices. Default is 10', default=10)
+    parser.add_argument('--base_ip', help='Address of the first device. Default is 127.0.1.1', default='127.0.1.1')
+    parser.add_argument('--port', type=int, help='Default is 830', default=830)
+    parser.add_argument('--latency', type=float, help='Average seconds before every rpc reply. Default is 0', default=0.0)
+    parser.add_argument('--rtt', type=float, help='''Round trip time in seconds added to every rpc reply. Unlike --latency
+                        it does not delay the requests queued behind, like a long distance link. Default is 0''', default=0.0)
+    parser.add_argument('--config_lines', type=int, help='Approximate size of every config. Default is 1000', default=1000)
+    parser.add_argument('--interfaces', type=int, help='Interfaces per device. Default is 48', default=48)
+    parser.add_argument('--peers', type=int, help='BGP peers per device. Default is 8', default=8)
+    parser.add_argument('--connect_failure_rate', type=float, help='Share of connections dropped. Default is 0', default=0.0)
+    parser.add_argument('--rpc_failure_rate', type=float, help='Share of rpcs answered with an error. Default is 0', default=0.0)
+    parser.add_argument('--user', default='bench')
+    parser.add_argument('--password', default='bench')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sim = Simulator(args.devices, args.base_ip, args.port, args.latency, args.config_lines, args.interfaces, args.peers,
+                    args.connect_failure_rate, args.rpc_failure_rate, args.user, args.password, args.rtt)
+    sim.start()
+    print("READY {} devices on {}..{} port {}".format(len(sim.devices), list(sim.devices)[0], list(sim.devices)[-1], args.port))
+    sys.stdout.flush()
+    try:
+        sim.stopped.wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
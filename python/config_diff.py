@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+# usage : python3 config_diff.py --golden files/golden/ -f list1.yml
+#         python3 config_diff.py --golden files/golden/standard.set --ignore "system host-name"
+#         python3 config_diff.py --against dumped_files/config/list1.yml_2023-01-31-23-00-00/
+# Compares the configs saved by get_config.py against golden configs or against an older backup without
+# contacting the devices. Configs are parsed into a hierarchy (text, set and xml backups compare equal) and
+# diffed locally across all cores. Diffs are saved in ./dumped_files/config_diff/<list>_<timestamp>/<device name>.diff
+
+import argparse
+import os, sys
+from utils.config_tree import diff_files
+from utils.path import create_path, latest_backup, find_config
+from utils.utils import parse_device_data
+from utils.inventory import load_inventory, add_selector_args
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='''Offline drift report. Diffs the latest backups taken by get_config.py
+                                    against golden configs or an older backup locally, without any load on the devices''')
+    parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is .list.yml', default = 'list.yml')
+    parser.add_argument('--format', help='format of the backups. Default is "text"', choices=['xml', 'text', 'set'], default = 'text')
+    parser.add_argument('--backup', '-b', help='''backup directory to check. Default is the latest
+                        dumped_files/config/<list>_<timestamp>/ directory''', default=None)
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--golden', '-g', help='''golden config. Either a directory with <device name>.<format> files
+                       (like set_config.py --config_file_dir) or a single file all devices are compared to. The golden
+                       format may differ from the backup format''')
+    group.add_argument('--against', '-a', help='an older backup directory, to report what changed since')
+    parser.add_argument('--ignore', '-i', action='append', help='''regex of set lines to leave out of the diff, eg:
+                        "system host-name". Can be repeated''')
+    parser.add_argument('--workers', '-w', type=int, help='Number of processes. Default is the number of cores', default=None)
+    add_selector_args(parser)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+    device_list_file = args.file
+    try:
+        data = load_inventory(device_list_file, args)
+    except FileNotFoundError as err:
+        print("File not found. {}".format(err))
+        return
+    dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+    backup = args.backup or latest_backup(dump_path, device_list_file)
+    if not backup:
+        print("No backups found for {}. Run get_config.py first".format(device_list_file))
+        return
+    print("Checking backups in {}".format(backup))
+    jobs, missing = [], []
+    for device in data['devices'].keys():
+        name = parse_device_data(data, device)[0]
+        current = find_config(backup, name, args.format)
+        if args.golden and os.path.isfile(args.golden):
+            reference = args.golden
+        else:
+            reference = find_config(args.golden or args.against, name, args.format)
+        if current and reference:
+            jobs.append((name, reference, current))
+        else:
+            missing.append(name)
+    out_dir = create_path(dump_path, 'config_diff', os.path.basename(device_list_file))
+    results, elapsed = diff_files(jobs, out_dir, args.ignore, args.workers)
+    drifted = 0
+    for name, added, removed, file_name, err in sorted(results):
+        if err:
+            print("{:<24} errored. {}".format(name, err))
+        elif file_name:
+            drifted += 1
+            print("{:<24} +{:<6} -{:<6} {}".format(name, added, removed, file_name))
+    for name in missing:
+        print("{:<24} no config to compare".format(name))
+    print("{} devices compared in {:.2f}s. {} in sync, {} drifted, {} errored, {} missing".format(
+        len(results), elapsed, sum(1 for r in results if not r[3] and not r[4]), drifted,
+        sum(1 for r in results if r[4]), len(missing)))
+    sys.exit(1 if drifted else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# usage : python3 config_query.py has "system services telnet"
+#         python3 config_query.py find "interfaces * unit * family ethernet-switching vlan members v300"
+#         python3 config_query.py values "system ntp server"
+#         python3 config_query.py show spine1 "system services"
+#         python3 config_query.py build --backup dumped_files/config/list1.yml_2023-01-31-23-00-00/
+# Answers fleet wide config questions from the index built by get_config.py --index (or "build") without
+# grepping the backups. Device selectors (--tags, --group, --match, --exclude) limit the answer to those devices.
+
+import argparse
+import os, sys, time
+from collections import Counter
+from utils.config_index import ConfigIndex
+from utils.path import latest_backup, find_config
+from utils.utils import parse_device_data
+from utils.inventory import load_inventory, add_selector_args
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='''Query the config index. "has" lists the devices with a statement
+                                    and everything below it, "find" matches statements with * and ? wildcards, "values" lists
+                                    what is configured below a hierarchy per device, "show" prints a device's statements,
+                                    "devices" lists the indexed devices and "build" indexes existing backups''')
+    parser.add_argument('action', choices=['has', 'find', 'values', 'show', 'devices', 'build'])
+    parser.add_argument('query', nargs='*', help='statement, pattern or hierarchy. For show: device name and optional hierarchy')
+    parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is .list.yml', default = 'list.yml')
+    parser.add_argument('--format', help='format of the backups for build. Default is "text"', choices=['xml', 'text', 'set'],
+                        default = 'text')
+    parser.add_argument('--backup', '-b', help='''backup directory for build. Default is the latest
+                        dumped_files/config/<list>_<timestamp>/ directory''', default=None)
+    add_selector_args(parser)
+    args = parser.parse_args()
+    return args
+
+def selected(data, args):
+    if not (args.tags or args.group or args.match or args.exclude):
+        return None
+    return {parse_device_data(data, device)[0] for device in data.get('devices', {}).keys()}
+
+def build(index, data, args, dump_path):
+    backup = args.backup or latest_backup(dump_path, args.file)
+    if not backup:
+        print("No backups found for {}. Run get_config.py first".format(args.file))
+        return 1
+    files = []
+    for device in data.get('devices', {}).keys():
+        name = parse_device_data(data, device)[0]
+        file_name = find_config(backup, name, args.format)
+        if file_name:
+            files.append((name, file_name, None))
+    start = time.monotonic()
+    indexed, unchanged, failed = index.update_all(files)
+    print("Indexed {} devices from {} in {:.2f}s. {} unchanged, {} failed".format(
+        indexed, backup, time.monotonic() - start, unchanged, failed))
+    return 1 if failed else 0
+
+def main():
+    args = parse_args()
+    try:
+        data = load_inventory(args.file, args)
+    except FileNotFoundError:
+        if args.action == 'build':
+            print("File not found. {}".format(args.file))
+            sys.exit(1)
+        data = {}
+    dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+    index = ConfigIndex(dump_path)
+    devices = selected(data, args)
+    query = ' '.join(args.query)
+    if not query and args.action in ('has', 'find', 'values', 'show'):
+        sys.exit("{} needs a {}".format(args.action, 'device name' if args.action == 'show' else 'statement'))
+    start = time.monotonic()
+    rc = 0
+    try:
+        if args.action == 'build':
+            rc = build(index, data, args, dump_path)
+        elif args.action == 'devices':
+            for name, statements, indexed, file_name in index.devices():
+                if devices is None or name in devices:
+                    print("{:<24} {:>8} statements  indexed {}  {}".format(name, statements, indexed, file_name))
+        elif args.action == 'show':
+            for _, line in index.show(args.query[0], ' '.join(args.query[1:])):
+                print("set " + line)
+        elif args.action == 'values':
+            rows = index.values(query, devices)
+            for device, value in rows:
+                print("{:<24} {}".format(device, value))
+            print("\n{:<8} {}".format('devices', 'value'))
+            for value, count in Counter(v for _, v in rows).most_common():
+                print("{:<8} {}".format(count, value))
+        else:
+            rows = index.has(query, devices) if args.action == 'has' else index.find(query, devices)
+            for device, line in rows:
+                print("{:<24} {}".format(device, line))
+            print("{} statements on {} devices in {:.1f} ms".format(len(rows), len({d for d, _ in rows}),
+                                                                   (time.monotonic() - start) * 1000))
+    finally:
+        index.close()
+    sys.exit(rc)
+
+if __name__ == "__main__":
+    main()
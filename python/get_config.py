@@ -3,13 +3,22 @@
 # Date: 6 Oct 2022
 # Email: himanshu.surendra@gmail.com
 # usage : python3 get_config.py --format=set --filter=system --f list1.yml
+#         python3 get_config.py --format=set --preset management --filter "interfaces/interface[name=ge-0/0/0]" --f list1.yml
 # for filter usage refer https://www.juniper.net/documentation/us/en/software/junos-pyez/junos-pyez-developer/topics/topic-map/junos-pyez-program-configuration-retrieving.html
 
-import concurrent.futures
-import argparse, yaml
+import argparse
 from utils.junosDevice import JunosDevice
-from utils.utils import parse_device_data
-import os
+from utils.utils import parse_device_data, parse_device_options
+from utils.scheduler import make_scheduler
+import os, sys, time
+from utils.shard import run_sharded, exit_code
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
+from utils import timing
+from utils.config_index import ConfigIndex
+from utils.archive import ConfigArchive
+from utils.path import create_path, find_config
+from utils.presets import CONFIG_PRESETS, config_filter, preset_xpaths
 
 def parse_args():
     parser = argparse.ArgumentParser(description='''Get config from Junos devices in xml or text or set format. 
@@ -17,34 +26,102 @@ def parse_args():
     parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is .list.yml', default = 'list.yml')
     parser.add_argument('--format', help='''format can be xml or set or text. Default is "text". Also note for older Junos
     format is always xml inspite of explicitly trying to specify otherwise. ''', choices=['xml', 'text', 'set'], default = 'text')
-    parser.add_argument('--filter', help='config xpath filter. eg: system/services. Default is print from root hierarchy', default = None)
+    parser.add_argument('--filter', action='append', help='''config xpath filter. eg: system/services or
+                        interfaces/interface[name=ge-0/0/0]. Can be repeated, all filters are fetched with a single rpc.
+                        Default is print from root hierarchy''', default = None)
+    parser.add_argument('--preset', action='append', help='''named set of config hierarchies to fetch, combined with
+                        --filter. Built in: {}. More can be defined in the presets section of the inventory (see sample.yml).
+                        Can be repeated'''.format(', '.join(CONFIG_PRESETS)), default = None)
+    parser.add_argument('--incremental', '-i', action='store_true', help='''Only download the config of devices that
+                        committed since their last incremental backup. Unchanged devices get a <device name>.<format>.unchanged
+                        marker pointing at the last backup instead''')
+    parser.add_argument('--archive', '-a', action='store_true', help='''Store configs in the deduplicated, compressed archive
+                        under dumped_files/archive/ instead of a new timestamped directory. Use archive.py to read them back''')
+    parser.add_argument('--index', action='store_true', help='''Update the searchable config index
+                        (dumped_files/config_index.db) with the new backups. Only devices whose config changed are re-indexed.
+                        Query it with config_query.py''')
+    parser.add_argument('--engine', help='''Execution engine. "asyncio" drives the sessions from an event loop and scales
+                        to larger fleets (see concurrency.io_threads in sample.yml). Default is "thread"''',
+                        choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--shards', type=int, help='''Number of processes to split the inventory across. Useful when
+                        post-processing large outputs makes a single process CPU bound. Default is 1''', default=1)
+    add_selector_args(parser)
+    timing.add_timing_args(parser)
     args = parser.parse_args()
     return args
 
 
 def main():
     args = parse_args()
-    conf_xpath = args.filter
+    timing.start(args)
     form = args.format
     device_list_file = JunosDevice.device_list_file = args.file
     try:
-        with open(device_list_file, 'r') as f:
-            data = yaml.safe_load(f)
-            JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = []
-                for device in data['devices'].keys():
-                    name, ip, console, user, password = parse_device_data(data, device)
-                    JD = JunosDevice(name, user, password, ip, console)
-                    results.append(executor.submit(JD.get_config, form, conf_xpath))
-                for fu in concurrent.futures.as_completed(results):
-                    fu.result()
+        data = load_inventory(device_list_file, args)
+        JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+        JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+        try:
+            conf_xpath = config_filter((args.filter or []) + preset_xpaths(data, args.preset or []))
+        except KeyError as err:
+            print("Unknown preset {}. Available presets: {}".format(err, ', '.join(dict(CONFIG_PRESETS, **(data.get('presets') or {})))))
+            return
+        except ValueError as err:
+            print(err)
+            return
+        # one backup directory for the whole run, so that it can be indexed afterwards
+        JunosDevice.timestamp = JunosDevice.timestamp or time.strftime("%Y-%m-%d-%H-%M-%S")
+        if args.shards > 1:
+            rc = exit_code(list(run_sharded(data, args.shards, 'get_config', form, conf_xpath, args.incremental, args.archive,
+                                            engine=args.engine)))
+            if args.index:
+                index_configs(data, form, conf_xpath, args.archive)
+            sys.exit(rc)
+        scheduler = make_scheduler(data, args.engine)
+        for device in data['devices'].keys():
+            name, ip, console, user, password = parse_device_data(data, device)
+            site, priority, timeout = parse_device_options(data, device)
+            JD = JunosDevice(name, user, password, ip, console, timeout)
+            scheduler.submit(JD.get_config, form, conf_xpath, args.incremental, args.archive,
+                             site=site, priority=priority)
+        for fu in scheduler.as_completed():
+            fu.result()
+        if args.index:
+            index_configs(data, form, conf_xpath, args.archive)
     except FileNotFoundError as err:
         print("File not found. {}".format(err))
     except Exception as err:
         print("Could not complete operation. {}".format(err))
+    finally:
+        timing.save(args, script='get_config.py', inventory=device_list_file)
 
 
+def index_configs(data, form, conf_xpath, archive):
+    if conf_xpath:
+        print("Not indexing. The index holds full configs and this run used --filter or --preset")
+        return
+    if archive:
+        archive = ConfigArchive(JunosDevice.dump_path)
+    else:
+        backup = create_path(JunosDevice.dump_path, 'config', os.path.basename(JunosDevice.device_list_file),
+                             JunosDevice.timestamp)
+    files = []
+    for device in data['devices'].keys():
+        name = parse_device_data(data, device)[0]
+        if archive:
+            version = archive.version_at(name, form)
+            file_name = archive.object_path(version['sha256']) if version else None
+        else:
+            file_name = find_config(backup, name, form)
+        if file_name:
+            files.append((name, file_name, form))
+    start = time.monotonic()
+    index = ConfigIndex(JunosDevice.dump_path)
+    try:
+        indexed, unchanged, failed = index.update_all(files)
+    finally:
+        index.close()
+    print("Indexed {} devices in {:.2f}s. {} unchanged, {} failed".format(indexed, time.monotonic() - start,
+                                                                        unchanged, failed))
 
 if __name__ == "__main__":
     main()
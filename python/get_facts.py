@@ -5,37 +5,56 @@
 # usage : python3 get_facts.py -k serialnumber -f list1.yml
 # files inside files/environment_variables/<device name>.yml . the device name is extracted from list.yml
 
-import concurrent.futures
-import argparse, yaml
+import argparse
 from utils.junosDevice import JunosDevice
-import os
-from utils.utils import parse_device_data
+import os, sys
+from utils.shard import run_sharded, exit_code
+from utils.utils import parse_device_data, parse_device_options
+from utils.scheduler import make_scheduler
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
+from utils import timing
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Get facts from junos devices. Saves output in a file under ./dumped_files/facts/<device_name>_facts")
     parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is .list.yml', default = 'list.yml')
     parser.add_argument('--key','-k', help='find a specific fact value. eg: serialnumber or version', default = None)
+    parser.add_argument('--cached', '-c', action='store_true', help='''Serve facts from the local facts cache while they are
+                        fresh and only fetch missing or expired facts from the devices. TTLs are set with facts_ttl in list.yml''')
+    parser.add_argument('--engine', help='''Execution engine. "asyncio" drives the sessions from an event loop and scales
+                        to larger fleets (see concurrency.io_threads in sample.yml). Default is "thread"''',
+                        choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--shards', type=int, help='''Number of processes to split the inventory across. Useful when
+                        post-processing large outputs makes a single process CPU bound. Default is 1''', default=1)
+    add_selector_args(parser)
+    timing.add_timing_args(parser)
     args = parser.parse_args()
     return args
 
 def main():
     args = parse_args()
+    timing.start(args)
     key = args.key
     device_list_file = JunosDevice.device_list_file = args.file
     try:
-        with open(device_list_file, 'r') as f:
-            data = yaml.safe_load(f)
-            JunosDevice.dump_path = data.get('dump_path')  or os.path.dirname(os.path.realpath(__file__))
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = []
-                for device in data['devices'].keys():
-                    name, ip, console, user, password = parse_device_data(data, device)
-                    JD = JunosDevice(name, user, password, ip, console)
-                    results.append(executor.submit(JD.get_facts, key))
-                for fu in concurrent.futures.as_completed(results):
-                    fu.result()
+        data = load_inventory(device_list_file, args)
+        JunosDevice.dump_path = data.get('dump_path')  or os.path.dirname(os.path.realpath(__file__))
+        JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+        JunosDevice.facts_ttl = data.get('facts_ttl')
+        if args.shards > 1:
+            sys.exit(exit_code(list(run_sharded(data, args.shards, 'get_facts', key, args.cached, engine=args.engine))))
+        scheduler = make_scheduler(data, args.engine)
+        for device in data['devices'].keys():
+            name, ip, console, user, password = parse_device_data(data, device)
+            site, priority, timeout = parse_device_options(data, device)
+            JD = JunosDevice(name, user, password, ip, console, timeout)
+            scheduler.submit(JD.get_facts, key, args.cached, site=site, priority=priority)
+        for fu in scheduler.as_completed():
+            fu.result()
     except FileNotFoundError as err:
         print("File not found. {}".format(err))
+    finally:
+        timing.save(args, script='get_facts.py', inventory=device_list_file)
 
 if __name__ == "__main__":
     main()
@@ -5,11 +5,13 @@
 # usage : python3 power.py -f file1.list 
 # reboots the list of devices in file1.list 
 
-import yaml
 import argparse
-import concurrent.futures
+import os
 from utils.junosDevice import JunosDevice
-from utils.utils import parse_device_data
+from utils.utils import parse_device_data, parse_device_options
+from utils.scheduler import Scheduler
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Reboot/shutdown junos devices")
@@ -19,6 +21,7 @@ def parse_args():
     parser.add_argument('--dry', '-d', type=int, help='''if set to 1,  "ONLY" prints list of devices that will be rebooted. 
                         Default is 1.
                         Explicitly specify this argument with value 0 to reboot or poweroff''', choices=[0,1], default = 1)
+    add_selector_args(parser)
     args = parser.parse_args()
     return args
 
@@ -29,16 +32,17 @@ def main():
     t = args.time
     dry = args.dry
     try:
-        with open(device_list_file, 'r') as f:
-            data = yaml.safe_load(f)
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = []
-                for device in data['devices'].keys():
-                    name, ip, console, user, password = parse_device_data(data, device)
-                    JD = JunosDevice(name, user, password, ip, console)
-                    results.append(executor.submit(JD.power_junos, power, t, dry))
-                for fu in concurrent.futures.as_completed(results):
-                    fu.result()
+        data = load_inventory(device_list_file, args)
+        JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+        JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+        scheduler = Scheduler.from_inventory(data)
+        for device in data['devices'].keys():
+            name, ip, console, user, password = parse_device_data(data, device)
+            site, priority, timeout = parse_device_options(data, device)
+            JD = JunosDevice(name, user, password, ip, console, timeout)
+            scheduler.submit(JD.power_junos, power, t, dry, site=site, priority=priority)
+        for fu in scheduler.as_completed():
+            fu.result()
     except FileNotFoundError as err:
         print("File {} not found. {}".format(device_list_file, err))
 
@@ -11,13 +11,21 @@
 # this option is selected. The config_file_dir is searched for device config to be pushed. The search is based on device 
 # name specified in list.yml
 
-import yaml, argparse
-from utils.junosDevice import JunosDevice
+import argparse
+from utils.junosDevice import JunosDevice, SessionPool
 from utils.j_email import Email
 from utils.path import create_path
-import os
-from utils.utils import parse_device_data
-import concurrent.futures
+import os, sys, time
+from utils.render import render_all
+from utils.shard import run_sharded, exit_code
+from utils.utils import parse_device_data, parse_device_options
+from utils.scheduler import Scheduler
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
+from utils.diff_report import DiffGroups
+from utils.commit_pipeline import CommitPipeline, CONFIRMED, UNCHANGED, COMMIT_RETRY_CODES
+from utils.scheduler import RETRY_CODES
+from utils import timing
 from os.path import exists
 
 failed_results = []
@@ -38,7 +46,19 @@ def parse_args():
                         If specified, searches for <device name>_config inside the config file directory 
                         instead of using j2 template from list.yml''', default=None)
     parser.add_argument('--overwrite', '-o', help='Whether to delete current config and overwrite new or not', choices=['True', 'False'], default = 'True')
+    parser.add_argument('--skip_unchanged', '-s', action='store_true', help='''Skip devices whose rendered config and
+                        device config checksum are both unchanged since the last successful run. Only one cheap rpc is sent
+                        to such devices, no lock, load or diff''')
+    parser.add_argument('--waves', '-w', action='store_true', help='''Commit in waves with commit confirmed as defined
+                        in the "commit" section of list.yml: load and diff everywhere first, then commit a wave, health check it
+                        and confirm it, or roll the whole wave back when too many devices fail. Needs '-d 0' ''')
+    parser.add_argument('--shards', type=int, help='''Number of processes to split the inventory across. Useful when
+                        post-processing large outputs makes a single process CPU bound. Default is 1''', default=1)
+    add_selector_args(parser)
+    timing.add_timing_args(parser)
     args = parser.parse_args()
+    if args.waves and args.shards > 1:
+        parser.error('--waves commits with a single pipeline and can not be combined with --shards')
     return args
 
 def get_env_file(name):
@@ -49,6 +69,7 @@ def get_env_file(name):
 
 def main():
     args = parse_args()
+    timing.start(args)
     form = args.format
     device_list_file = JunosDevice.device_list_file = args.file
     dry = args.dry
@@ -61,38 +82,85 @@ def main():
     else:
         overwrite = bool(0)
     try:
-        with open(device_list_file, 'r') as f:
-            data = yaml.safe_load(f)
-            JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
-            template_path=data.get('config')
-            from_email = data.get('from_email')
-            to_email = data.get('to_email')
-            smtp_server = data.get('smtp_server')
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = []
-                for device in data['devices'].keys():
-                    name, ip, console, user, password = parse_device_data(data, device)
-                    env_file = get_env_file(name)
-                    JD = JunosDevice(name, user, password, ip, console)
-                    results.append(executor.submit(JD.set_config, env_file, config_file_dir, template_path, dry, form, overwrite))
-                for fu in concurrent.futures.as_completed(results):
-                    ret, dev_name, file_name = fu.result()
-                    eval_results(ret, dev_name, file_name)
+        data = load_inventory(device_list_file, args)
+        JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+        JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+        template_path=data.get('config')
+        from_email = data.get('from_email')
+        to_email = data.get('to_email')
+        smtp_server = data.get('smtp_server')
+        # a commit that timed out may already be applied on the device, only diffs are retried on a timeout
+        retry_codes = RETRY_CODES if dry else COMMIT_RETRY_CODES
+        if args.shards > 1:
+            results = list(run_sharded(data, args.shards, 'set_config', config_file_dir, template_path, dry, form,
+                                       overwrite, None, args.skip_unchanged, device_arg=get_env_file,
+                                       retry_codes=retry_codes))
+            for name, (ret, dev_name, file_name) in results:
+                eval_results(ret, dev_name, file_name)
+            rc = exit_code(results)
+            if len(failed_results) > 0:
+                report_results(data, smtp_server)
+            sys.exit(rc)
+        devices = []
+        for device in data['devices'].keys():
+            name, ip, console, user, password = parse_device_data(data, device)
+            site, priority, timeout = parse_device_options(data, device)
+            devices.append((JunosDevice(name, user, password, ip, console, timeout), get_env_file(name), site, priority))
+        rendered = {}
+        if template_path and not config_file_dir:
+            rendered, render_time = render_all(template_path, {JD.name: env_file for JD, env_file, _, _ in devices})
+            print("Rendered {} configs in {:.2f}s".format(len(rendered), render_time))
+        push_start = time.monotonic()
+        if args.waves and not dry:
+            pipeline = CommitPipeline(data, devices, data.get('commit'))
+            # the load, health checks, commit and confirm of a device share one session
+            JunosDevice.session_pool = SessionPool(max_sessions=len(devices))
+            try:
+                status = pipeline.run(config_file_dir, template_path, form, overwrite, rendered)
+            finally:
+                JunosDevice.session_pool.close_all()
+            print("Pushed to {} devices in {:.2f}s".format(len(devices), time.monotonic() - push_start))
+            failed = [name for name, (state, _, _) in status.items() if state not in (CONFIRMED, UNCHANGED)]
+            if failed:
+                print("{} devices not confirmed: {}".format(len(failed), " ".join(failed)))
+                sys.exit(1)
+            return
+        scheduler = Scheduler.from_inventory(data)
+        scheduler.retry_codes = retry_codes
+        for JD, env_file, site, priority in devices:
+            scheduler.submit(JD.set_config, env_file, config_file_dir, template_path, dry, form, overwrite,
+                             rendered.get(JD.name), args.skip_unchanged, site=site, priority=priority)
+        for fu in scheduler.as_completed():
+            ret, dev_name, file_name = fu.result()
+            eval_results(ret, dev_name, file_name)
+        print("Pushed to {} devices in {:.2f}s".format(len(devices), time.monotonic() - push_start))
     except FileNotFoundError as err:
         print("File not found. {}".format(err))
+    finally:
+        timing.save(args, script='set_config.py', inventory=device_list_file)
     if len(failed_results) > 0:
-        print("Emailing results")
-        email_results(smtp_server)
+        report_results(data, smtp_server)
 
-def email_results(smtp_server=None):
+def report_results(data, smtp_server=None):
+    '''Groups the devices with a diff by their normalized diff and writes one compressed report next to the deltas.'''
+    ips = {}
+    for device in data['devices'].keys():
+        name, ip, console, _, _ = parse_device_data(data, device)
+        ips[name] = (ip, console.split(':')[0] if console else None)
+    groups = DiffGroups((data.get('diff_report') or {}).get('normalize'))
+    for dev_name, file_name in failed_results:
+        groups.add(dev_name, file_name, *ips.get(dev_name, ()))
+    summary = groups.summary()
+    print(summary)
+    report = groups.write(os.path.join(os.path.dirname(failed_results[0][1]), 'diff_report.txt.gz'))
+    print("Diff report written to {}".format(report))
+    print("Emailing results")
+    email_results(summary, report, smtp_server)
+
+def email_results(summary, report, smtp_server=None):
     if from_email and to_email and smtp_server:
-        body = "Diff detected for: "
-        attachments = []
-        for result in failed_results:
-            body = body + result[0] + "    "
-            attachments.append(result[1])
         e = Email(smtp_server)
-        e.send_mail(from_email, to_email, 'jberry diff results', body, attachments)
+        e.send_mail(from_email, to_email, 'jberry diff results', summary, [report])
     else:
         print("Email notifications not configured")
 
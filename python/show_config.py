@@ -2,126 +2,113 @@
 # Author: Himanshu Bahukhandi
 # Date: 3 Mar 2022
 # Email: himanshu.surendra@gmail.com
-# usage : python3 show_config.py <rpc> --f list1.yml
+# usage : python3 show_config.py <rpc> [<rpc> ...] --f list1.yml
 
 
 
-from jnpr.junos import Device
-from lxml import etree
-from jnpr.junos.exception import ConnectError, ConnectAuthError, RpcError
-import yaml
 import argparse
-import concurrent.futures
 import os 
+from utils.junosDevice import JunosDevice
+from utils.utils import parse_device_data, parse_device_options
+from utils.scheduler import make_scheduler
+from utils.collectors import COLLECTORS
+from utils.tables import Table
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
+from utils import timing
 
 final_result = []
 
 def parse_args():
     parser = argparse.ArgumentParser(description='''show running config states from Junos devices. Also saves the output in ./dumpled_files/
-                                    show_config/<device name>.<rpc>''')
-    parser.add_argument('rpc', choices=['interfaces_list', 'bgp_sessions'], help='avaiable options: interfaces_list, bgp_sessions')
+                                    show_config/<device name>.<rpc>. Several collectors can be given and are pipelined over a
+                                    single session per device''')
+    parser.add_argument('rpc', nargs='+', choices=list(COLLECTORS), help='avaiable options: ' + ', '.join(COLLECTORS))
     parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is list.yml', default = 'list.yml')
+    parser.add_argument('--interfaces', '-i', nargs='+', help='''Only collect these interfaces, eg: ge-0/0/0 "et-0/0/*".
+                        Applies to interfaces_list and interfaces_detail. Default is all interfaces''', default=None)
+    parser.add_argument('--engine', help='''Execution engine. "asyncio" drives the sessions from an event loop and scales
+                        to larger fleets (see concurrency.io_threads in sample.yml). Default is "thread"''',
+                        choices=['thread', 'asyncio'], default='thread')
+    parser.add_argument('--export', '-e', help='''File to write the fleet wide table to, with one row per interface,
+                        peer etc. and a device column. With several collectors the collector name is added before the
+                        extension, eg: fleet.bgp_sessions.csv''', default=None)
+    parser.add_argument('--export_format', help='Format of the --export file. Parquet needs pyarrow. Default is "csv"',
+                        choices=['csv', 'jsonl', 'parquet'], default='csv')
+    add_selector_args(parser)
+    timing.add_timing_args(parser)
     args = parser.parse_args()
     return args
 
-def get_dev_user_passord(data, device):
-    if data['devices'][device] and data['devices'][device].get('user'):
-        user = data['devices'][device]['user']  
-    else:
-        user = data['user']
-    if data['devices'][device] and data['devices'][device].get('password'):
-        password = data['devices'][device]['password']  
-    else:
-        password = data['password']
-    return user, password
-
-def dev_connection(device, user, password):
-    if ":" in device:
-        return Device(host=device.split(':')[0], mode='telnet', 
-                port=device.split(':')[1], user=user, password=password, attempts=5, gather_facts=0)
-    else:
-        return Device(host=device, user=user, password=password, gather_facts=0)
-
-def bgp_sessions(dev, device):
-    bgp_data = dev.rpc.get_bgp_summary_information()
-    bgp_neighbors_list = []
-    bgp_neighbors = bgp_data.xpath("bgp-peer/peer-address")
-    for i in bgp_neighbors:
-        bgp_neighbors_list.append(i.text.replace('\n',''))
-    
-    bgp_sessions_list = []
-    bgp_sessions = bgp_data.xpath("bgp-peer/peer-state")
-    for i in bgp_sessions:
-        bgp_sessions_list.append(i.text.replace('\n',''))
-    print("***{}***".format(device))
-    print("BGP Peer Name" + "    " + "State")
-    res = []
-    for i in range(len(bgp_sessions_list)):
-        res.append((bgp_neighbors_list[i], bgp_sessions_list[i]))
-        print("{:<16} {:<10}".format(bgp_neighbors_list[i], bgp_sessions_list[i]))
+def print_table(device, collector, table):
+    columns = [column for column, _, _ in collector.display]
+    print("***{}: {}***".format(device, collector.name))
+    print(" ".join("{:<{}}".format(header, width) for _, header, width in collector.display))
+    res = table.rows(columns)
+    for row in res:
+        print(" ".join("{:<{}}".format(str(value), width) for value, (_, _, width) in zip(row, collector.display)))
     return res
 
-def interfaces_list(dev, device):
-    interface_data = dev.rpc.get_interface_information()
-    int_list = []
-    interface_name_list = interface_data.xpath("physical-interface/name")
-    for i in interface_name_list:
-        int_list.append(i.text.replace('\n',''))
-
-    int_admin_state_list = []
-    int_admin_states = interface_data.xpath("physical-interface/admin-status")
-    for i in int_admin_states:
-        int_admin_state_list.append(i.text.replace('\n',''))
-
-    int_oper_state_list = []
-    int_oper_states = interface_data.xpath("physical-interface/oper-status")
-    for i in int_oper_states:
-        int_oper_state_list.append(i.text.replace('\n',''))    
-    res = []
-    print("***{}***".format(device))
-    print("Interface Name" + "   " +  "Admin State" + "   " + "Operational State")
-    for i in range(len(int_oper_state_list)):
-        res.append((int_list[i],int_admin_state_list[i],int_oper_state_list[i]))
-        print("{:<16} {:<13} {:<15}".format(int_list[i], int_admin_state_list[i], int_oper_state_list[i]))
-    return res
-
-def show_config(data, device, rpc):
-    user, password = get_dev_user_passord(data, device)
-    dev = dev_connection(device, user, password)
+def show_config(JD, collectors, interfaces=None):
+    ret, tables = JD.collect(collectors, interfaces)
+    if ret:
+        print("Could not collect from {}. Error code {}".format(JD.name, ret))
+        return JD.name, {}
     os.makedirs(os.path.dirname('dumped_files/show_config/'), exist_ok=True)
-    dev.open() 
-    
-    if rpc == "interfaces_list":
-        res = interfaces_list(dev, device)
-        final_result.append(res)
-    if rpc == "bgp_sessions":
-        res = bgp_sessions(dev, device)
+    for collector in collectors:
+        table = tables[collector.name]
+        if isinstance(table, int):
+            print("{} failed on {}. Error code {}".format(collector.name, JD.name, table))
+            continue
+        res = print_table(JD.name, collector, table)
         final_result.append(res)
-    with open('dumped_files/show_config/' + device + "." + rpc, 'w') as f:
-        f.write(str(res))
-    dev.close()
-    
+        with open('dumped_files/show_config/' + JD.name + "." + collector.name, 'w') as f:
+            f.write(str(res))
+    return JD.name, tables
+
+def export_file(export, name, several):
+    if not several:
+        return export
+    base, ext = os.path.splitext(export)
+    return base + "." + name + ext
+
 def main():
     args = parse_args()
-    rpc = args.rpc
-    device_list_file = args.file
-    result = []
+    timing.start(args)
+    collectors = [COLLECTORS[rpc] for rpc in dict.fromkeys(args.rpc)]
+    device_list_file = JunosDevice.device_list_file = args.file
     try:
-        with open(device_list_file, 'r') as f:
-            data = yaml.safe_load(f)
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = []
-                for device in data['devices'].keys():
-                    results.append(executor.submit(show_config, data, device, rpc))
-                for fu in concurrent.futures.as_completed(results):
-                    try:
-                        print(fu.result())
-                    except ConnectAuthError as err:
-                        print("Invalid Username or password. {}".format(err))
-                    except ConnectError as err:
-                        print("Could not connect to {}".format(err))
+        data = load_inventory(device_list_file, args)
+        JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+        JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+        scheduler = make_scheduler(data, args.engine)
+        fleet = {c.name: Table(('device',) + tuple(c.spec[1])) for c in collectors}
+        for device in data['devices'].keys():
+            name, ip, console, user, password = parse_device_data(data, device)
+            site, priority, timeout = parse_device_options(data, device)
+            JD = JunosDevice(name, user, password, ip, console, timeout)
+            scheduler.submit(show_config, JD, collectors, args.interfaces, site=site, priority=priority, name=name)
+        for fu in scheduler.as_completed():
+            device, tables = fu.result()
+            for collector_name, table in tables.items():
+                if not isinstance(table, int):
+                    fleet[collector_name].extend(table, device=device)
+        for collector in collectors:
+            table = fleet[collector.name]
+            print("***fleet {}: {} rows from {} devices***".format(collector.name, len(table),
+                                                                  len(set(table.column('device')))))
+            for value, count in sorted(table.count(*collector.summary).items(), key=str):
+                print("{:<30} {}".format(str(value), count))
+            if args.export:
+                file_name = export_file(args.export, collector.name, len(collectors) > 1)
+                table.export(file_name, args.export_format)
+                print("Exported to {}".format(file_name))
     except FileNotFoundError as err:
         print("File not found. {}".format(err))
+    except ImportError as err:
+        print(err)
+    finally:
+        timing.save(args, script='show_config.py', inventory=device_list_file)
 
     return final_result
 
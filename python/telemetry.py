@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+# usage : python3 telemetry.py bgp_sessions interfaces_list -f list1.yml
+# Long running poller. Keeps the sessions to the devices open, polls every collector on its own interval
+# (telemetry.intervals in list.yml) and only reports changes, eg: bgp peer state transitions or interface
+# oper-status flips. Changes are printed and appended to ./dumped_files/telemetry/events.jsonl and the current
+# state is served on http://<host>:<port>/metrics for Prometheus, /events and /state.
+
+import argparse, json
+import os, signal
+from utils.junosDevice import JunosDevice, SessionPool
+from utils.utils import parse_device_data, parse_device_options
+from utils.collectors import COLLECTORS
+from utils.telemetry import Poller, serve, DEFAULT_JITTER
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='''Continuously poll operational state from junos devices and report
+                                     changes. Serves Prometheus metrics on /metrics''')
+    parser.add_argument('rpc', nargs='*', choices=list(COLLECTORS), help='''collectors to poll. Default is the collectors
+                        listed in telemetry.intervals in list.yml, or all of them. avaiable options: ''' + ', '.join(COLLECTORS))
+    parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is list.yml', default = 'list.yml')
+    parser.add_argument('--port', '-p', type=int, help='Port of the http endpoint. Overrides telemetry.port. Default is 9105', default=None)
+    add_selector_args(parser)
+    args = parser.parse_args()
+    return args
+
+def main():
+    args = parse_args()
+    device_list_file = JunosDevice.device_list_file = args.file
+    try:
+        data = load_inventory(device_list_file, args)
+    except FileNotFoundError as err:
+        print("File not found. {}".format(err))
+        return
+    JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+    JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+    settings = data.get('telemetry') or {}
+    intervals = settings.get('intervals') or {}
+    names = args.rpc or [name for name in intervals if name in COLLECTORS] or list(COLLECTORS)
+    collectors = [COLLECTORS[name] for name in dict.fromkeys(names)]
+    devices = []
+    for device in data['devices'].keys():
+        name, ip, console, user, password = parse_device_data(data, device)
+        site, priority, timeout = parse_device_options(data, device)
+        devices.append(JunosDevice(name, user, password, ip, console, timeout))
+    # sessions have to outlive the longest poll interval
+    longest = max([v for v in intervals.values()] + [60])
+    JunosDevice.session_pool = SessionPool(max_sessions=len(devices), idle_timeout=max(300, 3 * longest))
+    events_dir = JunosDevice.dump_path + '/dumped_files/telemetry/'
+    os.makedirs(events_dir, exist_ok=True)
+    events_file = open(events_dir + 'events.jsonl', 'a', buffering=1)
+
+    def on_event(entry):
+        print("{timestamp} {device} {collector} {key} {event}: {old} -> {new}".format(**entry))
+        events_file.write(json.dumps(entry) + '\n')
+
+    workers = (data.get('concurrency') or {}).get('max_workers', 32)
+    poller = Poller(devices, collectors, intervals, settings.get('jitter', DEFAULT_JITTER), workers, on_event)
+    port = args.port or settings.get('port', 9105)
+    server = serve(poller, port, settings.get('address', ''))
+    print("Polling {} devices for {}. Metrics on port {}".format(len(devices), ', '.join(c.name for c in collectors), port))
+    signal.signal(signal.SIGTERM, lambda signum, frame: poller.stop())
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        poller.stop()
+    finally:
+        server.shutdown()
+        JunosDevice.session_pool.close_all()
+        events_file.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+import unittest
+import os, sys, shutil, tempfile, time
+sys.path.append( '/root/jberry/python/' )
+from utils.archive import ConfigArchive
+
+class TestConfigArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.archive = ConfigArchive(self.base)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_dedup(self):
+        d1 = self.archive.store('qfx1', 'set', 'set system host-name qfx\n')
+        d2 = self.archive.store('qfx2', 'set', 'set system host-name qfx\n')
+        self.assertEqual(d1, d2)
+        self.archive.store('qfx1', 'set', 'set system host-name qfx\n')
+        self.assertEqual(len(self.archive.versions('qfx1', 'set')), 1)
+        objects = [f for _, _, files in os.walk(self.base + '/dumped_files/archive/objects') for f in files]
+        self.assertEqual(len(objects), 1)
+
+    def test_materialize(self):
+        self.archive.store('qfx1', 'set', 'v1')
+        first = self.archive.versions('qfx1', 'set')[0]
+        self.archive.store('qfx1', 'set', 'v2')
+        self.assertEqual(self.archive.materialize('qfx1', 'set'), 'v2')
+        self.assertEqual(self.archive.materialize('qfx1', 'set', at=first['time']), 'v1')
+        self.assertEqual(self.archive.materialize('qfx1', 'set', at=first['time'] - 10), None)
+        self.assertEqual(self.archive.materialize('qfx1', 'text'), None)
+        self.assertEqual(self.archive.devices(), ['qfx1'])
+
+
+if __name__ == "__main__":
+    unittest.main()
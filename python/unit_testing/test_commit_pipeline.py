@@ -0,0 +1,86 @@
+import unittest
+import sys
+sys.path.append( '/root/jberry/python/' )
+from lxml import etree
+from utils.tables import extract, BGP_PEERS
+from utils.commit_pipeline import CommitPipeline, CONFIRMED, UNCHANGED, FAILED, ROLLED_BACK, NOT_STARTED
+
+def bgp_table(state):
+    return extract(etree.fromstring('<bgp-information><bgp-peer><peer-address>10.0.0.1</peer-address><peer-state>{}'
+                                    '</peer-state></bgp-peer></bgp-information>'.format(state)), BGP_PEERS)
+
+class FakeDevice:
+    def __init__(self, name, diff=1, commit=0, degrade=False):
+        self.name = name
+        self.diff = diff
+        self.commit = commit
+        self.degrade = degrade
+        self.calls = []
+        self.committed = False
+
+    def set_config(self, env_file, config_file_dir, template_path, dry, form, overwrite, rendered, skip=False, confirm=None):
+        self.calls.append(('set_config', dry, confirm))
+        if dry:
+            return self.diff, self.name, None
+        self.committed = self.commit == 0
+        return self.commit, self.name, None
+
+    def collect(self, collectors):
+        self.calls.append(('collect',))
+        state = 'Idle' if self.degrade and self.committed else 'Established'
+        return 0, {c.name: bgp_table(state) for c in collectors}
+
+    def confirm_commit(self):
+        self.calls.append(('confirm_commit',))
+        return 0
+
+    def rollback_commit(self, rb_id):
+        self.calls.append(('rollback_commit', rb_id))
+        return 0
+
+DATA = {'concurrency': {'retries': 0}}
+CONF = {'canary': 1, 'wave_size': 2, 'max_failures': 0, 'confirm_minutes': 3, 'settle': 0, 'health': ['bgp_sessions']}
+
+class TestCommitPipeline(unittest.TestCase):
+
+    def run_pipeline(self, devices, conf=CONF):
+        pipeline = CommitPipeline(DATA, [(d, None, None, 0) for d in devices], conf)
+        return pipeline.run(None, 'template.j2', 'text', True, {})
+
+    def test_all_confirmed(self):
+        devices = [FakeDevice('r1'), FakeDevice('r2', diff=0), FakeDevice('r3'), FakeDevice('r4')]
+        status = self.run_pipeline(devices)
+        self.assertEqual({name: s[0] for name, s in status.items()},
+                         {'r1': CONFIRMED, 'r2': UNCHANGED, 'r3': CONFIRMED, 'r4': CONFIRMED})
+        self.assertIn(('set_config', 0, 3), devices[0].calls)
+        self.assertIn(('confirm_commit',), devices[0].calls)
+        self.assertNotIn(('set_config', 0, 3), devices[1].calls)
+
+    def test_wave_rolled_back(self):
+        devices = [FakeDevice('r1'), FakeDevice('r2', degrade=True), FakeDevice('r3'), FakeDevice('r4')]
+        status = self.run_pipeline(devices, dict(CONF, canary=2))
+        self.assertEqual({name: s[0] for name, s in status.items()},
+                         {'r1': ROLLED_BACK, 'r2': ROLLED_BACK, 'r3': NOT_STARTED, 'r4': NOT_STARTED})
+        self.assertIn('bgp_sessions 10.0.0.1 changed', status['r2'][2])
+        self.assertIn(('rollback_commit', 1), devices[0].calls)
+        self.assertNotIn(('confirm_commit',), devices[0].calls)
+        self.assertEqual(devices[2].calls, [('set_config', 1, None)])
+
+    def test_failures_below_threshold(self):
+        devices = [FakeDevice('r1'), FakeDevice('r2', commit=-9), FakeDevice('r3')]
+        status = self.run_pipeline(devices, dict(CONF, max_failures=1))
+        self.assertEqual({name: s[0] for name, s in status.items()},
+                         {'r1': CONFIRMED, 'r2': FAILED, 'r3': CONFIRMED})
+
+    def test_timed_out_commit_not_retried(self):
+        # the commit may have gone through on the device, it rolls back by itself as it is never confirmed
+        devices = [FakeDevice('r1'), FakeDevice('r2', commit=-12)]
+        pipeline = CommitPipeline({'concurrency': {'retries': 2, 'backoff': 0}}, [(d, None, None, 0) for d in devices],
+                                  dict(CONF, max_failures=1))
+        status = pipeline.run(None, 'template.j2', 'text', True, {})
+        self.assertEqual({name: s[0] for name, s in status.items()}, {'r1': CONFIRMED, 'r2': FAILED})
+        self.assertEqual(devices[1].calls.count(('set_config', 0, 3)), 1)
+        self.assertNotIn(('confirm_commit',), devices[1].calls)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import sys, os, tempfile
+sys.path.append( '/root/jberry/python/' )
+from utils.config_index import ConfigIndex
+
+CONFIG = '''system {{
+    host-name {name};
+    services {{
+        ssh;
+        {telnet}
+    }}
+    ntp {{
+        server 10.0.0.{ntp};
+    }}
+}}
+interfaces {{
+    ge-0/0/0 {{
+        description "uplink to core";
+        unit 0 {{
+            family ethernet-switching {{
+                vlan {{
+                    members [ v100 {vlan} ];
+                }}
+            }}
+        }}
+    }}
+}}
+'''
+
+class TestConfigIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.index = ConfigIndex(self.dir.name)
+        self.files = []
+        for name, telnet, ntp, vlan in (('qfx1', 'telnet;', 1, 'v300'), ('qfx2', '', 1, 'v200'), ('qfx3', 'telnet;', 2, 'v300')):
+            file_name = os.path.join(self.dir.name, name + '.text')
+            with open(file_name, 'w') as f:
+                f.write(CONFIG.format(name=name, telnet=telnet, ntp=ntp, vlan=vlan))
+            self.files.append((name, file_name, None))
+        self.assertEqual(self.index.update_all(self.files), (3, 0, 0))
+
+    def tearDown(self):
+        self.index.close()
+        self.dir.cleanup()
+
+    def test_queries(self):
+        self.assertEqual([d for d, _ in self.index.has('system services telnet')], ['qfx1', 'qfx3'])
+        self.assertEqual(self.index.find('interfaces * unit * family ethernet-switching vlan members v300'),
+                         [('qfx1', 'interfaces ge-0/0/0 unit 0 family ethernet-switching vlan members v300'),
+                          ('qfx3', 'interfaces ge-0/0/0 unit 0 family ethernet-switching vlan members v300')])
+        self.assertEqual(len(self.index.find('interfaces * description "uplink*"')), 3)
+        self.assertEqual(self.index.values('system ntp server', {'qfx2', 'qfx3'}), [('qfx2', '10.0.0.1'), ('qfx3', '10.0.0.2')])
+        self.assertEqual(self.index.show('qfx2', 'system services'), [('qfx2', 'system services ssh')])
+
+    def test_incremental(self):
+        self.assertEqual(self.index.update_all(self.files), (0, 3, 0))
+        with open(self.files[1][1], 'w') as f:
+            f.write(CONFIG.format(name='qfx2', telnet='telnet;', ntp=1, vlan='v200'))
+        self.assertEqual(self.index.update_all(self.files), (1, 2, 0))
+        self.assertEqual([d for d, _ in self.index.has('system services telnet')], ['qfx1', 'qfx2', 'qfx3'])
+
+    def test_xml_backup(self):
+        file_name = os.path.join(self.dir.name, 'qfx4.xml')
+        with open(file_name, 'w') as f:
+            f.write('<rpc-reply><configuration><system><host-name>qfx4</host-name><services><telnet/></services>'
+                    '<syslog><file><name>messages</name><contents><name>any</name><notice/></contents></file></syslog>'
+                    '</system><interfaces><interface><name>ge-0/0/0</name><unit><name>0</name><family><ethernet-switching>'
+                    '<vlan><members>v300</members></vlan></ethernet-switching></family></unit></interface></interfaces>'
+                    '</configuration></rpc-reply>')
+        self.assertEqual(self.index.update_all([('qfx4', file_name, None)]), (1, 0, 0))
+        self.assertEqual([d for d, _ in self.index.has('system services telnet')], ['qfx1', 'qfx3', 'qfx4'])
+        self.assertEqual([d for d, _ in self.index.find('interfaces * unit * family ethernet-switching vlan members v300')],
+                         ['qfx1', 'qfx3', 'qfx4'])
+        self.assertEqual(self.index.values('system syslog file messages'), [('qfx4', 'any notice')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import sys, os, tempfile
+sys.path.append( '/root/jberry/python/' )
+from utils.config_tree import parse_text, parse_set, parse_xml, diff, diff_files
+
+TEXT = '''## Last commit: 2023-01-31 23:00:00 UTC by ops
+version 20.4R1;
+system {
+    host-name qfx1;
+    /* management */
+    services {
+        ssh;
+        inactive: telnet;
+    }
+}
+interfaces {
+    ge-0/0/0 {
+        description "uplink to core";
+        unit 0 {
+            family ethernet-switching {
+                vlan {
+                    members [ v100 v200 ];
+                }
+            }
+        }
+    }
+}
+'''
+
+SET = '''set version 20.4R1
+set system host-name qfx1
+set system services ssh
+set system services telnet
+deactivate system services telnet
+set interfaces ge-0/0/0 description "uplink to core"
+set interfaces ge-0/0/0 unit 0 family ethernet-switching vlan members v100
+set interfaces ge-0/0/0 unit 0 family ethernet-switching vlan members v200
+'''
+
+XML = '''<rpc-reply><configuration><version>20.4R1</version><system><host-name>qfx1</host-name><services><ssh/>
+<telnet inactive="inactive"/></services></system><interfaces><interface><name>ge-0/0/0</name>
+<description>uplink to core</description><unit><name>0</name><family><ethernet-switching><vlan>
+<members>v100</members><members>v200</members></vlan></ethernet-switching></family></unit></interface></interfaces>
+</configuration></rpc-reply>'''
+
+SYSLOG_SET = '''set system syslog user * any emergency
+set system syslog file messages any notice
+set system syslog file messages authorization info
+set security policies from-zone trust to-zone untrust policy allow-all match application any
+set security policies from-zone trust to-zone untrust policy allow-all then permit
+'''
+
+SYSLOG_XML = '''<configuration><system><syslog><user><name>*</name><contents><name>any</name><emergency/></contents></user>
+<file><name>messages</name><contents><name>any</name><notice/></contents><contents><name>authorization</name><info/>
+</contents></file></syslog></system><security><policies><policy><from-zone-name>trust</from-zone-name>
+<to-zone-name>untrust</to-zone-name><policy><name>allow-all</name><match><application>any</application></match>
+<then><permit/></then></policy></policy></policies></security></configuration>'''
+
+class TestConfigTree(unittest.TestCase):
+
+    def test_formats_compare_equal(self):
+        text = parse_text(TEXT)
+        self.assertEqual(text, parse_set(SET))
+        self.assertEqual(text, parse_xml(XML))
+        self.assertIn('set interfaces ge-0/0/0 unit 0 family ethernet-switching vlan members v200', text.set_lines())
+        self.assertIn('deactivate system services telnet', text.set_lines())
+
+    def test_hidden_xml_elements(self):
+        # syslog <contents> and the zone pair of security policies are not part of the set path
+        self.assertEqual(diff(parse_set(SYSLOG_SET), parse_xml(SYSLOG_XML)), [])
+        self.assertIn('set system syslog file messages any notice', parse_xml(SYSLOG_XML).set_lines())
+
+    def test_diff(self):
+        new = parse_text(TEXT.replace('host-name qfx1', 'host-name qfx2').replace('        ssh;\n', '')
+                         .replace('v200', 'v300'))
+        self.assertEqual(diff(parse_text(TEXT), new), [
+            '[edit interfaces ge-0/0/0 unit 0 family ethernet-switching vlan members]', '-  v200', '+  v300',
+            '[edit system]', '-  host-name qfx1', '+  host-name qfx2',
+            '[edit system services]', '-  ssh'])
+        self.assertEqual(diff(new, new), [])
+        self.assertEqual(diff(parse_text(TEXT).without(['system host-name']), new.without(['system host-name']))[3:],
+                         ['[edit system services]', '-  ssh'])
+
+    def test_diff_files(self):
+        with tempfile.TemporaryDirectory() as path:
+            golden = os.path.join(path, 'golden.set')
+            with open(golden, 'w') as f:
+                f.write(SET)
+            for name, contents in (('qfx1', TEXT), ('qfx2', TEXT.replace('ssh;', 'netconf;'))):
+                with open(os.path.join(path, name + '.text'), 'w') as f:
+                    f.write(contents)
+            results, _ = diff_files([(name, golden, os.path.join(path, name + '.text')) for name in ('qfx1', 'qfx2')],
+                                    path, workers=1)
+            self.assertEqual(results[0], ('qfx1', 0, 0, None, None))
+            self.assertEqual(results[1], ('qfx2', 1, 1, os.path.join(path, 'qfx2.diff'), None))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+from unittest.mock import MagicMock
+import sys, tempfile, threading, time
+sys.path.append( '/root/jberry/python/' )
+from utils.console import ConsoleManager, console_port
+from utils.junosDevice import JunosDevice
+from utils.scheduler import Scheduler
+
+class TestConsoleManager(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        JunosDevice.console_manager = None
+        self.dir.cleanup()
+
+    def manager(self, **kwargs):
+        return ConsoleManager(self.dir.name + '/', reuse=False, **kwargs)
+
+    def test_console_port(self):
+        self.assertEqual(console_port('ts1.lab.net:7027'), ('ts1.lab.net', 'ts1.lab.net:7027'))
+        self.assertIsNone(console_port('10.1.1.1'))
+        self.assertIsNone(console_port(None))
+
+    def test_port_busy_across_processes(self):
+        # a second manager stands in for another jberry process sharing the lock directory
+        first, second = self.manager(), self.manager()
+        self.assertEqual(first.acquire('ts1:7001'), 0)
+        self.assertEqual(second.acquire('ts1:7001'), -15)
+        self.assertEqual(second.acquire('ts1:7002'), 0)
+        first.release('ts1:7001')
+        self.assertEqual(second.acquire('ts1:7001'), 0)
+
+    def test_server_limit(self):
+        manager = self.manager(max_sessions_per_server=2, wait=0)
+        self.assertEqual(manager.acquire('ts1:7001'), 0)
+        self.assertEqual(manager.acquire('ts1:7002'), 0)
+        self.assertEqual(manager.acquire('ts1:7003'), -15)
+        self.assertEqual(manager.acquire('ts2:7003'), 0)
+        manager.release('ts1:7001')
+        self.assertEqual(manager.acquire('ts1:7003'), 0)
+
+    def test_busy_port_fails_fast(self):
+        JunosDevice.console_manager = self.manager()
+        holder = self.manager()
+        holder.acquire('ts1:7001')
+        JD = JunosDevice('r1', 'lab', 'lab123', None, 'ts1:7001')
+        JD.dev = MagicMock()
+        self.assertEqual(JD.connect(), -15)
+        JD.dev.open.assert_not_called()
+
+    def test_session_released(self):
+        JunosDevice.console_manager = self.manager()
+        JD = JunosDevice('r1', 'lab', 'lab123', None, 'ts1:7001')
+        JD.dev = MagicMock()
+        self.assertFalse(JD.connect())
+        self.assertEqual(self.manager().acquire('ts1:7001'), -15)
+        JD.disconnect()
+        self.assertEqual(self.manager().acquire('ts1:7001'), 0)
+
+    def test_kept_session_holds_port(self):
+        manager = ConsoleManager(self.dir.name + '/', max_sessions_per_server=1, reuse=True, wait=5)
+        JunosDevice.console_manager = manager
+        devs = []
+        def new_dev():
+            devs.append(MagicMock(connected=True))
+            return devs[-1]
+        JD1 = JunosDevice('r1', 'lab', 'lab123', None, 'ts1:7001')
+        JD2 = JunosDevice('r2', 'lab', 'lab123', None, 'ts1:7002')
+        for JD in (JD1, JD2):
+            JD._new_dev = new_dev
+        self.assertFalse(JD1.connect())
+        JD1.disconnect()
+        # the logged in session is kept, so the port and the terminal server slot stay taken
+        self.assertEqual(self.manager().acquire('ts1:7001'), -15)
+        self.assertFalse(JD1.connect())
+        JD1.disconnect()
+        self.assertEqual(len(devs), 1)
+        # another port of the same terminal server gets the slot of the idle session
+        self.assertFalse(JD2.connect())
+        devs[0].close.assert_called_once()
+        self.assertEqual(self.manager().acquire('ts1:7001'), 0)
+        JD2.disconnect()
+        manager.close_all()
+        devs[1].close.assert_called_once()
+        self.assertEqual(self.manager().acquire('ts1:7002'), 0)
+
+    def test_scheduler_console_limits(self):
+        lock = threading.Lock()
+        running = {'ts1': 0, 'max': 0, 'ports': set(), 'overlap': False}
+        def work(JD):
+            with lock:
+                running['ts1'] += 1
+                running['max'] = max(running['max'], running['ts1'])
+                running['overlap'] |= JD.ip in running['ports']
+                running['ports'].add(JD.ip)
+            time.sleep(0.05)
+            with lock:
+                running['ts1'] -= 1
+                running['ports'].discard(JD.ip)
+            return 0
+        scheduler = Scheduler(max_workers=8, console_limit=2)
+        for port in (7001, 7001, 7002, 7003, 7004):
+            scheduler.submit(work, MagicMock(ip='ts1:{}'.format(port)))
+        self.assertEqual([fu.result() for fu in scheduler.as_completed()], [0] * 5)
+        self.assertEqual(running['max'], 2)
+        self.assertFalse(running['overlap'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import sys, gzip, os, tempfile
+sys.path.append( '/root/jberry/python/' )
+from utils.diff_report import DiffGroups
+
+DIFF = '''
+[edit system]
+-  host-name {name};
++  host-name {name}-new;
+[edit system login user ops authentication]
++    encrypted-password "$6$abc{name}$xyz"; ## SECRET-DATA
+[edit interfaces lo0 unit 0 family inet]
++       address {ip}/32;
+'''
+
+class TestDiffReport(unittest.TestCase):
+
+    def write(self, path, name, ip, extra=''):
+        file_name = os.path.join(path, name + '.text')
+        with open(file_name, 'w') as f:
+            f.write(DIFF.format(name=name, ip=ip) + extra)
+        return file_name
+
+    def test_groups(self):
+        with tempfile.TemporaryDirectory() as path:
+            groups = DiffGroups()
+            a = groups.add('qfx1', self.write(path, 'qfx1', '10.0.0.1'), '10.0.0.1')
+            b = groups.add('qfx2', self.write(path, 'qfx2', '10.0.0.2'), '10.0.0.2')
+            c = groups.add('qfx3', self.write(path, 'qfx3', '10.0.0.3', '+ set snmp community public;\n'), '10.0.0.3')
+            self.assertEqual(a, b)
+            self.assertNotEqual(a, c)
+            self.assertIn('host-name <device>-new;', groups.groups[a]['diff'])
+            self.assertIn('address <device>/32;', groups.groups[a]['diff'])
+            summary = groups.summary()
+            self.assertIn('3 devices with a diff, 2 distinct diffs', summary)
+            self.assertIn('diff {}: 2 devices share this diff: qfx1 qfx2'.format(a), summary)
+            report = groups.write(os.path.join(path, 'diff_report.txt.gz'))
+            with gzip.open(report, 'rt') as f:
+                contents = f.read()
+            self.assertEqual(contents.count('host-name <device>-new;'), 2)
+            self.assertIn('  qfx3\n', contents)
+
+    def test_normalize(self):
+        groups = DiffGroups([['description "[^"]*"', 'description "<description>"']])
+        self.assertEqual(groups.normalize('+ address 10.0.0.11/32;\n+ address 10.0.0.1/32;', '10.0.0.1'),
+                         '+ address 10.0.0.11/32;\n+ address <device>/32;')
+        self.assertEqual(groups.normalize('+ description "uplink to qfx1";'), '+ description "<description>";')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import json, os, sys, shutil, tempfile
+sys.path.append( '/root/jberry/python/' )
+from utils.inventory import load, select
+
+INVENTORY = '''
+user: root
+password: juniper
+groups:
+  core: [mx1]
+devices:
+  mx1:
+  qfx1:
+    name: spine1
+    tags: [dc1, spine]
+  qfx2:
+    tags: dc2,leaf
+    group: core
+'''
+
+class TestInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.path = self.base + '/list.yml'
+        with open(self.path, 'w') as f:
+            f.write(INVENTORY)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_cache(self):
+        data = load(self.path)
+        self.assertTrue(os.path.exists(self.base + '/.list.yml.cache'))
+        self.assertEqual(load(self.path), data)
+        with open(self.path, 'a') as f:
+            f.write('  qfx3:\n')
+        self.assertIn('qfx3', load(self.path)['devices'])
+
+    def test_cache_is_private(self):
+        load(self.path)
+        cache = self.base + '/.list.yml.cache'
+        self.assertEqual(os.stat(cache).st_mode & 0o777, 0o600)
+        # a cache others could have written to is not trusted
+        with open(cache) as f:
+            cached = json.load(f)
+        cached['data']['devices']['rogue'] = None
+        with open(cache, 'w') as f:
+            json.dump(cached, f)
+        self.assertIn('rogue', load(self.path)['devices'])
+        os.chmod(cache, 0o666)
+        self.assertNotIn('rogue', load(self.path)['devices'])
+        self.assertEqual(os.stat(cache).st_mode & 0o777, 0o600)
+
+    def test_select(self):
+        data = load(self.path)
+        self.assertEqual(list(select(data, tags=['dc1,dc2'])['devices']), ['qfx1', 'qfx2'])
+        self.assertEqual(list(select(data, tags=['dc1,dc2', 'leaf'])['devices']), ['qfx2'])
+        self.assertEqual(list(select(data, groups=['core'])['devices']), ['mx1', 'qfx2'])
+        self.assertEqual(list(select(data, match='^spine')['devices']), ['qfx1'])
+        self.assertEqual(list(select(data, exclude='qfx')['devices']), ['mx1'])
+        self.assertEqual(len(data['devices']), 3)
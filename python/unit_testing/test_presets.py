@@ -0,0 +1,32 @@
+import unittest
+import sys
+sys.path.append( '/root/jberry/python/' )
+from utils.presets import config_filter, parse_xpath, preset_xpaths
+
+class TestPresets(unittest.TestCase):
+
+    def test_parse_xpath(self):
+        self.assertEqual(parse_xpath('interfaces/interface[name=ge-0/0/0]/unit[name=0]'),
+                         [('interfaces', None, None), ('interface', 'name', 'ge-0/0/0'), ('unit', 'name', '0')])
+        with self.assertRaises(ValueError):
+            parse_xpath('system//services')
+
+    def test_config_filter(self):
+        self.assertIsNone(config_filter(None))
+        self.assertEqual(config_filter(['system/services']), 'system/services')
+        self.assertEqual(config_filter(['system/services', 'system/login', 'snmp']),
+                         '<configuration><system><services/><login/></system><snmp/></configuration>')
+        # a hierarchy fetched as a whole makes the xpaths below it redundant, whichever comes first
+        self.assertEqual(config_filter(['system/services', 'system', 'system/login']), '<configuration><system/></configuration>')
+        self.assertEqual(config_filter(['interfaces/interface[name=ge-0/0/0]']),
+                         '<configuration><interfaces><interface><name>ge-0/0/0</name></interface></interfaces></configuration>')
+
+    def test_preset_xpaths(self):
+        data = {'presets': {'uplinks': ['interfaces/interface[name=et-0/0/48]', 'protocols/lldp']}}
+        self.assertEqual(preset_xpaths(data, ['uplinks', 'interfaces']),
+                         ['interfaces/interface[name=et-0/0/48]', 'protocols/lldp', 'interfaces'])
+        with self.assertRaises(KeyError):
+            preset_xpaths(data, ['missing'])
+
+if __name__ == '__main__':
+    unittest.main()
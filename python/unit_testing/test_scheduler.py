@@ -0,0 +1,133 @@
+import unittest
+from unittest.mock import MagicMock, patch
+import sys, threading, time
+from jnpr.junos.exception import ConnectError, ConnectAuthError
+sys.path.append( '/root/jberry/python/' )
+from utils.scheduler import Scheduler
+from utils.async_engine import AsyncScheduler
+from utils.shard import shard_inventory, _run_shard, exit_code
+from utils.junosDevice import JunosDevice
+
+class TestScheduler(unittest.TestCase):
+
+    def test_priority_order(self):
+        order = []
+        scheduler = Scheduler(max_workers=1)
+        for name, priority in [('a', 2), ('b', 0), ('c', 1)]:
+            scheduler.submit(order.append, name, priority=priority)
+        list(scheduler.as_completed())
+        self.assertEqual(order, ['b', 'c', 'a'])
+
+    def test_site_limit(self):
+        lock = threading.Lock()
+        running = {'dc1': 0, 'max': 0}
+        def work():
+            with lock:
+                running['dc1'] += 1
+                running['max'] = max(running['max'], running['dc1'])
+            time.sleep(0.05)
+            with lock:
+                running['dc1'] -= 1
+            return 0
+        scheduler = Scheduler(max_workers=8, site_limits={'dc1': 2})
+        for i in range(6):
+            scheduler.submit(work, site='dc1')
+        results = [fu.result() for fu in scheduler.as_completed()]
+        self.assertEqual(results, [0] * 6)
+        self.assertEqual(running['max'], 2)
+
+    def test_retry_on_connect_error_code(self):
+        fn = MagicMock(side_effect=[-2, (-12, 'qfx', None), 0])
+        scheduler = Scheduler(retries=2, backoff=0)
+        scheduler.submit(fn)
+        self.assertEqual([fu.result() for fu in scheduler.as_completed()], [0])
+        self.assertEqual(fn.call_count, 3)
+
+    def test_retries_exhausted(self):
+        fn = MagicMock(side_effect=ConnectError(MagicMock()))
+        scheduler = Scheduler(retries=1, backoff=0)
+        scheduler.submit(fn)
+        fu = next(scheduler.as_completed())
+        self.assertIsInstance(fu.exception(), ConnectError)
+        self.assertEqual(fn.call_count, 2)
+
+    def test_no_retry_on_auth_error(self):
+        fn = MagicMock(side_effect=ConnectAuthError(MagicMock()))
+        scheduler = Scheduler(retries=2, backoff=0)
+        scheduler.submit(fn)
+        list(scheduler.as_completed())
+        self.assertEqual(fn.call_count, 1)
+        fn = MagicMock(return_value=-1)
+        scheduler.submit(fn)
+        list(scheduler.as_completed())
+        self.assertEqual(fn.call_count, 1)
+
+
+class TestAsyncScheduler(unittest.TestCase):
+
+    def test_priority_and_retry(self):
+        order = []
+        scheduler = AsyncScheduler(max_workers=1, retries=1, backoff=0)
+        for name, priority in [('a', 1), ('b', 0)]:
+            scheduler.submit(order.append, name, priority=priority)
+        fn = MagicMock(side_effect=[-2, 0])
+        scheduler.submit(fn, priority=2)
+        results = [fu.result() for fu in scheduler.as_completed()]
+        self.assertEqual(order, ['b', 'a'])
+        self.assertEqual(results, [None, None, 0])
+        self.assertEqual(fn.call_count, 2)
+
+    def test_io_threads_limit(self):
+        lock = threading.Lock()
+        running = {'all': 0, 'max': 0, 'dc1': 0, 'dc1_max': 0}
+        def work(site):
+            with lock:
+                running['all'] += 1
+                running[site] = running.get(site, 0) + 1
+                running['max'] = max(running['max'], running['all'])
+                running['dc1_max'] = max(running['dc1_max'], running['dc1'])
+            time.sleep(0.05)
+            with lock:
+                running['all'] -= 1
+                running[site] -= 1
+        scheduler = AsyncScheduler(max_workers=2, io_threads=6, site_limits={'dc1': 2})
+        for i in range(12):
+            site = 'dc1' if i % 2 else 'dc2'
+            scheduler.submit(work, site, site=site)
+        list(scheduler.as_completed())
+        self.assertEqual(running['max'], 6)
+        self.assertEqual(running['dc1_max'], 2)
+
+
+class TestShardInventory(unittest.TestCase):
+
+    def test_shard_inventory(self):
+        data = {'user': 'root', 'password': 'x', 'devices': {'d%d' % i: None for i in range(5)},
+                'concurrency': {'max_workers': 10, 'sites': {'dc1': 3}}}
+        shards = shard_inventory(data, 2)
+        self.assertEqual([list(s['devices']) for s in shards], [['d0', 'd2', 'd4'], ['d1', 'd3']])
+        self.assertEqual(shards[0]['concurrency'], {'max_workers': 5, 'sites': {'dc1': 2}})
+        self.assertEqual(shards[1]['user'], 'root')
+        self.assertEqual(len(shard_inventory(data, 10)), 5)
+
+    def test_shard_failure_result(self):
+        data = {'user': 'root', 'password': 'x', 'devices': {'d0': None, 'd1': None}}
+        def set_config(*args):
+            if args[0] == 'd1.yml':
+                raise ValueError('boom')
+            return 0, 'd0', '/tmp/d0.set'
+        with patch.object(JunosDevice, 'set_config', side_effect=set_config):
+            results, _ = _run_shard(data, 'set_config', (), lambda name: name + '.yml', 'thread', '/tmp', 'list.yml', 'ts')
+        self.assertEqual(sorted(results), [('d0', (0, 'd0', '/tmp/d0.set')), ('d1', (-99, 'd1', None))])
+        self.assertEqual(exit_code(results), 1)
+
+    def test_shard_retry_codes(self):
+        data = {'user': 'root', 'password': 'x', 'devices': {'d0': None}, 'concurrency': {'retries': 2, 'backoff': 0}}
+        with patch.object(JunosDevice, 'set_config', return_value=(-12, 'd0', None)) as mocked:
+            results, _ = _run_shard(data, 'set_config', (), None, 'thread', '/tmp', 'list.yml', 'ts', retry_codes=(-2,))
+        self.assertEqual(results, [('d0', (-12, 'd0', None))])
+        self.assertEqual(mocked.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+import os, sys, json, shutil, tempfile
+sys.path.append( '/root/jberry/python/' )
+from lxml import etree
+from utils.tables import Table, extract, INTERFACES, BGP_PEERS
+
+INTERFACES_XML = '''<interface-information>
+<physical-interface><name>
+ge-0/0/0
+</name><admin-status>up</admin-status><oper-status>up</oper-status></physical-interface>
+<physical-interface><name>ge-0/0/1</name><oper-status>down</oper-status></physical-interface>
+<physical-interface><name>ge-0/0/2</name><admin-status>down</admin-status><oper-status>down</oper-status></physical-interface>
+</interface-information>'''
+
+class TestTables(unittest.TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def test_missing_element(self):
+        table = extract(etree.fromstring(INTERFACES_XML), INTERFACES)
+        self.assertEqual(table.rows(['name', 'admin_status', 'oper_status']),
+                         [('ge-0/0/0', 'up', 'up'), ('ge-0/0/1', None, 'down'), ('ge-0/0/2', 'down', 'down')])
+
+    def test_fleet(self):
+        fleet = Table(('device',) + tuple(INTERFACES[1]))
+        table = extract(etree.fromstring(INTERFACES_XML), INTERFACES)
+        fleet.extend(table, device='qfx1')
+        fleet.extend(table, device='qfx2')
+        fleet.extend(extract(etree.fromstring('<bgp-information/>'), BGP_PEERS), device='qfx3')
+        self.assertEqual(len(fleet), 6)
+        self.assertEqual(fleet.count('oper_status'), {'up': 2, 'down': 4})
+        fleet.to_jsonl(self.base + '/fleet.jsonl')
+        with open(self.base + '/fleet.jsonl') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[3]['device'], 'qfx2')
+        self.assertEqual(rows[3]['name'], 'ge-0/0/0')
+        fleet.to_csv(self.base + '/fleet.csv')
+        with open(self.base + '/fleet.csv') as f:
+            self.assertEqual(len(f.readlines()), 7)
@@ -0,0 +1,53 @@
+import unittest
+import sys, threading, time, urllib.request
+sys.path.append( '/root/jberry/python/' )
+from lxml import etree
+from utils.collectors import COLLECTORS
+from utils.tables import extract, BGP_PEERS
+from utils.telemetry import Poller, snapshot, changes, serve
+
+def bgp_table(*peers):
+    return extract(etree.fromstring('<bgp-information>' + ''.join(
+        '<bgp-peer><peer-address>{}</peer-address><peer-state>{}</peer-state></bgp-peer>'.format(p, s)
+        for p, s in peers) + '</bgp-information>'), BGP_PEERS)
+
+class FakeDevice:
+    def __init__(self, name, replies):
+        self.name = name
+        self.replies = replies
+        self.calls = 0
+
+    def collect(self, collectors):
+        self.calls += 1
+        reply = self.replies[min(self.calls, len(self.replies)) - 1]
+        return (0, {c.name: reply for c in collectors}) if reply is not None else (-2, {})
+
+class TestTelemetry(unittest.TestCase):
+
+    def test_changes(self):
+        collector = COLLECTORS['bgp_sessions']
+        old = snapshot(collector, bgp_table(('10.0.0.1', 'Established'), ('10.0.0.2', 'Established')))
+        new = snapshot(collector, bgp_table(('10.0.0.1', 'Active'), ('10.0.0.3', 'Connect')))
+        self.assertEqual(sorted(changes(old, new)), [('10.0.0.1', 'changed', ('Established',), ('Active',)),
+                                                     ('10.0.0.2', 'removed', ('Established',), None),
+                                                     ('10.0.0.3', 'added', None, ('Connect',))])
+        self.assertEqual(list(changes(new, new)), [])
+
+    def test_poller(self):
+        events = []
+        device = FakeDevice('qfx', [bgp_table(('10.0.0.1', 'Established')), bgp_table(('10.0.0.1', 'Established')),
+                                    bgp_table(('10.0.0.1', 'Idle')), None])
+        poller = Poller([device], [COLLECTORS['bgp_sessions']], {'bgp_sessions': 0.05}, on_event=events.append)
+        server = serve(poller, 0)
+        thread = threading.Thread(target=poller.run)
+        thread.start()
+        deadline = time.time() + 10
+        while device.calls < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        metrics = urllib.request.urlopen('http://127.0.0.1:{}/metrics'.format(server.server_address[1])).read().decode()
+        poller.stop()
+        thread.join()
+        server.shutdown()
+        self.assertEqual([(e['key'], e['event']) for e in events[:2]], [('10.0.0.1', 'changed'), (None, 'down')])
+        self.assertIn('jberry_bgp_peer_established{device="qfx",peer="10.0.0.1"} 0', metrics)
+        self.assertIn('# TYPE jberry_poll_errors_total counter', metrics)
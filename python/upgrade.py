@@ -4,53 +4,191 @@
 # Email: himanshu.surendra@gmail.com
 # usage : python3 upgrade.py <rpc> --f list1.yml
 
-import yaml
 import argparse
-import concurrent.futures
-from utils.utils import parse_device_data
-from utils.junosDevice import JunosDevice
+import json, re, threading, time
+from utils.utils import parse_device_data, parse_device_options
+from utils.scheduler import Scheduler
+from utils.junosDevice import JunosDevice, SessionPool
+from utils.throttle import Throttle
+from utils.waves import run_jobs, make_waves
+from utils.console import ConsoleManager
+from utils.inventory import load_inventory, add_selector_args
+from jnpr.junos.utils.sw import SW
 import os
 
+STAGED = 'staged'
+INSTALLED = 'installed'
+FAILED = 'failed'
+# an install that timed out (-12) may still be running or rebooting the device, running it again would install
+# twice. Only failures to connect, before anything is sent, are retried
+INSTALL_RETRY_CODES = (-2,)
+
 def parse_args():
     parser = argparse.ArgumentParser(description='''Upgrades junos devices reading from list.yml. The list.yml file needs
-                                    to have 'upgrade' section defined''')
+                                    to have 'upgrade' section defined. The image is first staged on every device (reusing
+                                    images already present, optionally copying from already staged peers), then installed in
+                                    waves: canary devices first, then batches of upgrade.wave_size devices''')
     parser.add_argument('--file','-f', help='A yaml formatted file to read list of devices from. Default is .list.yml', default = 'list.yml')
     parser.add_argument('--dry', '-d', type=int, help='''if set to 1,  "ONLY" prints list of devices that will be upgraded. 
                         Default is 1.
                         Explicitly specify this argument with value 0 to upgrade''', choices=[0,1], default = 1)
+    parser.add_argument('--resume', '-r', action='store_true', help='''Resume a previous run of the same package from its state file
+                        in dumped_files/upgrade/. Installed devices are skipped and staged devices are not copied again''')
+    parser.add_argument('--stage_only', action='store_true', help='Only stage the image on the devices, eg: ahead of a maintenance window')
+    add_selector_args(parser)
     args = parser.parse_args()
     return args
 
+class UpgradeState:
+    '''Per device progress of an upgrade, saved after every change so that a half finished run can be resumed.'''
+    def __init__(self, path, package, resume):
+        self.path = path
+        self.package = package
+        self.devices = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('package') == package:
+                self.devices = saved['devices']
+            else:
+                print("State file is for package {}. Starting a fresh run".format(saved.get('package')))
+
+    def get(self, name):
+        return self.devices.get(name, {}).get('state')
+
+    def set(self, name, state, ret=0):
+        with self._lock:
+            self.devices[name] = {'state': state, 'ret': ret, 'timestamp': time.strftime("%Y-%m-%d-%H-%M-%S")}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump({'package': self.package, 'devices': self.devices}, f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+
+def stage(data, devices, state, package, remote_path, checksum, checksum_algorithm, conf):
+    throttle = Throttle(conf['bandwidth_mbps']) if conf.get('bandwidth_mbps') else None
+    remote_package = remote_path.rstrip('/') + '/' + os.path.basename(package)
+    todo = [d for d in devices if state.get(d[0].name) not in (STAGED, INSTALLED)]
+    peers = [d[0] for d in devices if state.get(d[0].name) in (STAGED, INSTALLED) and ':' not in (d[0].ip or '')]
+    fanout_url = conf.get('fanout_url')
+    phases = [todo]
+    if fanout_url and not peers:
+        # seed a few devices from the jberry host, the rest copy from them
+        seeds = conf.get('fanout_seeds', 1)
+        phases = [todo[:seeds], todo[seeds:]]
+    for phase in phases:
+        jobs = []
+        for i, (JD, site, priority) in enumerate(phase):
+            source_url = None
+            if fanout_url and peers:
+                peer = peers[i % len(peers)]
+                source_url = fanout_url.format(user=peer.user, password=peer.password, peer=peer.ip, path=remote_package)
+            jobs.append((JD, site, priority, JD.stage_package,
+                         (package, remote_path, checksum, checksum_algorithm, throttle, source_url)))
+        for name, ret in run_jobs(data, jobs).items():
+            state.set(name, STAGED if ret == 0 else FAILED, ret)
+            print("{:<24} {}".format(name, "staged" if ret == 0 else "staging failed ({})".format(ret)))
+        peers += [d[0] for d in phase if state.get(d[0].name) == STAGED and ':' not in (d[0].ip or '')]
+
+def package_version(package, conf):
+    '''The release the devices run after the upgrade: upgrade.version, or taken from the package name, eg:
+    jinstall-ppc-16.1R6.7-signed.tgz or junos-install-mx-x86-64-21.4R3-S5.4.tgz'''
+    if conf.get('version'):
+        return conf['version']
+    match = re.search(r'-(\d+\.\d+[A-Z][\w.-]*?)(?:-signed|-limited)?\.(?:tgz|iso|img)$', os.path.basename(package))
+    return match.group(1) if match else None
+
+def install(data, devices, state, package, validate, checksum_algorithm, remote_path, conf):
+    version = package_version(package, conf)
+    if not version:
+        print("Can not tell the release of {} from its name. Set upgrade.version".format(package))
+        return False
+    staged = [d for d in devices if state.get(d[0].name) == STAGED]
+    max_failures = conf.get('max_failures', 0)
+    for number, wave in enumerate(make_waves(staged, conf.get('canary', 1), conf.get('wave_size', 10)), 1):
+        print("***WAVE {}: {}***".format(number, " ".join(d[0].name for d in wave)))
+        jobs = [(JD, site, priority, JD.install_package, (package, validate, checksum_algorithm, remote_path))
+                for JD, site, priority in wave]
+        failed = 0
+        rebooting = []
+        for name, ret in run_jobs(data, jobs, INSTALL_RETRY_CODES).items():
+            state.set(name, INSTALLED if ret == 0 else FAILED, ret)
+            print("{:<24} {}".format(name, "installed, rebooting" if ret == 0 else "install failed ({})".format(ret)))
+            failed += ret != 0
+            if ret == 0:
+                rebooting.append(name)
+        # the next wave only starts once this one is back on the new release
+        jobs = [(JD, site, priority, JD.wait_for_version,
+                 (version, conf.get('boot_timeout', 1800), conf.get('boot_poll_interval', 30)))
+                for JD, site, priority in wave if JD.name in rebooting]
+        if jobs:
+            print("***WAITING FOR WAVE {} TO BOOT {}***".format(number, version))
+        for name, ret in run_jobs(data, jobs, ()).items():
+            if ret:
+                state.set(name, FAILED, ret)
+            print("{:<24} {}".format(name, "running {}".format(version) if ret == 0 else
+                                     "not running {} ({})".format(version, ret)))
+            failed += ret != 0
+        if failed > max_failures:
+            print("***{} FAILURES IN WAVE {}. STOPPING. Fix and rerun with --resume***".format(failed, number))
+            return False
+    return True
+
 def main():
     args = parse_args()
     dry = args.dry
     device_list_file = JunosDevice.device_list_file = args.file
 
     try:
-        with open(device_list_file, 'r') as f:
-            data = yaml.safe_load(f)
-            package = data['upgrade']['package']
-            validate = data['upgrade']['validate']
-            checksum_algorithm = data['upgrade']['checksum_algorithm']
-            remote_path = data['upgrade']['remote_path']
-            print("***UPGRADE PACKAGE {}***".format(package))
-            print("***GETTING CURRENT VERSION***")
-            os.system("./get_facts.py -f {} -k version".format(device_list_file))
-            print("***FINISHED GETTING CURRENT VERSION***")
-            print("***STARTING UPGRADE***")
-            with concurrent.futures.ThreadPoolExecutor() as executor:
-                results = []
-                for device in data['devices'].keys():
-                    name, ip, console, user, password = parse_device_data(data, device)
-                    JD = JunosDevice(name, user, password, ip, console)
-                    results.append(executor.submit(JD.upgrade_junos, dry, package, validate, 
-                                                    checksum_algorithm, remote_path))
-                for fu in concurrent.futures.as_completed(results):
-                    fu.result()         
+        data = load_inventory(device_list_file, args)
+        conf = data['upgrade']
+        package = conf['package']
+        validate = conf['validate']
+        checksum_algorithm = conf['checksum_algorithm']
+        remote_path = conf['remote_path']
+        JunosDevice.dump_path = data.get('dump_path') or os.path.dirname(os.path.realpath(__file__))
+        JunosDevice.console_manager = ConsoleManager.from_inventory(data, JunosDevice.dump_path)
+        JunosDevice.facts_ttl = data.get('facts_ttl')
+        print("***UPGRADE PACKAGE {}***".format(package))
+        devices = []
+        for device in data['devices'].keys():
+            name, ip, console, user, password = parse_device_data(data, device)
+            site, priority, timeout = parse_device_options(data, device)
+            devices.append((JunosDevice(name, user, password, ip, console, timeout), site, priority))
+        devices.sort(key=lambda d: d[2])
+        # the version check, staging and install of a device share one session, install_package drops it on reboot
+        JunosDevice.session_pool = SessionPool(max_sessions=len(devices))
+        print("***GETTING CURRENT VERSION***")
+        scheduler = Scheduler.from_inventory(data)
+        versions = {scheduler.submit(JD.get_fact, 'version', site=site, priority=priority): JD.name
+                    for JD, site, priority in devices}
+        for fu in scheduler.as_completed():
+            print("{:<24} {}".format(versions[fu], fu.result()))
+        print("***FINISHED GETTING CURRENT VERSION***")
+        state = UpgradeState(JunosDevice.dump_path + '/dumped_files/upgrade/' + os.path.basename(device_list_file) +
+                             '.state.json', package, args.resume)
+        if dry:
+            staged = [d for d in devices if state.get(d[0].name) == STAGED]
+            pending = [d for d in devices if state.get(d[0].name) not in (INSTALLED,)]
+            for number, wave in enumerate(make_waves(pending, conf.get('canary', 1), conf.get('wave_size', 10)), 1):
+                print("WAVE {}: {}".format(number, " ".join(d[0].name for d in wave)))
+            print("{} devices already staged. Dry run completed. To skip dry run pass agrument '-d 0'".format(len(staged)))
+            return
+        print("***STAGING IMAGE***")
+        checksum = SW.local_checksum(package, algorithm=checksum_algorithm)
+        stage(data, devices, state, package, remote_path, checksum, checksum_algorithm, conf)
+        if args.stage_only:
+            return
+        print("***STARTING UPGRADE***")
+        if install(data, devices, state, package, validate, checksum_algorithm, remote_path, conf):
+            print("***UPGRADE FINISHED***")
     except FileNotFoundError as err:
         print("File not found. {}".format(err))
     except Exception as err:
         print("Exception Caught: {}".format(err))
+    finally:
+        if JunosDevice.session_pool is not None:
+            JunosDevice.session_pool.close_all()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,97 @@
+import gzip, hashlib, json, os, time
+
+TIME_FORMAT = "%Y-%m-%d-%H-%M-%S"
+
+
+class ConfigArchive:
+    '''
+    Content addressed store for config backups under <dump_path>/dumped_files/archive/.
+    Every distinct config is stored once as a gzip compressed blob named after its sha256
+    (objects/<2 char prefix>/<sha256>.gz) and each device keeps an append only version index
+    (devices/<device name>.jsonl) that only grows when the device's config actually changes.
+    '''
+    def __init__(self, base_path):
+        self.root = base_path + '/' + 'dumped_files/archive/'
+        os.makedirs(self.root + 'objects/', exist_ok=True)
+        os.makedirs(self.root + 'devices/', exist_ok=True)
+
+    def object_path(self, digest):
+        return self.root + 'objects/' + digest[:2] + '/' + digest + '.gz'
+
+    def __index_path(self, name):
+        return self.root + 'devices/' + name + '.jsonl'
+
+    def store(self, name, form, contents, conf_xpath=None):
+        data = contents.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.' + str(os.getpid()) + '.tmp'
+            with gzip.open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        self.__add_version(name, form, conf_xpath, digest)
+        return digest
+
+    def store_file(self, name, form, file_name, conf_xpath=None, chunk_size=1024 * 1024):
+        '''Same as store for a config already written to file_name. The file is hashed and compressed
+        in chunks and removed afterwards.'''
+        sha = hashlib.sha256()
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.' + str(os.getpid()) + '.tmp'
+            with open(file_name, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+                for chunk in iter(lambda: src.read(chunk_size), b''):
+                    dst.write(chunk)
+            os.replace(tmp, path)
+        os.remove(file_name)
+        self.__add_version(name, form, conf_xpath, digest)
+        return digest
+
+    def staging_path(self, name, form):
+        os.makedirs(self.root + 'staging/', exist_ok=True)
+        return self.root + 'staging/' + name + '.' + form + '.' + str(os.getpid()) + '.tmp'
+
+    def __add_version(self, name, form, conf_xpath, digest):
+        latest = self.versions(name, form, conf_xpath)
+        if latest and latest[-1]['sha256'] == digest:
+            return
+        entry = {'timestamp': time.strftime(TIME_FORMAT), 'time': time.time(), 'format': form,
+                 'filter': conf_xpath, 'sha256': digest}
+        with open(self.__index_path(name), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def devices(self):
+        return sorted(f[:-len('.jsonl')] for f in os.listdir(self.root + 'devices/') if f.endswith('.jsonl'))
+
+    def versions(self, name, form=None, conf_xpath=None):
+        try:
+            with open(self.__index_path(name), 'r') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+        return [e for e in entries if (form is None or e['format'] == form) and e['filter'] == conf_xpath]
+
+    def version_at(self, name, form, at=None, conf_xpath=None):
+        '''Returns the version that was current at the given time ("YYYY-mm-dd-HH-MM-SS" or epoch seconds),
+        or the latest version when at is None.'''
+        if isinstance(at, str):
+            at = time.mktime(time.strptime(at, TIME_FORMAT))
+        candidates = [e for e in self.versions(name, form, conf_xpath) if at is None or e['time'] <= at]
+        return candidates[-1] if candidates else None
+
+    def read(self, digest):
+        with gzip.open(self.object_path(digest), 'rb') as f:
+            return f.read().decode()
+
+    def materialize(self, name, form, at=None, conf_xpath=None):
+        version = self.version_at(name, form, at, conf_xpath)
+        if version is None:
+            return None
+        return self.read(version['sha256'])
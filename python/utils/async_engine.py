@@ -0,0 +1,89 @@
+import asyncio, contextlib, heapq, logging, queue, threading
+import concurrent.futures
+from .scheduler import Scheduler, DEFAULT_MAX_WORKERS
+from .console import DEFAULT_MAX_SESSIONS_PER_SERVER
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncScheduler(Scheduler):
+    '''
+    asyncio based drop-in for Scheduler. Waiting, backoff and the global/per-site limits are handled by
+    the event loop instead of one polling thread per task, and each blocking PyEZ session is bridged onto
+    a separate pool of io_threads. io_threads (concurrency.io_threads in the inventory, max_workers when not set)
+    is also the limit on sessions in flight, so raising it lets a single process keep many more sessions open
+    than the thread engine's worker count. Site and console limits apply as with the thread engine.
+    '''
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, site_limits=None, retries=2, backoff=5, io_threads=None,
+                 console_limit=DEFAULT_MAX_SESSIONS_PER_SERVER):
+        super().__init__(max_workers, site_limits, retries, backoff, console_limit)
+        self.io_threads = io_threads or max_workers
+
+    @classmethod
+    def from_inventory(cls, data):
+        conf = data.get('concurrency') or {}
+        return cls(max_workers=conf.get('max_workers', DEFAULT_MAX_WORKERS), site_limits=conf.get('sites'),
+                   retries=conf.get('retries', 2), backoff=conf.get('backoff', 5),
+                   io_threads=conf.get('io_threads'),
+                   console_limit=(data.get('console') or {}).get('max_sessions_per_server', DEFAULT_MAX_SESSIONS_PER_SERVER))
+
+    def as_completed(self):
+        done = queue.Queue()
+        thread = threading.Thread(target=asyncio.run, args=(self._run(done),), daemon=True)
+        thread.start()
+        while True:
+            fu = done.get()
+            if fu is None:
+                break
+            yield fu
+        thread.join()
+
+    async def _run(self, done):
+        try:
+            loop = asyncio.get_running_loop()
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.io_threads)
+            loop.set_default_executor(executor)
+            # every session in flight holds one io thread while it blocks in PyEZ
+            limit = asyncio.Semaphore(self.io_threads)
+            sites = {site: asyncio.Semaphore(n) for site, n in self.site_limits.items()}
+            self._servers = {}
+            self._ports = {}
+            tasks = []
+            # semaphores wake waiters in FIFO order, so creating the coroutines in priority order is enough
+            while self._pending:
+                task = heapq.heappop(self._pending)[-1]
+                tasks.append(asyncio.create_task(self._run_task(task, limit, sites.get(task.site), done)))
+            await asyncio.gather(*tasks)
+            executor.shutdown(wait=True)
+        finally:
+            done.put(None)
+
+    def _console_limits(self, task):
+        if not task.console:
+            return contextlib.nullcontext(), contextlib.nullcontext()
+        server, port = task.console
+        if server not in self._servers:
+            self._servers[server] = asyncio.Semaphore(self.console_limit) if self.console_limit else contextlib.nullcontext()
+        return self._ports.setdefault(port, asyncio.Lock()), self._servers[server]
+
+    async def _run_task(self, task, limit, site_limit, done):
+        port_lock, server_limit = self._console_limits(task)
+        while True:
+            task.attempt += 1
+            result = err = None
+            async with port_lock, server_limit, site_limit or contextlib.nullcontext(), limit:
+                try:
+                    result = await asyncio.to_thread(task.fn, *task.args, **task.kwargs)
+                except Exception as e:
+                    err = e
+            if self.should_retry(task, result, err):
+                delay = self.backoff * 2 ** (task.attempt - 1)
+                logger.info(f'[{task.name}]: Retrying in {delay}s (attempt {task.attempt + 1}).')
+                await asyncio.sleep(delay)
+                continue
+            if err:
+                task.future.set_exception(err)
+            else:
+                task.future.set_result(result)
+            done.put(task.future)
+            return
@@ -0,0 +1,39 @@
+import json, os, time
+
+
+class BackupIndex:
+    '''
+    Remembers the config fingerprint and file of the last backup taken for every device so that
+    get_config can skip devices that have not committed since. One small json file is kept per device
+    under <dump_path>/dumped_files/config/.index/ which keeps concurrent writers (threads or shards)
+    from stepping on each other.
+    '''
+    def __init__(self, base_path):
+        self.index_dir = base_path + '/' + 'dumped_files/config/.index/'
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def __path(self, name):
+        return self.index_dir + name + '.json'
+
+    def load(self, name):
+        try:
+            with open(self.__path(name), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, name, key):
+        return self.load(name).get(key)
+
+    def update(self, name, key, fingerprint, file_name):
+        entries = self.load(name)
+        entries[key] = {'fingerprint': fingerprint, 'file': file_name,
+                        'timestamp': time.strftime("%Y-%m-%d-%H-%M-%S")}
+        tmp = self.__path(name) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp, self.__path(name))
+
+    def is_unchanged(self, name, key, fingerprint):
+        last = self.get(name, key)
+        return bool(fingerprint and last and last['fingerprint'] == fingerprint and os.path.exists(last['file']))
@@ -0,0 +1,79 @@
+from .timing import phase
+from .tables import Table, extract, INTERFACES, INTERFACES_TERSE, BGP_PEERS, LLDP_NEIGHBORS, ROUTE_SUMMARY, CHASSIS_ALARMS
+
+COLLECTORS = {}
+
+
+class Collector:
+    '''
+    An operational state collector: the rpc to run, how to tabulate its reply (see utils/tables.py), the
+    columns printed per device as (column, header, width), the columns counted in the fleet summary and the
+    column that identifies a row (eg: the interface name) when tracking changes between polls. scope is the rpc
+    argument that limits the rpc to one interface, when it has one.
+    '''
+    def __init__(self, name, rpc, spec, display, summary, key, scope=None, **rpc_args):
+        self.name = name
+        self.scope = scope
+        self.key = key
+        self.rpc = rpc
+        self.spec = spec
+        self.display = display
+        self.summary = summary
+        self.rpc_args = rpc_args
+
+    def __repr__(self):
+        return f'Collector({self.name})'
+
+    def collect(self, dev):
+        with phase('rpc', collector=self.name):
+            reply = getattr(dev.rpc, self.rpc)(**self.rpc_args)
+        return self.parse(reply)
+
+    def parse(self, reply):
+        with phase('parse', collector=self.name):
+            return extract(reply, self.spec)
+
+    def requests(self, interfaces=None):
+        '''(rpc, rpc args) to run, one per interface when the collector can be limited to the given interfaces.'''
+        if not (interfaces and self.scope):
+            return [(self.rpc, self.rpc_args)]
+        return [(self.rpc, dict(self.rpc_args, **{self.scope: interface})) for interface in interfaces]
+
+    def merge(self, replies):
+        '''One table from the replies to requests(), or the error code when none of them succeeded.'''
+        tables = [self.parse(reply) for reply in replies if not isinstance(reply, int)]
+        if not tables:
+            return replies[0]
+        if len(tables) == 1:
+            return tables[0]
+        table = Table(self.spec[1])
+        for t in tables:
+            table.extend(t)
+        return table
+
+
+def register(collector):
+    COLLECTORS[collector.name] = collector
+    return collector
+
+
+register(Collector('interfaces_list', 'get_interface_information', INTERFACES_TERSE,
+                   [('name', 'Interface Name', 16), ('admin_status', 'Admin State', 13),
+                    ('oper_status', 'Operational State', 15)], ('admin_status', 'oper_status'), 'name',
+                   scope='interface_name', terse=True))
+register(Collector('interfaces_detail', 'get_interface_information', INTERFACES,
+                   [('name', 'Interface Name', 16), ('admin_status', 'Admin State', 13),
+                    ('oper_status', 'Operational State', 15), ('speed', 'Speed', 10), ('mtu', 'MTU', 8),
+                    ('description', 'Description', 30)], ('admin_status', 'oper_status', 'speed'), 'name',
+                   scope='interface_name'))
+register(Collector('bgp_sessions', 'get_bgp_summary_information', BGP_PEERS,
+                   [('peer_address', 'BGP Peer Name', 16), ('state', 'State', 10)], ('state',), 'peer_address'))
+register(Collector('lldp_neighbors', 'get_lldp_neighbors_information', LLDP_NEIGHBORS,
+                   [('local_port', 'Local Port', 16), ('remote_system', 'Remote System', 30),
+                    ('remote_port', 'Remote Port', 16)], ('remote_system',), 'local_port'))
+register(Collector('route_summary', 'get_route_summary_information', ROUTE_SUMMARY,
+                   [('table', 'Table', 24), ('destinations', 'Destinations', 13), ('active', 'Active', 10),
+                    ('hidden', 'Hidden', 10)], ('table',), 'table'))
+register(Collector('chassis_alarms', 'get_alarm_information', CHASSIS_ALARMS,
+                   [('class', 'Class', 8), ('time', 'Time', 26), ('description', 'Description', 40)],
+                   ('class', 'description'), 'description'))
@@ -0,0 +1,142 @@
+import logging, time
+from .collectors import COLLECTORS
+from .telemetry import snapshot, changes
+from .waves import run_jobs, make_waves
+
+logger = logging.getLogger(__name__)
+
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+CONFIRMED = 'confirmed'
+ROLLED_BACK = 'rolled back'
+NOT_STARTED = 'not started'
+
+# snapshot changes that count as a degradation per collector. New rows are only bad news for alarms
+DEGRADED = {'chassis_alarms': ('added',)}
+DEFAULT_DEGRADED = ('changed', 'removed')
+# a commit or rollback that timed out (-12) may still have gone through on the device, running it again would
+# commit twice or roll back one change too many. Only failures to connect, before anything is sent, are retried
+COMMIT_RETRY_CODES = (-2,)
+
+
+class CommitPipeline:
+    '''
+    Pushes a config change to a fleet in waves (inventory section "commit"). The config is loaded and diffed
+    on every device in parallel first, then the devices with a diff are committed with commit confirmed a
+    wave at a time (canary devices first). After settle seconds every device of the wave is health checked
+    against a snapshot of the health collectors taken before the commit. A wave with more than max_failures
+    failed or degraded devices is rolled back in parallel and the run stops, otherwise the wave is confirmed.
+    Devices that cannot be reached any more roll back by themselves after confirm_minutes.
+    '''
+    def __init__(self, data, devices, conf=None):
+        conf = conf or {}
+        self.data = data
+        self.devices = devices
+        self.canary = conf.get('canary', 1)
+        self.wave_size = conf.get('wave_size', 10)
+        self.max_failures = conf.get('max_failures', 0)
+        self.confirm_minutes = conf.get('confirm_minutes', 5)
+        self.settle = conf.get('settle', 30)
+        self.collectors = [COLLECTORS[name] for name in conf.get('health', [])]
+        self.status = {}
+
+    def _set(self, name, status, ret, detail=''):
+        self.status[name] = (status, ret, detail)
+        print("{:<24} {:<12} {}".format(name, status, detail or ret))
+
+    def prepare(self, config_file_dir, template_path, form, overwrite, rendered):
+        '''Loads and diffs the config on every device in parallel. Returns the devices that have a diff.'''
+        jobs = [(JD, site, priority, JD.set_config, (env_file, config_file_dir, template_path, 1, form, overwrite,
+                                                     rendered.get(JD.name)))
+                for JD, env_file, site, priority in self.devices]
+        results = run_jobs(self.data, jobs)
+        targets = []
+        for device in self.devices:
+            ret = results[device[0].name][0]
+            if ret == 1:
+                targets.append(device)
+            elif ret == 0:
+                self._set(device[0].name, UNCHANGED, ret)
+            else:
+                self._set(device[0].name, FAILED, ret, 'load or diff failed ({})'.format(ret))
+        return targets
+
+    def health(self, wave):
+        '''{device name: (ret, {collector name: snapshot})}. Only checks reachability without health collectors.'''
+        jobs = [(JD, site, priority, JD.collect, (self.collectors,)) for JD, _, site, priority in wave]
+        health = {}
+        for name, (ret, tables) in run_jobs(self.data, jobs).items():
+            health[name] = (ret, {c.name: snapshot(c, tables[c.name]) for c in self.collectors
+                                  if not isinstance(tables.get(c.name, -3), int)})
+        return health
+
+    def degraded(self, before, after):
+        '''Reasons the state after the commit is worse than before it. Empty when it is not.'''
+        reasons = []
+        for collector, old in before.items():
+            if collector not in after:
+                reasons.append('{} failed'.format(collector))
+                continue
+            bad = DEGRADED.get(collector, DEFAULT_DEGRADED)
+            reasons += ['{} {} {}'.format(collector, key, event) for key, event, _, _ in changes(old, after[collector])
+                        if event in bad]
+        return reasons
+
+    def run_wave(self, wave, config_file_dir, template_path, form, overwrite, rendered):
+        '''Commits, checks and confirms or rolls back one wave. Returns False when the wave was rolled back.'''
+        baseline = self.health(wave)
+        jobs = [(JD, site, priority, JD.set_config, (env_file, config_file_dir, template_path, 0, form, overwrite,
+                                                     rendered.get(JD.name), False, self.confirm_minutes))
+                for JD, env_file, site, priority in wave]
+        results = run_jobs(self.data, jobs, COMMIT_RETRY_CODES)
+        committed = [d for d in wave if results[d[0].name][0] >= 0]
+        failures = {d[0].name: 'commit failed ({})'.format(results[d[0].name][0]) for d in wave if d not in committed}
+        if committed:
+            logger.info(f'Waiting {self.settle}s for {len(committed)} devices to settle')
+            time.sleep(self.settle)
+            after = self.health(committed)
+            for JD, _, _, _ in committed:
+                ret, snapshots = after[JD.name]
+                reasons = ['unreachable ({})'.format(ret)] if ret else self.degraded(baseline[JD.name][1], snapshots)
+                if reasons:
+                    failures[JD.name] = ', '.join(reasons[:5]) + (' ...' if len(reasons) > 5 else '')
+        if len(failures) > self.max_failures:
+            jobs = [(JD, site, priority, JD.rollback_commit, (1,)) for JD, _, site, priority in committed]
+            for name, ret in run_jobs(self.data, jobs, COMMIT_RETRY_CODES).items():
+                detail = failures.get(name, 'wave rolled back')
+                if ret:
+                    detail += '. Rollback failed ({}), the device rolls back by itself in {} minutes'.format(
+                        ret, self.confirm_minutes)
+                self._set(name, ROLLED_BACK, ret, detail)
+            for JD, _, _, _ in wave:
+                if JD.name not in self.status:
+                    self._set(JD.name, FAILED, results[JD.name][0], failures[JD.name])
+            return False
+        jobs = [(JD, site, priority, JD.confirm_commit, ()) for JD, _, site, priority in committed
+                if JD.name not in failures]
+        for name, ret in run_jobs(self.data, jobs).items():
+            if ret:
+                self._set(name, FAILED, ret, 'confirm failed, the device rolls back by itself in {} minutes'.format(
+                    self.confirm_minutes))
+            else:
+                self._set(name, CONFIRMED, ret)
+        for name, detail in failures.items():
+            # below the threshold: the device is left to roll back by itself when the timer expires
+            self._set(name, FAILED, results[name][0], detail + '. Not confirmed')
+        return True
+
+    def run(self, config_file_dir, template_path, form, overwrite, rendered=None):
+        '''Runs the whole pipeline. Returns {device name: (status, ret, detail)}.'''
+        rendered = rendered or {}
+        print("***LOADING AND DIFFING ON {} DEVICES***".format(len(self.devices)))
+        targets = self.prepare(config_file_dir, template_path, form, overwrite, rendered)
+        waves = make_waves(targets, self.canary, self.wave_size)
+        for number, wave in enumerate(waves, 1):
+            print("***WAVE {}/{}: {}***".format(number, len(waves), " ".join(d[0].name for d in wave)))
+            if not self.run_wave(wave, config_file_dir, template_path, form, overwrite, rendered):
+                print("***TOO MANY FAILURES IN WAVE {}. WAVE ROLLED BACK, STOPPING***".format(number))
+                for later in waves[number:]:
+                    for device in later:
+                        self._set(device[0].name, NOT_STARTED, None)
+                break
+        return self.status
@@ -0,0 +1,123 @@
+import hashlib, logging, os, re, sqlite3, time
+from .config_tree import PARSERS, detect_format, read_file, split
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS devices (name TEXT PRIMARY KEY, file TEXT, sha256 TEXT, statements INTEGER, indexed TEXT);
+CREATE TABLE IF NOT EXISTS statements (device TEXT, path TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS statements_path ON statements (path);
+CREATE INDEX IF NOT EXISTS statements_value ON statements (value);
+CREATE INDEX IF NOT EXISTS statements_device ON statements (device);
+'''
+_LINE = "trim(path || ' ' || value)"
+_GLOB = re.compile(r'[*?\[]')
+
+
+def _under(prefix):
+    # statements at or below a hierarchy, as ranges the path index can serve
+    return "(path = ? OR (path >= ? AND path < ?))", [prefix, prefix + ' ', prefix + '!']
+
+
+class ConfigIndex:
+    '''
+    Inverted index of the latest backup of every device in SQLite (<dump_path>/dumped_files/config_index.db).
+    Every set statement is stored as its hierarchy path (all tokens but the last) and value (the last token),
+    both indexed, so "which devices have system services telnet" or "which devices use vlan v300" are answered
+    from the index. A device is only parsed and rewritten when its config file changed since it was indexed.
+    '''
+    def __init__(self, base_path):
+        self.path = base_path + '/' + 'dumped_files/config_index.db'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def update(self, name, file_name, form=None):
+        '''Indexes a device's config file. Returns the number of statements, or None when it is already indexed.'''
+        text = read_file(file_name)
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        row = self.db.execute('SELECT sha256 FROM devices WHERE name = ?', (name,)).fetchone()
+        if row and row[0] == digest:
+            return None
+        config = PARSERS[form or detect_format(file_name)](text)
+        with self.db:
+            self.db.execute('DELETE FROM statements WHERE device = ?', (name,))
+            self.db.executemany('INSERT INTO statements VALUES (?, ?, ?)',
+                                ((name, ' '.join(line[:-1]), line[-1]) for line in config.lines))
+            self.db.execute('INSERT OR REPLACE INTO devices VALUES (?, ?, ?, ?, ?)',
+                            (name, file_name, digest, len(config), time.strftime("%Y-%m-%d-%H-%M-%S")))
+        return len(config)
+
+    def update_all(self, files):
+        '''Indexes (device name, config file, format or None) entries. Returns (indexed, unchanged, failed) counts.'''
+        indexed = unchanged = failed = 0
+        for name, file_name, form in files:
+            try:
+                if self.update(name, file_name, form) is None:
+                    unchanged += 1
+                else:
+                    indexed += 1
+            except Exception as err:
+                logger.error(f'[{name}]: Could not index {file_name}. {err}')
+                failed += 1
+        return indexed, unchanged, failed
+
+    def remove(self, name):
+        with self.db:
+            self.db.execute('DELETE FROM statements WHERE device = ?', (name,))
+            self.db.execute('DELETE FROM devices WHERE name = ?', (name,))
+
+    def devices(self):
+        return self.db.execute('SELECT name, statements, indexed, file FROM devices ORDER BY name').fetchall()
+
+    def __query(self, where, params, devices=None):
+        sql = f'SELECT device, {_LINE} FROM statements WHERE {where}'
+        rows = self.db.execute(sql + ' ORDER BY device, path, value', params).fetchall()
+        return [r for r in rows if devices is None or r[0] in devices]
+
+    def has(self, statement, devices=None):
+        '''[(device, line)] for the statement itself and everything configured below it.'''
+        tokens = split(statement)
+        where, params = _under(' '.join(tokens))
+        where = f"({where} OR (path = ? AND value = ?))"
+        return self.__query(where, params + [' '.join(tokens[:-1]), tokens[-1]], devices)
+
+    def find(self, pattern, devices=None):
+        '''
+        [(device, line)] for statements matching a glob pattern, eg: "interfaces * unit * family ethernet-switching
+        vlan members v300". A literal last token is looked up in the value index, otherwise the literal leading
+        tokens narrow down the hierarchy.
+        '''
+        tokens = split(pattern)
+        # quotes are left out of the match so that "uplink*" finds description "uplink to core"
+        where, params = f"replace({_LINE}, '\"', '') GLOB ?", [' '.join(tokens).replace('"', '')]
+        prefix = []
+        for token in tokens[:-1]:
+            if _GLOB.search(token):
+                break
+            prefix.append(token)
+        if tokens and not _GLOB.search(tokens[-1]):
+            where, params = 'value = ? AND ' + where, [tokens[-1]] + params
+        elif prefix:
+            under, under_params = _under(' '.join(prefix))
+            where, params = under + ' AND ' + where, under_params + params
+        return self.__query(where, params, devices)
+
+    def values(self, hierarchy, devices=None):
+        '''[(device, value)] configured below a hierarchy, eg: "system ntp server" gives the ntp servers.'''
+        hierarchy = ' '.join(split(hierarchy))
+        where, params = _under(hierarchy)
+        return [(device, line[len(hierarchy):].strip()) for device, line in self.__query(where, params, devices)]
+
+    def show(self, name, hierarchy=''):
+        '''[(device, line)] of one device, optionally only below a hierarchy.'''
+        hierarchy = ' '.join(split(hierarchy))
+        if not hierarchy:
+            return self.__query('device = ?', [name])
+        where, params = _under(hierarchy)
+        return self.__query('device = ? AND ' + where, [name] + params)
@@ -0,0 +1,316 @@
+import concurrent.futures
+import gzip, logging, os, re, time
+from collections import Counter
+from xml.sax.saxutils import unescape
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r'"(?:\\.|[^"\\])*"|#[^\n]*|[{};\[\]]|[^\s{};\[\]"]+')
+_ANNOTATION = re.compile(r'/\*.*?\*/', re.S)
+_PLAIN = re.compile(r'^[^\s"{};\[\]#]+$')
+_PREFIXES = ('inactive:', 'protect:', 'replace:', 'active:')
+# junos list entries whose element name is not part of the set path, eg: <interfaces><interface><name>ge-0/0/0
+# is "interfaces ge-0/0/0" while <unit><name>0 is "unit 0"
+_UNNAMED = {('interfaces', 'interface'), ('vlans', 'vlan'), ('routing-instances', 'instance'),
+            ('bridge-domains', 'domain'),
+            # syslog facilities, eg: <file><name>messages</name><contents><name>any</name><notice/> is "file messages any notice"
+            ('file', 'contents'), ('host', 'contents'), ('user', 'contents'), ('console', 'contents')}
+# list entries keyed by several elements, eg: <policies><policy><from-zone-name>trust</from-zone-name><to-zone-name>
+# untrust</to-zone-name> is "policies from-zone trust to-zone untrust"
+_COMPOUND = {('policies', 'policy'): (('from-zone-name', 'from-zone'), ('to-zone-name', 'to-zone'))}
+
+
+def _canonical(token):
+    '''Quotes a value only where junos would, so "foo" and foo or an xml value compare equal.'''
+    if token.startswith('"') and token.endswith('"') and len(token) > 1:
+        token = token[1:-1].replace('\\"', '"')
+    if _PLAIN.match(token):
+        return token
+    return '"' + token.replace('"', '\\"') + '"'
+
+
+def split(statement):
+    '''Tokens of a statement the way they are stored, eg: 'description "uplink"' for a query.'''
+    return [_canonical(token) for token in _TOKEN.findall(statement)]
+
+
+class ConfigTree:
+    '''
+    A configuration as the set of its statements, each a tuple of tokens like a "show | display set"
+    line without the "set", plus the deactivated hierarchies. Parsed from text, set or xml so that
+    configs saved in different formats compare equal. Statement order is not significant.
+    '''
+    def __init__(self, lines=(), inactive=()):
+        self.lines = set(lines)
+        self.inactive = set(inactive)
+        self._tree = None
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __eq__(self, other):
+        return self.lines == other.lines and self.inactive == other.inactive
+
+    @property
+    def tree(self):
+        '''Nested dicts, one level per token.'''
+        if self._tree is None:
+            self._tree = {}
+            for line in self.lines:
+                node = self._tree
+                for token in line:
+                    node = node.setdefault(token, {})
+        return self._tree
+
+    def set_lines(self):
+        return sorted(['set ' + ' '.join(line) for line in self.lines]) + \
+            sorted(['deactivate ' + ' '.join(path) for path in self.inactive])
+
+    def subtree(self, *path):
+        '''The statements under a hierarchy, eg: subtree('system', 'services').'''
+        n = len(path)
+        return ConfigTree([line for line in self.lines if line[:n] == path],
+                          [p for p in self.inactive if p[:n] == path])
+
+    def without(self, patterns):
+        '''Drops the statements whose set line matches one of the regexes, eg: to ignore "system host-name".'''
+        patterns = [re.compile(p) for p in patterns or []]
+        if not patterns:
+            return self
+        keep = lambda prefix, line: not any(p.search(prefix + ' '.join(line)) for p in patterns)
+        return ConfigTree([line for line in self.lines if keep('set ', line)],
+                          [path for path in self.inactive if keep('deactivate ', path)])
+
+
+def parse_text(text):
+    '''Parses the curly brace format of "show configuration".'''
+    text = _ANNOTATION.sub('', unescape(text))
+    lines, inactive = [], []
+    path = []
+    depth = []
+    statement = []
+    for token in _TOKEN.findall(text):
+        if token[0] == '#':
+            continue
+        if token == '{':
+            if statement and statement[0] == 'inactive:':
+                statement = statement[1:]
+                inactive.append(tuple(path + statement))
+            path += statement
+            depth.append(len(statement))
+            statement = []
+        elif token == '}':
+            if depth:
+                del path[len(path) - depth.pop():]
+            statement = []
+        elif token == ';':
+            if statement:
+                if statement[0] == 'inactive:':
+                    statement = statement[1:]
+                    inactive.append(tuple(path + statement))
+                if '[' in statement:
+                    # vlan members [ v1 v2 ]; is one statement per member
+                    start = statement.index('[')
+                    lines += [tuple(path + statement[:start] + [value]) for value in statement[start + 1:]
+                              if value != ']']
+                else:
+                    lines.append(tuple(path + statement))
+            statement = []
+        elif token in _PREFIXES:
+            if token == 'inactive:' and not statement:
+                statement.append(token)
+        else:
+            statement.append(_canonical(token) if token[0] == '"' else token)
+    return ConfigTree(lines, inactive)
+
+
+def parse_set(text):
+    '''Parses "show configuration | display set" output or a set style load file.'''
+    config = ConfigTree()
+    for raw in unescape(text).splitlines():
+        tokens = []
+        for token in _TOKEN.findall(raw):
+            if token[0] == '#':
+                break
+            tokens.append(_canonical(token))
+        if not tokens:
+            continue
+        verb, path = tokens[0], tuple(tokens[1:])
+        if verb == 'set' and path:
+            config.lines.add(path)
+        elif verb == 'deactivate':
+            config.inactive.add(path)
+        elif verb == 'activate':
+            config.inactive.discard(path)
+        elif verb == 'delete':
+            n = len(path)
+            config.lines = {line for line in config.lines if line[:n] != path}
+            config.inactive = {p for p in config.inactive if p[:n] != path}
+    return config
+
+
+def _local(tag):
+    # comments and junos:comment annotations are not part of the configuration
+    if not isinstance(tag, str) or '/junos/' in tag.split('}')[0]:
+        return None
+    return tag.split('}')[-1]
+
+
+def _walk(element, parent, path, config):
+    tag = _local(element.tag)
+    children = [c for c in element if _local(c.tag)]
+    keys = [c for c in children if _local(c.tag) == 'name']
+    if (parent, tag) in _COMPOUND:
+        labels = dict(_COMPOUND[(parent, tag)])
+        keys = [c for c in children if _local(c.tag) in labels] or keys
+    for key in keys:
+        children.remove(key)
+    if not keys:
+        tokens = (tag,)
+    elif _local(keys[0].tag) != 'name':
+        tokens = tuple(t for key in keys for t in (labels[_local(key.tag)], _canonical((key.text or '').strip())))
+    else:
+        name = (_canonical((keys[0].text or '').strip()),)
+        tokens = name if (parent, tag) in _UNNAMED else (tag,) + name
+    here = path + tokens
+    if element.get('inactive') == 'inactive':
+        config.inactive.add(here)
+    if not children:
+        text = (element.text or '').strip() if not keys else ''
+        config.lines.add(here + ((_canonical(text),) if text else ()))
+    for child in children:
+        _walk(child, tag, here, config)
+
+
+def parse_xml(text):
+    '''Parses "show configuration | display xml" output. The <configuration> element may be wrapped, eg: in rpc-reply.'''
+    root = etree.fromstring(text.encode() if isinstance(text, str) else text,
+                            etree.XMLParser(remove_comments=True, huge_tree=True))
+    if _local(root.tag) != 'configuration':
+        root = next((e for e in root.iter() if _local(e.tag) == 'configuration'), root)
+    config = ConfigTree()
+    for child in root:
+        if _local(child.tag):
+            _walk(child, 'configuration', (), config)
+    return config
+
+
+PARSERS = {'text': parse_text, 'set': parse_set, 'xml': parse_xml}
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    form = os.path.splitext(name)[1].lstrip('.')
+    return form if form in PARSERS else 'text'
+
+
+def read_file(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return f.read()
+
+
+def parse_file(path, form=None):
+    '''Parses a saved config. The format is taken from the file extension unless given, .gz files are read as is.'''
+    return PARSERS[form or detect_format(path)](read_file(path))
+
+
+def _diff(a, b, path, dirty, out):
+    for sign, only, node in (('-', a.keys() - b.keys(), a), ('+', b.keys() - a.keys(), b)):
+        for key in only:
+            sub = node[key]
+            if not sub and path and len(a) <= 1 and len(b) <= 1:
+                # a changed value, eg: host-name r1 -> r2, reads better one level up
+                out.append((path[:-1], sign, (path[-1], key)))
+                continue
+            for line in _flatten(sub, (key,)):
+                out.append((path, sign, line))
+    for key in a.keys() & b.keys():
+        if path + (key,) in dirty:
+            _diff(a[key], b[key], path + (key,), dirty, out)
+
+
+def _flatten(tree, prefix):
+    if not tree:
+        yield prefix
+    for key, sub in tree.items():
+        yield from _flatten(sub, prefix + (key,))
+
+
+def diff(a, b):
+    '''
+    Hierarchy aware diff of two ConfigTrees in the style of "show | compare": statements grouped under
+    [edit <hierarchy>] with - for what is only in a and + for what is only in b. Empty when they are equal.
+    '''
+    changes = []
+    if a.lines != b.lines:
+        dirty = {line[:i] for line in a.lines ^ b.lines for i in range(1, len(line))}
+        _diff(a.tree, b.tree, (), dirty, changes)
+    groups = {}
+    for path, sign, line in changes:
+        groups.setdefault(path, []).append((sign, line))
+    out = []
+    for path in sorted(groups):
+        out.append('[edit' + ''.join(' ' + t for t in path) + ']')
+        out += ['{}  {}'.format(sign, ' '.join(line)) for sign, line in sorted(groups[path], key=lambda c: (c[1], c[0]))]
+    for sign, paths in (('-', a.inactive - b.inactive), ('+', b.inactive - a.inactive)):
+        out += ['{}  deactivate {}'.format(sign, ' '.join(p)) for p in sorted(paths)]
+    return out
+
+
+def _diff_chunk(jobs, out_dir, ignore):
+    results = []
+    counts = Counter(path for _, a_path, b_path in jobs for path in (a_path, b_path))
+    shared = {}
+    for name, a_path, b_path in jobs:
+        try:
+            texts = [read_file(path) for path in (a_path, b_path)]
+            if texts[0] == texts[1] and detect_format(a_path) == detect_format(b_path):
+                # most devices did not change, no need to parse them
+                results.append((name, 0, 0, None, None))
+                continue
+            trees = []
+            for path, text in zip((a_path, b_path), texts):
+                # a golden config used for many devices is parsed once per worker
+                if path not in shared:
+                    tree = PARSERS[detect_format(path)](text).without(ignore)
+                    if counts[path] == 1:
+                        trees.append(tree)
+                        continue
+                    shared[path] = tree
+                trees.append(shared[path])
+            lines = diff(*trees)
+            added = sum(1 for line in lines if line.startswith('+'))
+            removed = sum(1 for line in lines if line.startswith('-'))
+            file_name = None
+            if lines and out_dir:
+                file_name = os.path.join(out_dir, name + '.diff')
+                with open(file_name, 'w') as f:
+                    f.write('\n'.join(lines) + '\n')
+            results.append((name, added, removed, file_name, None))
+        except Exception as err:
+            results.append((name, None, None, None, '{}: {}'.format(type(err).__name__, err)))
+    return results
+
+
+def diff_files(jobs, out_dir=None, ignore=None, workers=None, chunk_size=50):
+    '''
+    Diffs (device name, old config file, new config file) jobs locally, split in chunks across a process pool
+    so that all cores are used. Each non empty diff is written to <out_dir>/<device name>.diff.
+    Returns [(name, added, removed, diff file or None, error or None)] and the elapsed seconds.
+    '''
+    start = time.monotonic()
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = [r for chunk in executor.map(_diff_chunk, chunks, [out_dir] * len(chunks),
+                                                   [ignore] * len(chunks)) for r in chunk]
+    else:
+        results = _diff_chunk(jobs, out_dir, ignore)
+    for name, _, _, _, err in results:
+        if err:
+            logger.error(f'[{name}]: Failed to diff. {err}')
+    return results, time.monotonic() - start
@@ -0,0 +1,126 @@
+import atexit, fcntl, logging, os, threading, time
+from .junosDevice import SessionPool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SESSIONS_PER_SERVER = 4
+BUSY = -15
+
+
+def console_port(address):
+    '''(terminal server, "server:port") for a console address, None for devices reached over their ip.'''
+    if not isinstance(address, str) or ':' not in address:
+        return None
+    return address.split(':')[0], address
+
+
+class ConsoleManager:
+    '''
+    Coordinates console access for devices reached through terminal servers (<terminal server>:<port>).
+    At most max_sessions_per_server sessions are open per terminal server, every port is used by one session
+    at a time, also across jberry processes through a lock file per port, and an operation on a port that
+    is already in use fails fast with -15 instead of piling up telnet retries. Logged in console sessions are
+    kept for the next operation on the same port until they have been idle for idle_timeout seconds. A kept
+    session holds on to its terminal server slot and port lock, and is closed early when another port of the
+    same terminal server needs the slot.
+    '''
+    def __init__(self, lock_dir, max_sessions_per_server=DEFAULT_MAX_SESSIONS_PER_SERVER, attempts=3, reuse=True,
+                 idle_timeout=120, wait=None):
+        self.lock_dir = lock_dir
+        self.max_sessions_per_server = max_sessions_per_server
+        self.attempts = attempts
+        self.wait = wait
+        self.sessions = SessionPool(max_sessions=100000, idle_timeout=idle_timeout, keepalive=0,
+                                    health_check_interval=idle_timeout, on_close=self.__closed) if reuse else None
+        self._lock = threading.Lock()
+        self._servers = {}
+        # port: [lock file descriptor, in use by an operation]. Ports not in use are held by a kept session
+        self._ports = {}
+        if self.sessions is not None:
+            # a console left logged in would greet the next user with our shell
+            atexit.register(self.sessions.close_all)
+
+    @classmethod
+    def from_inventory(cls, data, base_path):
+        conf = data.get('console') or {}
+        return cls(base_path + '/' + 'dumped_files/.console/',
+                   conf.get('max_sessions_per_server', DEFAULT_MAX_SESSIONS_PER_SERVER), conf.get('attempts', 3),
+                   conf.get('reuse', True), conf.get('idle_timeout', 120), conf.get('wait'))
+
+    def __lock_file(self, port):
+        os.makedirs(self.lock_dir, exist_ok=True)
+        return self.lock_dir + port.replace(':', '_').replace('/', '_') + '.lock'
+
+    def __closed(self, key):
+        # the pool closed a kept session (session key is host, port, user, password)
+        self.release(key[0] + ':' + key[1])
+
+    def __take_slot(self, server, slots):
+        deadline = None if self.wait is None else time.monotonic() + self.wait
+        while not slots.acquire(blocking=False):
+            # sessions kept for reuse give their slot to an operation that needs one. Checked again every second,
+            # as the operations holding the slots may keep their sessions when they finish
+            if self.sessions is not None and self.sessions.evict(lambda key: key[0] == server):
+                logger.info(f'[{server}]: Closed idle console sessions to free a terminal server slot.')
+                continue
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if slots.acquire(timeout=1 if remaining is None else min(1, remaining)):
+                return True
+        return True
+
+    def acquire(self, address):
+        '''Takes a session slot on the terminal server and the port. Returns 0, or -15 when either is not available.'''
+        server, port = console_port(address)
+        with self._lock:
+            held = self._ports.get(port)
+            if held is not None:
+                if held[1]:
+                    logger.error(f'[{port}]: Console port is in use by another session.')
+                    return BUSY
+                # the session kept by the pool already has the slot and the lock
+                held[1] = True
+                return 0
+            slots = self._servers.setdefault(server, threading.BoundedSemaphore(self.max_sessions_per_server))
+        if not self.__take_slot(server, slots):
+            logger.error(f'[{port}]: No free session on terminal server {server} after {self.wait}s.')
+            return BUSY
+        with self._lock:
+            if port in self._ports:
+                fd = None
+            else:
+                fd = os.open(self.__lock_file(port), os.O_CREAT | os.O_RDWR, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self._ports[port] = [fd, True]
+                except BlockingIOError:
+                    os.close(fd)
+                    fd = None
+        if fd is None:
+            slots.release()
+            logger.error(f'[{port}]: Console port is in use by another session.')
+            return BUSY
+        return 0
+
+    def release(self, address, keep=False):
+        '''Gives the port and its slot back. With keep they stay with the session the pool keeps for reuse.'''
+        server, port = console_port(address)
+        with self._lock:
+            held = self._ports.get(port)
+            if held is None:
+                return
+            if keep:
+                held[1] = False
+                return
+            del self._ports[port]
+            slots = self._servers.get(server)
+        try:
+            fcntl.flock(held[0], fcntl.LOCK_UN)
+        finally:
+            os.close(held[0])
+            slots.release()
+
+    def close_all(self):
+        if self.sessions is not None:
+            self.sessions.close_all()
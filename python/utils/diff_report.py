@@ -0,0 +1,69 @@
+import gzip, hashlib, logging, re
+
+logger = logging.getLogger(__name__)
+
+# values that differ per device even when the change is the same everywhere
+DEFAULT_PATTERNS = [
+    (r'"\$9\$[^"]*"', '"<secret>"'),
+    (r'"\$[156]\$[^"]*"', '"<secret-hash>"'),
+    (r'## SECRET-DATA', ''),
+]
+
+
+class DiffGroups:
+    '''
+    Groups devices by their normalized diff. The device's name and ip, encrypted secrets and the inventory's
+    diff_report.normalize patterns ([regex, replacement] pairs) are replaced before hashing, so devices that
+    drifted the same way end up in one group. Only one copy of every distinct diff is kept in memory.
+    '''
+    def __init__(self, patterns=None):
+        self.patterns = [(re.compile(p), r) for p, r in DEFAULT_PATTERNS + [tuple(p) for p in patterns or []]]
+        self.groups = {}
+        self.devices = 0
+
+    def normalize(self, diff, *values):
+        for value in sorted({v for v in values if v}, key=len, reverse=True):
+            # whole words only, eg: the ip 10.0.0.1 must not touch 10.0.0.11
+            diff = re.sub(r'(?<![\w.])' + re.escape(value) + r'(?![\w.])', '<device>', diff)
+        for pattern, replacement in self.patterns:
+            diff = pattern.sub(replacement, diff)
+        return '\n'.join(line.rstrip() for line in diff.strip('\n').splitlines())
+
+    def add(self, name, file_name, *values):
+        '''Adds the delta file a device's set_config run wrote. values are device specific strings, eg: its ip.'''
+        try:
+            with open(file_name, 'r') as f:
+                diff = self.normalize(f.read(), name, *values)
+        except (OSError, TypeError) as err:
+            logger.error(f'[{name}]: Could not read delta file {file_name}. {err}')
+            diff = '<delta file missing>'
+        key = hashlib.sha256(diff.encode()).hexdigest()[:12]
+        self.groups.setdefault(key, {'diff': diff, 'devices': []})['devices'].append(name)
+        self.devices += 1
+        return key
+
+    def sorted_groups(self):
+        return sorted(self.groups.items(), key=lambda g: (-len(g[1]['devices']), g[0]))
+
+    def summary(self, max_names=10):
+        lines = ['{} devices with a diff, {} distinct diffs'.format(self.devices, len(self.groups))]
+        for key, group in self.sorted_groups():
+            devices = group['devices']
+            line = 'diff {}: {} devices share this diff'.format(key, len(devices))
+            if max_names:
+                line += ': ' + ' '.join(sorted(devices)[:max_names]) + (' ...' if len(devices) > max_names else '')
+            lines.append(line)
+        return '\n'.join(lines)
+
+    def write(self, path):
+        '''Writes every distinct diff once with all devices sharing it to a gzip compressed report.'''
+        with gzip.open(path, 'wt') as f:
+            f.write(self.summary(max_names=0) + '\n')
+            for key, group in self.sorted_groups():
+                f.write('\n' + '=' * 80 + '\n')
+                f.write('diff {}: {} devices share this diff\n'.format(key, len(group['devices'])))
+                for name in sorted(group['devices']):
+                    f.write('  ' + name + '\n')
+                f.write('-' * 80 + '\n' + group['diff'] + '\n')
+        logger.info(f'Diff report written to {path}')
+        return path
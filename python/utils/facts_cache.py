@@ -0,0 +1,62 @@
+import json, os, time
+
+DEFAULT_TTL = 3600
+# facts that only change with hardware swaps or renames can be trusted for much longer than the default
+DEFAULT_TTLS = {
+    'serialnumber': 30 * 86400,
+    'model': 30 * 86400,
+    'model_info': 30 * 86400,
+    'personality': 30 * 86400,
+    'hostname': 86400,
+    'domain': 86400,
+    'fqdn': 86400,
+}
+
+
+class FactsCache:
+    '''
+    Persistent facts cache under <dump_path>/dumped_files/facts/.cache/<device name>.json. Every fact is
+    stored with the time it was fetched and is served from the cache until its TTL expires. TTLs can be
+    set per fact in the inventory, eg: facts_ttl: {default: 3600, version: 600}
+    '''
+    def __init__(self, base_path, ttls=None):
+        self.cache_dir = base_path + '/' + 'dumped_files/facts/.cache/'
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = self.ttls.pop('default', DEFAULT_TTL)
+
+    def __path(self, name):
+        return self.cache_dir + name + '.json'
+
+    def ttl(self, key):
+        return self.ttls.get(key, self.default_ttl)
+
+    def load(self, name):
+        try:
+            with open(self.__path(name), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def get(self, name, keys):
+        '''Returns the facts out of keys that are cached and still fresh.'''
+        now = time.time()
+        cached = self.load(name)
+        return {k: cached[k]['value'] for k in keys if k in cached and now - cached[k]['time'] < self.ttl(k)}
+
+    def invalidate(self, name):
+        try:
+            os.remove(self.__path(name))
+        except FileNotFoundError:
+            pass
+
+    def update(self, name, facts):
+        cached = self.load(name)
+        now = time.time()
+        for key, value in facts.items():
+            cached[key] = {'value': json.loads(json.dumps(value, default=str)), 'time': now}
+        tmp = self.__path(name) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cached, f)
+        os.replace(tmp, self.__path(name))
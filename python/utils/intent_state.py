@@ -0,0 +1,33 @@
+import json, os, time
+
+
+class IntentState:
+    '''
+    Remembers, per device, the hash of the last config intent that was verified or committed and the
+    device's config fingerprint right after. set_config --skip_unchanged uses it to leave devices alone
+    when neither side has changed since. Kept as one json file per device under
+    <dump_path>/dumped_files/delta/.state/.
+    '''
+    def __init__(self, base_path):
+        self.state_dir = base_path + '/' + 'dumped_files/delta/.state/'
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def __path(self, name):
+        return self.state_dir + name + '.json'
+
+    def get(self, name):
+        try:
+            with open(self.__path(name), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def is_unchanged(self, name, intent, fingerprint):
+        last = self.get(name)
+        return bool(intent and fingerprint and last and last['intent'] == intent and last['fingerprint'] == fingerprint)
+
+    def update(self, name, intent, fingerprint):
+        tmp = self.__path(name) + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'intent': intent, 'fingerprint': fingerprint, 'timestamp': time.strftime("%Y-%m-%d-%H-%M-%S")}, f)
+        os.replace(tmp, self.__path(name))
@@ -0,0 +1,122 @@
+import json, logging, os, re, stat
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# the libyaml parser is several times faster than the pure python one on large inventories
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+CACHE_VERSION = 2
+
+
+def _cache_path(path):
+    return os.path.join(os.path.dirname(os.path.abspath(path)), '.' + os.path.basename(path) + '.cache')
+
+
+def _read_cache(cache, key):
+    # the cache holds the device passwords, it is only trusted when nobody else could have read or written it
+    try:
+        with open(cache, 'r') as f:
+            info = os.fstat(f.fileno())
+            if info.st_uid != os.getuid() or stat.S_IMODE(info.st_mode) & 0o077:
+                logger.warning(f'Ignoring inventory cache {cache}. It is not private to this user.')
+                return None
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if isinstance(cached, dict) and cached.get('key') == list(key):
+        return cached.get('data')
+    return None
+
+
+def _write_cache(cache, key, data):
+    if json.loads(json.dumps(data, default=str)) != data:
+        # eg: numeric device keys or dates, which json would not give back as they are
+        logger.debug(f'Not caching inventory {cache}. It does not round trip through json.')
+        return
+    tmp = cache + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'key': list(key), 'data': data}, f)
+        os.replace(tmp, cache)
+    except OSError as err:
+        logger.debug(f'Could not write inventory cache {cache}. {err}')
+
+
+def load(path):
+    '''
+    Returns the parsed inventory. The parsed result is saved as json next to the inventory
+    (.<file name>.cache, readable only by its owner) and reused as long as the inventory's size and mtime are
+    unchanged, so large inventories are parsed once instead of on every run. Raises FileNotFoundError like open().
+    '''
+    info = os.stat(path)
+    key = (CACHE_VERSION, info.st_mtime_ns, info.st_size)
+    cache = _cache_path(path)
+    data = _read_cache(cache, key)
+    if data is not None:
+        return data
+    with open(path, 'r') as f:
+        data = yaml.load(f, Loader=Loader)
+    _write_cache(cache, key, data)
+    return data
+
+
+def _options(data, device):
+    options = data['devices'][device]
+    return options if type(options) is dict else {}
+
+
+def _tags(options):
+    tags = options.get('tags') or []
+    return set(tags.split(',') if isinstance(tags, str) else tags)
+
+
+def select(data, tags=None, groups=None, match=None, exclude=None):
+    '''
+    Returns a copy of the inventory with only the selected devices. All given selectors must match:
+    tags - list of comma separated tag sets, a device needs one tag out of every set (devices.<device>.tags)
+    groups - device is in one of the groups (devices.<device>.group, or listed under groups.<group>)
+    match / exclude - regex searched in the device key and name
+    '''
+    if not (tags or groups or match or exclude):
+        return data
+    tag_sets = [set(t.split(',')) for t in tags or []]
+    members = {}
+    for group, devices in (data.get('groups') or {}).items():
+        for device in devices or []:
+            members.setdefault(device, set()).add(group)
+    match = re.compile(match) if match else None
+    exclude = re.compile(exclude) if exclude else None
+    selected = {}
+    for device, value in data['devices'].items():
+        options = _options(data, device)
+        names = (str(device), str(options.get('name') or device))
+        if tag_sets and not all(_tags(options) & tag_set for tag_set in tag_sets):
+            continue
+        if groups and not ({options.get('group')} | members.get(device, set())) & set(groups):
+            continue
+        if match and not any(match.search(n) for n in names):
+            continue
+        if exclude and any(exclude.search(n) for n in names):
+            continue
+        selected[device] = value
+    logger.info(f'Selected {len(selected)} out of {len(data["devices"])} devices')
+    return dict(data, devices=selected)
+
+
+def add_selector_args(parser):
+    parser.add_argument('--tags', action='append', help='''Only devices with one of these comma separated tags
+                        (devices.<device>.tags). Repeat to require a tag out of every set, eg: --tags dc1,dc2 --tags spine''')
+    parser.add_argument('--group', action='append', help='''Only devices of this group (devices.<device>.group or
+                        listed under groups.<group>). Can be repeated''')
+    parser.add_argument('--match', help='Only devices whose name matches this regex', default=None)
+    parser.add_argument('--exclude', help='Skip devices whose name matches this regex', default=None)
+    return parser
+
+
+def load_inventory(path, args=None):
+    '''Loads the inventory and applies the selectors added by add_selector_args.'''
+    data = load(path)
+    if args is None:
+        return data
+    return select(data, getattr(args, 'tags', None), getattr(args, 'group', None), getattr(args, 'match', None),
+                  getattr(args, 'exclude', None))
@@ -1,6 +1,8 @@
 import smtplib
 from email.message import EmailMessage
-import socket, os
+import socket, os, logging
+
+logger = logging.getLogger(__name__)
 
 class Email:
     def __init__(self, smtp_server, port=25, user=None, password=None, ssl=False):
@@ -32,8 +34,14 @@ class Email:
             msg['Subject'] = subject
             for file_name in files:
                 file_name_without_path = os.path.basename(file_name)
-                with open(file_name, 'r') as f:
-                    msg.add_attachment(f.read(), filename=file_name_without_path)
+                if file_name.endswith('.gz'):
+                    # compressed reports are attached as is instead of being decoded as text
+                    with open(file_name, 'rb') as f:
+                        msg.add_attachment(f.read(), maintype='application', subtype='gzip',
+                                           filename=file_name_without_path)
+                else:
+                    with open(file_name, 'r') as f:
+                        msg.add_attachment(f.read(), filename=file_name_without_path)
             return msg
         except FileNotFoundError as err:
             logger.error(f"Failed to locate file. {err}")
@@ -2,41 +2,320 @@ from jnpr.junos import Device
 from lxml import etree
 from jnpr.junos.utils.config import Config 
 from os.path import exists
-import yaml, os
+import os
 from jnpr.junos.utils.sw import SW
-import logging, json
-from jnpr.junos.exception import ConnectError, ConnectAuthError, RpcError, ConfigLoadError, CommitError, LockError, RpcTimeoutError
+from jnpr.junos.utils.scp import SCP
+import logging, json, hashlib, functools, socket
+import threading, time
+from jnpr.junos.exception import ConnectError, ConnectAuthError, ConnectRefusedError, RpcError, ConfigLoadError, CommitError, LockError, RpcTimeoutError
+from jnpr.junos.rpcmeta import _RpcMetaExec
+from ncclient.manager import Manager
+from ncclient.xml_ import to_ele
+from jnpr.junos.jxml import remove_namespaces
 from .path import create_path
+from .backup_index import BackupIndex
+from .archive import ConfigArchive
+from .log import setup_logging
+from .facts_cache import FactsCache
+from .render import get_template, load_env, render
+from .intent_state import IntentState
+from .timing import operation, phase, begin, finish, enabled as timing_enabled
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter("%(asctime)s:[%(levelname)s]:[%(name)s]:%(message)s")
-file_handler = logging.FileHandler('jberry.log')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-# stream_handler = logging.StreamHandler()
-# stream_handler.setFormatter(formatter)
-# logger.addHandler(stream_handler)
+if not logging.getLogger(__package__).handlers:
+    setup_logging()
+
+_dns = threading.local()
+_getaddrinfo = socket.getaddrinfo
+
+
+def _timed_getaddrinfo(*args, **kwargs):
+    '''socket.getaddrinfo while timing. The lookup ncclient makes to open a session is recorded as the dns phase.'''
+    if not getattr(_dns, 'connecting', False):
+        return _getaddrinfo(*args, **kwargs)
+    with phase('dns'):
+        return _getaddrinfo(*args, **kwargs)
+
+
+def _rss():
+    '''Current resident set size of the process in bytes, None where /proc is not available.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+class _ConfigWriter:
+    '''
+    File like sink for lxml serialization that writes straight to the dump file and strips the
+    <configuration-{form}> wrapper on the fly. At most one tag length is held back between chunks.
+    '''
+    def __init__(self, f, form):
+        self.f = f
+        self.tags = (f'<configuration-{form}>'.encode(), f'</configuration-{form}>'.encode())
+        self.keep = max(len(t) for t in self.tags) - 1
+        self.pending = b''
+        self.bytes_written = 0
+
+    def __strip(self, data):
+        for tag in self.tags:
+            data = data.replace(tag, b'')
+        return data
+
+    def write(self, data):
+        data = self.__strip(self.pending + data)
+        cut = max(len(data) - self.keep, 0)
+        self.pending = data[cut:]
+        self.__flush(data[:cut])
+
+    def close(self):
+        self.__flush(self.__strip(self.pending))
+        self.pending = b''
+
+    def __flush(self, data):
+        if data:
+            self.f.write(data)
+            self.bytes_written += len(data)
+
+
+class _PooledSession:
+    def __init__(self, key):
+        self.key = key
+        self.dev = None
+        self.in_use = True
+        self.last_used = time.monotonic()
+        self.last_checked = self.last_used
+
+
+class SessionPool:
+    '''
+    Keeps NETCONF sessions open between JunosDevice operations so that several operations against the
+    same device (facts + config + show) pay the SSH key exchange and NETCONF hello only once.
+    Sessions are keyed by host/port/credentials and handed out to one caller at a time. on_close is called
+    with the key of every pooled session once it has been closed.
+    '''
+    def __init__(self, max_sessions=100, idle_timeout=300, keepalive=30, health_check_interval=60, on_close=None):
+        self.max_sessions = max_sessions
+        self.on_close = on_close
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.health_check_interval = health_check_interval
+        self._sessions = {}
+        self._by_dev = {}
+        self._to_close = []
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def acquire(self, key, factory):
+        with self._cond:
+            while True:
+                self._evict_idle()
+                session = self._sessions.get(key)
+                if session and not session.in_use:
+                    session.in_use = True
+                    break
+                if session is None and (len(self._sessions) < self.max_sessions or self._evict_lru()):
+                    session = self._sessions[key] = _PooledSession(key)
+                    break
+                self._cond.wait()
+        self._close_evicted()
+        try:
+            if session.dev is None or not self._healthy(session):
+                self._open(session, factory)
+        except Exception:
+            with self._cond:
+                self._forget(session)
+                self._cond.notify_all()
+            self._close_evicted()
+            raise
+        session.last_used = time.monotonic()
+        return session.dev
+
+    def release(self, dev, discard=False):
+        with self._cond:
+            session = self._by_dev.get(id(dev))
+            if session is None or not session.in_use:
+                return
+            session.in_use = False
+            session.last_used = time.monotonic()
+            if discard:
+                self._forget(session)
+            self._evict_idle()
+            self._cond.notify_all()
+        self._close_evicted()
+
+    def evict(self, match):
+        '''Closes the idle sessions whose key matches. Returns how many were closed.'''
+        with self._cond:
+            idle = [s for s in self._sessions.values() if not s.in_use and match(s.key)]
+            for session in idle:
+                self._forget(session)
+            self._cond.notify_all()
+        self._close_evicted()
+        return len(idle)
+
+    def close_all(self):
+        with self._cond:
+            for session in list(self._sessions.values()):
+                if not session.in_use:
+                    self._forget(session)
+            self._cond.notify_all()
+        self._close_evicted()
+
+    def _open(self, session, factory):
+        if session.dev is not None:
+            logger.info(f'[{session.key[0]}]: Pooled session failed health check. Reconnecting.')
+            with self._cond:
+                self._by_dev.pop(id(session.dev), None)
+            self._close_quietly(session.dev)
+            session.dev = None
+        dev = factory()
+        dev.open()
+        self._set_keepalive(dev)
+        session.dev = dev
+        session.last_checked = time.monotonic()
+        with self._cond:
+            self._by_dev[id(dev)] = session
+
+    def _set_keepalive(self, dev):
+        if not self.keepalive:
+            return
+        try:
+            dev._conn._session._transport.set_keepalive(self.keepalive)
+        except AttributeError:
+            # console (telnet) sessions have no ssh transport
+            pass
+
+    def _healthy(self, session):
+        if not session.dev.connected:
+            return False
+        now = time.monotonic()
+        if now - session.last_checked < self.health_check_interval:
+            return True
+        try:
+            session.dev.rpc.get_system_uptime_information()
+            session.last_checked = now
+            return True
+        except Exception as err:
+            logger.debug(f'[{session.key[0]}]: Health check failed. {err}')
+            return False
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        for session in list(self._sessions.values()):
+            if not session.in_use and now - session.last_used > self.idle_timeout:
+                logger.info(f'[{session.key[0]}]: Evicting session idle for {int(now - session.last_used)}s.')
+                self._forget(session)
+
+    def _evict_lru(self):
+        idle = [s for s in self._sessions.values() if not s.in_use]
+        if not idle:
+            return False
+        self._forget(min(idle, key=lambda s: s.last_used))
+        return True
+
+    def _forget(self, session):
+        # called with the lock held; the actual close happens in _close_evicted once it is released
+        self._sessions.pop(session.key, None)
+        if session.dev is not None:
+            self._by_dev.pop(id(session.dev), None)
+            self._to_close.append((session.key, session.dev))
+            session.dev = None
+
+    def _close_evicted(self):
+        with self._cond:
+            to_close, self._to_close = self._to_close, []
+        for key, dev in to_close:
+            self._close_quietly(dev)
+            if self.on_close is not None:
+                self.on_close(key)
+
+    @staticmethod
+    def _close_quietly(dev):
+        try:
+            dev.close()
+        except Exception:
+            pass
+
+
+class _RpcRecorder:
+    '''Stands in for the Device behind dev.rpc, so that dev.rpc only builds the rpc element instead of running it.'''
+    transform = None
+
+    def execute(self, rpc, **kwargs):
+        return rpc, kwargs.get('filter_xml')
+
+
+# builds rpcs with the same arguments as dev.rpc, eg: _RPC_BUILDER.get_config(filter_xml='system/services')
+_RPC_BUILDER = _RpcMetaExec(_RpcRecorder())
+# dev.rpc arguments that change how the reply is handled rather than the rpc that is sent
+_REPLY_ARGS = {'dev_timeout', 'normalize', 'ignore_warning', 'to_py'}
+
+
+def traced(fn):
+    '''Records the operation and its return code when timing is enabled (see utils/timing.py).'''
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        with operation(self.name, fn.__name__) as span:
+            ret = fn(self, *args, **kwargs)
+            span.set('ret', ret[0] if isinstance(ret, tuple) else ret)
+            return ret
+    return wrapper
+
 
 class JunosDevice:
     dump_path = None
     device_list_file = None
     dir_name = None
+    timestamp = None
+    session_pool = None
+    console_manager = None
+    facts_ttl = None
 
-    def __init__(self, name, user, password, ip=None, console=None):
+    def __init__(self, name, user, password, ip=None, console=None, timeout=None):
         self.name = name
         self.ip = ip 
         self.console = console
         self.user = user
         self.password = password
-        self.dev = self.dev_connection(self.name, self.ip or self.console, self.user, self.password)
+        self.timeout = timeout
+        self.dev = self.dev_connection(self.name, self.ip or self.console, self.user, self.password, self.timeout)
+        self._pooled = False
+        self._console = False
 
     def __repr__(self):
         return f"JunosDevice({self.name})"
 
+    def session_key(self):
+        host, _, port = (self.ip or self.console).partition(':')
+        return (host, port, self.user, self.password)
+
+    def _new_dev(self):
+        return self.dev_connection(self.name, self.ip or self.console, self.user, self.password, self.timeout)
+
     def connect(self):
         try:
-            self.dev.open() 
+            if ":" in (self.ip or self.console) and JunosDevice.console_manager is not None:
+                return self.__connect_console()
+            if timing_enabled() and socket.getaddrinfo is not _timed_getaddrinfo:
+                socket.getaddrinfo = _timed_getaddrinfo
+            # covers the dns lookup, the ssh connection and the netconf hello, or only the health check of a pooled
+            # session. The lookup is the one ncclient makes, none is made for a reused session or a proxy command
+            _dns.connecting = True
+            try:
+                with phase('connect', pooled=JunosDevice.session_pool is not None):
+                    if JunosDevice.session_pool is not None:
+                        self.dev = JunosDevice.session_pool.acquire(self.session_key(), self._new_dev)
+                        self._pooled = True
+                    else:
+                        self.dev.open()
+            finally:
+                _dns.connecting = False
+            if self.timeout and ":" not in (self.ip or self.console):
+                self.dev.timeout = self.timeout
         except ConnectAuthError as err:
             logger.error("[{}]: Invalid Username or password for device. {}".format(self.name, err))
             return -1
@@ -44,29 +323,98 @@ class JunosDevice:
             logger.error("[{}]: Could not connect to device. {}".format(self.name, err))
             return -2
 
-    def disconnect(self):
+    def __connect_console(self):
+        manager = JunosDevice.console_manager
+        with phase('console_wait'):
+            ret = manager.acquire(self.ip or self.console)
+        if ret:
+            logger.error("[{}]: Console port busy. Not retrying.".format(self.name))
+            return ret
+        self._console = True
         try:
-            self.dev.close() 
+            with phase('connect', console=True, pooled=manager.sessions is not None):
+                if manager.sessions is not None:
+                    self.dev = manager.sessions.acquire(self.session_key(), self._new_dev)
+                else:
+                    self.dev.open()
+        except Exception as err:
+            # the port is given back for the next try, the error is reported by connect()
+            self._console = False
+            manager.release(self.ip or self.console)
+            if not isinstance(err, ConnectRefusedError):
+                raise
+            # the terminal server refuses a port that someone is already connected to
+            logger.error("[{}]: Console port refused the connection, probably in use. {}".format(self.name, err))
+            return -15
+
+    def _release_console(self, discard=False):
+        if not self._console:
+            return
+        self._console = False
+        manager = JunosDevice.console_manager
+        keep = False
+        try:
+            if manager.sessions is not None:
+                manager.sessions.release(self.dev, discard)
+                # a pooled session keeps the port until the pool closes it
+                keep = not discard
+            elif self.dev.connected:
+                self.dev.close()
+        finally:
+            manager.release(self.ip or self.console, keep)
+
+    def disconnect(self, discard=False):
+        try:
+            with phase('disconnect'):
+                if self._console:
+                    self._release_console(discard)
+                elif self._pooled:
+                    self._pooled = False
+                    JunosDevice.session_pool.release(self.dev, discard)
+                else:
+                    self.dev.close() 
         except Exception as err:
             logger.exception("[{}]: Exception caught for device. {}".format(self.name, err))
             return -99
 
+    def _release_session(self):
+        # a pooled session left behind by a failed operation is in an unknown state
+        if self._pooled:
+            self._pooled = False
+            JunosDevice.session_pool.release(self.dev, discard=True)
+        # a console session is closed as well, a stuck one would keep the port busy
+        try:
+            self._release_console(discard=True)
+        except Exception as err:
+            logger.error("[{}]: Failed to close console session. {}".format(self.name, err))
+
     def __del__(self):
         pass
 
     @staticmethod
-    def dev_connection(name, ip, user, password):
+    def dev_connection(name, ip, user, password, timeout=None):
         logger.info(f'[{name}]: Connecting to device.')
         if ":" in ip:
             logger.info(f'[{name}]: Using Console for connection')
+            attempts = JunosDevice.console_manager.attempts if JunosDevice.console_manager is not None else 5
             return Device(host=ip.split(':')[0], mode='telnet', 
-                    port=ip.split(':')[1], user=user, password=password, attempts=5, gather_facts=0)
+                    port=ip.split(':')[1], user=user, password=password, attempts=attempts, gather_facts=0)
         else:
             logger.info(f'[{name}]: Using IP for connection')
+            if timeout:
+                return Device(host=ip, user=user, password=password, gather_facts=0, conn_open_timeout=timeout)
             return Device(host=ip, user=user, password=password, gather_facts=0)
 
     def __create_dir(self, module_name):
-        return create_path(JunosDevice.dump_path, module_name, os.path.basename(JunosDevice.device_list_file))
+        return create_path(JunosDevice.dump_path, module_name, os.path.basename(JunosDevice.device_list_file),
+                           JunosDevice.timestamp)
+
+    def write_config(self, file_name, config, form):
+        with open(file_name, 'wb') as f:
+            writer = _ConfigWriter(f, form)
+            etree.ElementTree(config).write(writer, encoding='utf-8', pretty_print=True, xml_declaration=False)
+            writer.close()
+        return writer.bytes_written
 
     def write_to_file(self, file_name, contents):
         try:
@@ -76,21 +424,79 @@ class JunosDevice:
         except FileNotFoundError:
             logger.error(f'[{name}]: {file} not found')
 
-    def get_config(self, form, conf_xpath):
-        logger.info(f'[{self.name}]: get_config called.')
-        JunosDevice.dir_name = self.__create_dir('config')
-        logger.info(f'[{self.name}]: Dump directory is {JunosDevice.dir_name}')
+    def config_fingerprint(self):
+        '''Cheap identifier of the committed configuration. Uses the checksum of the active config file and
+        falls back to the latest commit history entry where the file is not readable.'''
+        with phase('fingerprint'):
+            return self.__config_fingerprint()
+
+    def __config_fingerprint(self):
         try:
-            self.connect()
-            full_config = self.dev.rpc.get_config(filter_xml=conf_xpath, options={"format" : form})
-            contents = etree.tostring(full_config, encoding="unicode", 
-                pretty_print='True').replace(f'<configuration-{form}>', '').replace(f'</configuration-{form}>', '')
-            file_name = JunosDevice.dir_name + self.name + "." + form
-            self.write_to_file(file_name, contents)
-            msg = self.name + "\n" + contents
-            logger.debug(f'[{self.name}]: Dumping config ' + msg)
+            rsp = self.dev.rpc.get_checksum_information(path='/config/juniper.conf.gz')
+            checksum = rsp.findtext('.//checksum')
+            if checksum:
+                return checksum.strip()
+        except RpcTimeoutError:
+            raise
+        except RpcError as err:
+            logger.debug(f'[{self.name}]: Could not checksum active config. {err}')
+        rsp = self.dev.rpc.get_commit_information()
+        latest = rsp.find('.//commit-history')
+        if latest is None:
+            return None
+        return '|'.join((latest.findtext(tag) or '').strip() for tag in ('date-time', 'user', 'client'))
+
+    @traced
+    def get_config(self, form, conf_xpath, incremental=False, archive=False):
+        logger.info(f'[{self.name}]: get_config called. Incremental: {incremental}. Archive: {archive}')
+        if archive:
+            archive = ConfigArchive(JunosDevice.dump_path)
+        else:
+            JunosDevice.dir_name = self.__create_dir('config')
+            logger.info(f'[{self.name}]: Dump directory is {JunosDevice.dir_name}')
+        try:
+            ret = self.connect()
+            if ret:
+                return ret
+            if incremental:
+                index = BackupIndex(JunosDevice.dump_path)
+                index_key = f"{form}:{conf_xpath or ''}"
+                fingerprint = self.config_fingerprint()
+                if index.is_unchanged(self.name, index_key, fingerprint):
+                    last = index.get(self.name, index_key)
+                    if not archive:
+                        self.write_to_file(JunosDevice.dir_name + self.name + "." + form + ".unchanged",
+                                           f"skipped, unchanged since {last['timestamp']}. Last backup {last['file']}\n")
+                    logger.info(f"[{self.name}]: Config unchanged since {last['timestamp']}. Skipping backup.")
+                    self.disconnect()
+                    return 0
+            rss = _rss()
+            with phase('rpc'):
+                full_config = self.dev.rpc.get_config(filter_xml=conf_xpath, options={"format" : form})
+            if archive:
+                staging = archive.staging_path(self.name, form)
+                with phase('write'):
+                    size = self.write_config(staging, full_config, form)
+                with phase('archive'):
+                    file_name = archive.object_path(archive.store_file(self.name, form, staging, conf_xpath))
+            else:
+                file_name = JunosDevice.dir_name + self.name + "." + form
+                # serializing the reply and writing it to disk happen together, chunk by chunk
+                with phase('write'):
+                    size = self.write_config(file_name, full_config, form)
+            # the reply tree is the bulk of the memory a device needs, measured before it is freed. Other devices
+            # worked on at the same time show up in the same process wide figure
+            grown = _rss() - rss if rss is not None else None
+            del full_config
+            logger.info(f'[{self.name}]: Wrote {size} bytes of config to {file_name}.' +
+                        (f' Process RSS grew by {grown / 1048576:.1f} MB over the rpc and write.' if grown is not None else ''))
+            if incremental and fingerprint:
+                index.update(self.name, index_key, fingerprint, file_name)
             self.disconnect()
             return 0
+        except RpcTimeoutError as err:
+            logger.error("[{}]: Rpc Timeout Error. {}".format(self.name, err))
+            return -12
         except RpcError as err:
             logger.error("[{}]: Configuration hierarchy doesnt exist. {}".format(self.name, conf_xpath))
             return -3
@@ -100,24 +506,56 @@ class JunosDevice:
         except Exception as err:
             logger.exception("[{}]: Exception caught. {}".format(self.name, err))
             return -99
+        finally:
+            self._release_session()
+
+    def fetch_facts(self, keys, cached=False):
+        '''
+        Returns a dict of the requested facts. With cached, facts that are still fresh in the facts cache
+        are served locally and the device is only contacted for the missing or expired ones. PyEZ resolves
+        facts lazily, so only the fact groups behind those keys are fetched from the device.
+        '''
+        cache = FactsCache(JunosDevice.dump_path, JunosDevice.facts_ttl) if cached else None
+        contents = cache.get(self.name, keys) if cache else {}
+        stale = [k for k in keys if k not in contents]
+        if stale:
+            logger.info(f'[{self.name}]: Fetching facts {stale} from device.')
+            ret = self.connect()
+            if ret:
+                return ret
+            with phase('facts'):
+                fetched = {k: self.dev.facts[k] for k in stale}
+            if cache:
+                cache.update(self.name, fetched)
+            contents.update(fetched)
+            self.disconnect()
+        return {k: contents[k] for k in keys}
+
+    def get_fact(self, key):
+        '''Returns a single fact value for in-process callers, served from the facts cache when fresh.'''
+        try:
+            facts = self.fetch_facts([key], cached=True)
+            return None if isinstance(facts, int) else facts[key]
+        except Exception as err:
+            logger.error("[{}]: Could not get fact {}. {}".format(self.name, key, err))
+            return None
+        finally:
+            self._release_session()
 
-    def get_facts(self, key):
+    @traced
+    def get_facts(self, key, cached=False):
         try:
-            self.connect()
-            logger.info(f'[{self.name}]: get_facts called with key {key}')
+            logger.info(f'[{self.name}]: get_facts called with key {key}. Cached: {cached}')
+            contents = self.fetch_facts([key] if key else list(self.dev.facts), cached)
+            if isinstance(contents, int):
+                return contents
             JunosDevice.dir_name = self.__create_dir('facts')
             logger.info(f'[{self.name}]: Dump directory is {JunosDevice.dir_name}')
-            if key:
-                contents = {}
-                contents[key] = self.dev.facts[key]
-            else:
-                contents = self.dev.facts
-            contents = json.dumps(contents)
-            file_name = JunosDevice.dir_name + self.name + "_facts"
-            self.write_to_file(file_name, contents)
-            msg = json.dumps(contents)
-            logger.debug(f'[{self.name}]: Dumping facts: {msg}')
-            self.disconnect()
+            with phase('write'):
+                contents = json.dumps(contents, default=str)
+                file_name = JunosDevice.dir_name + self.name + "_facts"
+                self.write_to_file(file_name, contents)
+            logger.debug('[%s]: Dumping facts: %s', self.name, contents)
             return 0
         except KeyError as err:
             logger.error("[{}]: Fact {} doesnt exist. {}".format(self.name, key, err))
@@ -128,19 +566,171 @@ class JunosDevice:
         except Exception as err:
             logger.exception("[{}]: Exception caught. {}".format(self.name, err))
             return -99
+        finally:
+            self._release_session()
+
+    @traced
+    def collect(self, collectors, interfaces=None):
+        '''
+        Runs several operational state collectors (see utils/collectors.py) over a single session, limited to
+        the given interfaces for the collectors that support it.
+        Returns (ret, {collector name: Table, or the error code of a collector whose rpc failed}).
+        '''
+        try:
+            ret = self.connect()
+            if ret:
+                return ret, {}
+            logger.info(f'[{self.name}]: collect called for {[c.name for c in collectors]}. Interfaces: {interfaces}')
+            requests = [c.requests(interfaces) for c in collectors]
+            replies = iter(self._pipeline([r for batch in requests for r in batch]))
+            # a failed collector (eg: lldp is not enabled) keeps its error code, the others are still useful
+            results = {c.name: c.merge([next(replies) for _ in batch]) for c, batch in zip(collectors, requests)}
+            self.disconnect()
+            return 0, results
+        except RuntimeError as err:
+            logger.error("[{}]: Runtime Error. {}".format(self.name, err))
+            return -7, {}
+        except Exception as err:
+            logger.exception("[{}]: Exception caught. {}".format(self.name, err))
+            return -99, {}
+        finally:
+            self._release_session()
+
+    @traced
+    def rpc_batch(self, requests):
+        '''
+        Runs several rpcs pipelined over a single session, eg:
+            JD.rpc_batch([('get_config', {'filter_xml': 'system', 'options': {'format': 'set'}}),
+                          ('get_interface_information', {'terse': True}), 'get_bgp_summary_information',
+                          ('facts', ['hostname', 'version'])])
+        Requests take the same arguments as dev.rpc.<rpc name>. Returns (ret, [reply element, facts dict or the
+        error code of the request, per request]).
+        '''
+        try:
+            ret = self.connect()
+            if ret:
+                return ret, []
+            logger.info(f'[{self.name}]: rpc_batch called for {len(requests)} requests')
+            results = self._pipeline(requests)
+            self.disconnect()
+            return 0, results
+        except RuntimeError as err:
+            logger.error("[{}]: Runtime Error. {}".format(self.name, err))
+            return -7, []
+        except Exception as err:
+            logger.exception("[{}]: Exception caught. {}".format(self.name, err))
+            return -99, []
+        finally:
+            self._release_session()
+
+    def _pipeline(self, requests):
+        '''
+        Sends every request on the open session before waiting for the first reply, so that a batch costs one
+        round trip plus the device's processing time instead of a round trip per rpc. Console sessions can not
+        pipeline and run the requests one after the other, as do requests with arguments that change how dev.rpc
+        handles the reply (dev_timeout, normalize, ignore_warning, to_py, json format) and replies that carry an
+        rpc-error, so that the result is always the one dev.rpc.<rpc> gives. A request that failed gives -3, -6 for
+        an unknown fact, -12 when it timed out and -2 when the session was lost.
+        '''
+        requests = [(r, {}) if isinstance(r, str) else r for r in requests]
+        # the ncclient manager of the session. Console sessions have none, other versions may lack async mode
+        conn = getattr(self.dev, '_conn', None)
+        pipelined = isinstance(conn, Manager) and hasattr(conn, 'async_mode')
+        with phase('rpc', batch=len(requests), pipelined=pipelined):
+            sent = self.__send_batch(conn, requests) if pipelined else None
+            if sent is None:
+                return [self.__run_request(name, args) for name, args in requests]
+            results = []
+            timeout = self.dev.timeout
+            for (name, args), request in zip(requests, sent):
+                if request is None:
+                    # queued behind the batch on the same session
+                    results.append(self.__run_request(name, args))
+                    continue
+                result = self.__batch_reply(*request, timeout)
+                if result is None:
+                    # dev.rpc decides about the rpc-error: raise mode, exempt errors of the session's device handler
+                    result = self.__run_request(name, args)
+                results.append(result)
+                if result == -12:
+                    # the device stopped answering, only take what has already arrived
+                    timeout = 0
+            return results
+
+    def __send_batch(self, conn, requests):
+        '''
+        Sends the requests in ncclient's async mode. Returns [(rpc, pending ncclient rpc), or None for facts and
+        the requests left to dev.rpc].
+        '''
+        sent = []
+        previous = conn.async_mode
+        conn.async_mode = True
+        try:
+            for name, args in requests:
+                rpc = None
+                if name != 'facts' and not _REPLY_ARGS.intersection(args):
+                    rpc, filter_xml = getattr(_RPC_BUILDER, name)(**args)
+                if rpc is None or rpc.attrib.get('format', '').lower() == 'json':
+                    sent.append(None)
+                else:
+                    sent.append((rpc, conn.rpc(rpc, filter_xml)))
+        except AttributeError as err:
+            if any(sent):
+                raise
+            logger.warning("[{}]: Can not pipeline rpcs, running them one by one. {}".format(self.name, err))
+            return None
+        finally:
+            conn.async_mode = previous
+        return sent
+
+    def __batch_reply(self, rpc, request, timeout):
+        if not request.event.wait(timeout):
+            logger.error("[{}]: {} timed out.".format(self.name, rpc.tag))
+            return -12
+        if request.error:
+            logger.error("[{}]: {} failed. {}".format(self.name, rpc.tag, request.error))
+            return -2
+        reply = request.reply
+        reply.parse()
+        if reply.error is not None:
+            return None
+        # what dev.rpc.<rpc> returns: the first child of the rpc-reply without namespaces, the reply itself when it
+        # only has text or True when it is empty
+        doc = remove_namespaces(to_ele(reply.xml, huge_tree=request.huge_tree))
+        if len(doc):
+            return doc[0]
+        return doc if doc.text and doc.text.strip() else True
+
+    def __run_request(self, name, args):
+        try:
+            if name == 'facts':
+                return {k: self.dev.facts[k] for k in (args or list(self.dev.facts))}
+            return getattr(self.dev.rpc, name)(**args)
+        except KeyError as err:
+            logger.error("[{}]: Fact {} doesnt exist.".format(self.name, err))
+            return -6
+        except RpcTimeoutError as err:
+            logger.error("[{}]: {} timed out. {}".format(self.name, name, err))
+            return -12
+        except RpcError as err:
+            logger.error("[{}]: {} failed. {}".format(self.name, name, err))
+            return -3
 
-    def load_config(self, conf, env_file, config_file_dir, template_path, form, overwrite):
+    def load_config(self, conf, env_file, config_file_dir, template_path, form, overwrite, rendered=None):
         try:
             if config_file_dir:
                 path = config_file_dir + "/" + self.name + "." + form
                 logger.info(f'[{self.name}] : Loading config from {path}')
                 conf.load(path=path, format=form, overwrite=overwrite)
                 ret = conf
+            elif rendered is not None:
+                logger.info(f'[{self.name}] : Loading config pre-rendered from template {template_path}')
+                conf.load(rendered, format=form)
+                ret = conf
             elif env_file and template_path:
-                with open(env_file, 'r') as ef:
-                    env = yaml.safe_load(ef)
-                    logger.info(f'[{self.name}] : Loading config from template {template_path} and vars file {env_file}')
-                    temp = conf.load(template_path=template_path, template_vars=env, format=form)
+                env = load_env(env_file)
+                logger.info(f'[{self.name}] : Loading config from template {template_path} and vars file {env_file}')
+                temp = conf.load(template=get_template(template_path), template_vars=env, format=form)
                 ret = conf
             else:
                 ret = -11
@@ -149,34 +739,85 @@ class JunosDevice:
             logger.error(f"[{self.name}]: Failed to locate configuration file. {err}")
             return -11
 
-    def set_config(self, env_file, config_file_dir, template_path, dry, form, overwrite=True):
+    def intent_hash(self, env_file, config_file_dir, template_path, form, overwrite, rendered=None):
+        '''Hash of the config set_config would load, computed locally without contacting the device.'''
+        if config_file_dir:
+            with open(config_file_dir + "/" + self.name + "." + form, 'rb') as f:
+                contents = f.read()
+        elif rendered is not None:
+            contents = rendered.encode()
+        elif env_file and template_path:
+            contents = render(template_path, env_file).encode()
+        else:
+            return None
+        return hashlib.sha256(f'{form}:{overwrite}:'.encode() + contents).hexdigest()
+
+    @traced
+    def set_config(self, env_file, config_file_dir, template_path, dry, form, overwrite=True, rendered=None,
+                   skip_unchanged=False, confirm=None):
+        '''
+        Loads the config and saves the diff. Commits it when dry is not set. With confirm (minutes) the commit
+        is a commit confirmed that the device rolls back by itself unless confirm_commit() follows in time.
+        '''
         try:
-            self.connect()
+            intent = fingerprint = None
+            if skip_unchanged:
+                state = IntentState(JunosDevice.dump_path)
+                try:
+                    intent = self.intent_hash(env_file, config_file_dir, template_path, form, overwrite, rendered)
+                except FileNotFoundError as err:
+                    logger.error(f"[{self.name}]: Failed to locate configuration file. {err}")
+                    return -11, self.name, None
+            ret = self.connect()
+            if ret:
+                return ret, self.name, None
             logger.info(f'[{self.name}]: set_config called. Dry run: {dry}')
             JunosDevice.dir_name = self.__create_dir('delta')
             logger.info(f'[{self.name}]: Dump directory is {JunosDevice.dir_name}.')
+            file_name = JunosDevice.dir_name + self.name + "." + form
+            if skip_unchanged:
+                fingerprint = self.config_fingerprint()
+                if state.is_unchanged(self.name, intent, fingerprint):
+                    logger.info(f"[{self.name}]: Intent and device config unchanged since "
+                                f"{state.get(self.name)['timestamp']}. Skipping lock, load and diff.")
+                    self.write_to_file(file_name, "None")
+                    self.disconnect()
+                    return 0, self.name, file_name
+            lock = begin('lock')
             with Config(self.dev, mode="exclusive") as conf:
-                ret = self.load_config(conf=conf, env_file=env_file, config_file_dir=config_file_dir, template_path=template_path, 
-                                    form=form, overwrite=overwrite)
+                finish(lock)
+                with phase('load'):
+                    ret = self.load_config(conf=conf, env_file=env_file, config_file_dir=config_file_dir, template_path=template_path, 
+                                        form=form, overwrite=overwrite, rendered=rendered)
                 if ret == -11:
                     logger.info(f"[{self.name}]: No env file or config file provided.")
                     return ret, self.name, None
-                diff = conf.diff()
+                with phase('diff'):
+                    diff = conf.diff()
                 if diff == None:
                     diff = "None"
                     ret = 0
                 else:
                     ret = 1
-                file_name = JunosDevice.dir_name + self.name + "." + form
                 contents = diff
-                self.write_to_file(file_name, contents)
+                with phase('write'):
+                    self.write_to_file(file_name, contents)
                 if not dry:
-                    conf.commit()
+                    with phase('commit', confirm=confirm):
+                        if confirm:
+                            conf.commit(confirm=confirm, comment='jberry commit confirmed')
+                        else:
+                            conf.commit()
                     msg = "Configuration commited for device {}".format(self.name)
                 else:
                     msg = "{} Dry run completed. To skip dry run pass agrument '-d 0'".format(self.name)
+                unlock = begin('unlock')
+            finish(unlock)
+            if skip_unchanged and (ret == 0 or not dry):
+                # the device now matches the intent; remember the fingerprint it has after our commit
+                state.update(self.name, intent, fingerprint if dry else self.config_fingerprint())
             self.disconnect()
-            logger.debug(f'[{self.name}]: Dumping diff: \n {diff}')
+            logger.debug('[%s]: Dumping diff: \n %s', self.name, diff)
             logger.debug(msg)
             return ret, self.name, file_name
         except LockError as err:
@@ -197,24 +838,203 @@ class JunosDevice:
         except Exception as err:
             logger.exception("[{}]: Exception caught. {}".format(self.name, err))
             return -99, self.name, None
+        finally:
+            self._release_session()
+
+    @traced
+    def confirm_commit(self):
+        '''Confirms a commit confirmed made by set_config(confirm=minutes) before the device rolls it back.'''
+        try:
+            ret = self.connect()
+            if ret:
+                return ret
+            logger.info(f'[{self.name}]: Confirming commit')
+            with Config(self.dev, mode="exclusive") as conf:
+                with phase('commit'):
+                    conf.commit(comment='jberry confirm')
+            self.disconnect()
+            return 0
+        except LockError as err:
+            logger.error("[{}]: Failed to lock device. {}".format(self.name, err))
+            return -8
+        except CommitError as err:
+            logger.error("[{}]: Failed to confirm commit. {}".format(self.name, err))
+            return -9
+        except RpcTimeoutError as err:
+            logger.error("[{}]: Rpc Timeout Error. {}".format(self.name, err))
+            return -12
+        except Exception as err:
+            logger.exception("[{}]: Exception caught. {}".format(self.name, err))
+            return -99
+        finally:
+            self._release_session()
+
+    @traced
+    def rollback_commit(self, rb_id=1):
+        '''Rolls back to the config of rb_id commits ago and commits it, eg: to undo a commit confirmed right away.'''
+        try:
+            ret = self.connect()
+            if ret:
+                return ret
+            logger.info(f'[{self.name}]: Rolling back to rollback {rb_id}')
+            with Config(self.dev, mode="exclusive") as conf:
+                with phase('rollback'):
+                    conf.rollback(rb_id)
+                with phase('commit'):
+                    conf.commit(comment='jberry rollback {}'.format(rb_id))
+            self.disconnect()
+            return 0
+        except LockError as err:
+            logger.error("[{}]: Failed to lock device. {}".format(self.name, err))
+            return -8
+        except CommitError as err:
+            logger.error("[{}]: Failed to commit rollback. {}".format(self.name, err))
+            return -9
+        except RpcTimeoutError as err:
+            logger.error("[{}]: Rpc Timeout Error. {}".format(self.name, err))
+            return -12
+        except Exception as err:
+            logger.exception("[{}]: Exception caught. {}".format(self.name, err))
+            return -99
+        finally:
+            self._release_session()
+
+    @traced
+    def stage_package(self, package, remote_path, checksum, checksum_algorithm, throttle=None, source_url=None):
+        '''
+        Makes sure package is present in remote_path with the given checksum. An image that is already there
+        is reused, source_url (eg: an already staged peer) is tried before copying from the jberry host,
+        and copies from the jberry host are paced by the shared throttle.
+        '''
+        # fan-out urls carry the peer's credentials, only the part after @ is logged
+        logger.info(f'[{self.name}]: stage_package called. Source: {source_url.split("@")[-1] if source_url else "local"}')
+        remote_package = remote_path.rstrip('/') + '/' + os.path.basename(package)
+        try:
+            ret = self.connect()
+            if ret:
+                return ret
+            sw = SW(self.dev)
+            if sw.remote_checksum(remote_package, algorithm=checksum_algorithm) == checksum:
+                logger.info(f'[{self.name}]: {remote_package} already staged. Skipping copy.')
+                self.disconnect()
+                return 0
+            if source_url:
+                try:
+                    with phase('copy', source='peer'):
+                        self.dev.rpc.file_copy(source=source_url, destination=remote_package, dev_timeout=1800)
+                except RpcError as err:
+                    logger.warning(f'[{self.name}]: Copy from {source_url.split("@")[-1]} failed. {err}')
+                if sw.remote_checksum(remote_package, algorithm=checksum_algorithm) == checksum:
+                    logger.info(f'[{self.name}]: Staged {remote_package} from peer.')
+                    self.disconnect()
+                    return 0
+                logger.info(f'[{self.name}]: Falling back to copy from the jberry host.')
+            with phase('copy', source='local'):
+                if hasattr(self.dev, "_mode") and self.dev._mode == "telnet":
+                    sw.put(package, remote_path)
+                else:
+                    with SCP(self.dev, progress=throttle.callback() if throttle else None) as scp:
+                        scp.put(package, remote_path)
+            if sw.remote_checksum(remote_package, algorithm=checksum_algorithm) != checksum:
+                logger.error(f'[{self.name}]: Checksum mismatch for {remote_package} after copy.')
+                self.disconnect()
+                return -14
+            logger.info(f'[{self.name}]: Staged {remote_package}.')
+            self.disconnect()
+            return 0
+        except RpcTimeoutError as err:
+            logger.error("[{}]: Rpc Timeout Error. {}".format(self.name, err))
+            return -12
+        except Exception as err:
+            logger.exception("[{}]: Staging failed. {}".format(self.name, err))
+            return -14
+        finally:
+            self._release_session()
+
+    @traced
+    def install_package(self, package, validate, checksum_algorithm, remote_path):
+        '''Installs a package that stage_package already copied to remote_path and reboots the device.'''
+        logger.info(f'[{self.name}]: install_package called.')
+        try:
+            ret = self.connect()
+            if ret:
+                return ret
+            sw = SW(self.dev)
+            with phase('install'):
+                ok, msg = sw.install(package=package, validate=validate, remote_path=remote_path, no_copy=True,
+                                     checksum_algorithm=checksum_algorithm)
+            logger.info(f"[{self.name}]: status: {ok}, Message: {msg}")
+            if not ok:
+                self.disconnect()
+                return -13
+            if JunosDevice.dump_path:
+                FactsCache(JunosDevice.dump_path).invalidate(self.name)
+            with phase('reboot'):
+                sw.reboot()
+            self.disconnect(discard=True)
+            return 0
+        except RpcTimeoutError as err:
+            logger.error("[{}]: Rpc Timeout Error. {}".format(self.name, err))
+            return -12
+        except Exception as err:
+            logger.exception("[{}]: Install failed. {}".format(self.name, err))
+            return -13
+        finally:
+            self._release_session()
 
+    @traced
+    def wait_for_version(self, version, timeout=1800, interval=30):
+        '''
+        Polls a device rebooted by install_package until it runs version. The old version answers until the reboot
+        has actually started, so only the last poll counts. Returns 0, -2 when the device is still unreachable after
+        timeout seconds or -13 when it came back on another version.
+        '''
+        logger.info(f'[{self.name}]: Waiting up to {timeout}s for the device to run {version}.')
+        deadline = time.monotonic() + timeout
+        while True:
+            running = None
+            try:
+                if not self.connect():
+                    self.dev.facts_refresh(keys='version')
+                    running = self.dev.facts['version']
+                    self.disconnect(discard=True)
+            except Exception as err:
+                logger.info(f'[{self.name}]: Not back yet. {err}')
+            finally:
+                self._release_session()
+            if running == version:
+                logger.info(f'[{self.name}]: Device is running {version}.')
+                return 0
+            if time.monotonic() + interval > deadline:
+                break
+            time.sleep(interval)
+        if running is None:
+            logger.error(f'[{self.name}]: Device did not come back within {timeout}s.')
+            return -2
+        logger.error(f'[{self.name}]: Device runs {running} instead of {version}.')
+        return -13
+
+    @traced
     def upgrade_junos(self, dry, package, validate, checksum_algorithm, remote_path):
         logger.info(f'[{self.name}]: upgrade_junos called.')
         logger.info(f'[{self.name}]: to be upgraded using package {package}. Dry run: {dry}')
-        dev = self.dev_connection(self.name, self.ip or self.console, self.user, self.password)
         try:
-            dev.open() 
+            ret = self.connect()
+            if ret:
+                return ret
             if not dry:
                 "***{} UPGRADE STARTED***".format(self.name)
-                sw = SW(dev)
+                sw = SW(self.dev)
                 ok, msg = sw.install(package=package, validate=validate, remote_path=remote_path, 
                                     checksum_algorithm=checksum_algorithm)
                 logger.info("status: " + str(ok) + ", Message: " + msg)
                 if ok:
+                    if JunosDevice.dump_path:
+                        FactsCache(JunosDevice.dump_path).invalidate(self.name)
                     sw.reboot()
             else:
                 logger.info("[{}]: Dry run completed. To skip dry run pass agrument '-d 0'".format(self.name))
-            dev.close()
+            self.disconnect(discard=not dry)
             logger.info(f"***[{self.name}]: UPGRADE FINISHED***")
             return 0
         except RuntimeError as err:
@@ -229,19 +1049,23 @@ class JunosDevice:
         except Exception as err:
             logger.error("[{}]:Exception caught. {}".format(self.name, err))
             return -99
+        finally:
+            self._release_session()
 
+    @traced
     def zeroize_junos(self, dry):
         logger.info(f'[{self.name}]: zeroize_junos called. Dry run: {dry}')
-        dev = self.dev_connection(self.name, self.ip or self.console, self.user, self.password)
         try:
-            dev.open() 
+            ret = self.connect()
+            if ret:
+                return ret
             if not dry:
-                sw = SW(dev)
+                sw = SW(self.dev)
                 msg = self.name + " " + sw.zeroize()
             else:
                 msg = "[{}]: Dry run completed. To skip dry run pass agrument '-d 0'".format(self.name)
             logger.info(msg)
-            dev.close()
+            self.disconnect(discard=not dry)
             return 0
         except RuntimeError as err:
             logger.error("[{}]: Failed to connect to device. {}".format(self.name, err))
@@ -255,14 +1079,18 @@ class JunosDevice:
         except Exception as err:
             logger.error("[{}]: Exception caught. {}".format(self.name, err))
             return -99
+        finally:
+            self._release_session()
 
+    @traced
     def power_junos(self, power, t, dry):
         logger.info(f'[{self.name}]: power_junos called. Dry run: {dry}')
         logger.info(f"[{self.name}]: ACTION IS {power}")
-        dev = self.dev_connection(self.name, self.ip or self.console, self.user, self.password)
         try:
-            dev.open() 
-            sw = SW(dev)
+            ret = self.connect()
+            if ret:
+                return ret
+            sw = SW(self.dev)
             if not dry:
                 if power == "poweroff":
                     msg = sw.poweroff(in_min=t) + " [{}]".format(self.name)
@@ -271,7 +1099,7 @@ class JunosDevice:
             else:
                 msg = "[{}]: Dry run completed. To skip dry run pass agrument '-d 0'".format(self.name)
             logger.info(msg)
-            dev.close()
+            self.disconnect(discard=not dry)
             return 0
         except RuntimeError as err:
             logger.error("[{}]: Failed to connect to device. {}".format(self.name, err))
@@ -285,3 +1113,5 @@ class JunosDevice:
         except Exception as err:
             logger.error("[{}]:Exception caught. {}".format(self.name, err))
             return -99
+        finally:
+            self._release_session()
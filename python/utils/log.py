@@ -0,0 +1,59 @@
+import atexit, logging, logging.handlers, os, queue
+
+FORMAT = "%(asctime)s:[%(levelname)s]:[%(name)s]:%(message)s"
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+_listener = None
+_settings = {}
+
+
+def setup_logging(level=None, log_file=None, max_bytes=None, backup_count=None):
+    '''
+    Sends every utils.* logger through a QueueHandler. Worker threads only enqueue records and a single
+    QueueListener thread formats them into a size rotated log file, so hundreds of device threads never
+    contend on the file handler lock. Settings default to the JBERRY_LOG_LEVEL, JBERRY_LOG_FILE,
+    JBERRY_LOG_MAX_BYTES and JBERRY_LOG_BACKUPS environment variables. Calling it again changes the settings.
+    '''
+    global _listener
+    level = level or os.environ.get('JBERRY_LOG_LEVEL', 'INFO')
+    _settings.update(log_file=log_file or _settings.get('log_file') or os.environ.get('JBERRY_LOG_FILE', 'jberry.log'),
+                     max_bytes=int(max_bytes or _settings.get('max_bytes') or
+                                   os.environ.get('JBERRY_LOG_MAX_BYTES', DEFAULT_MAX_BYTES)),
+                     backup_count=int(backup_count or _settings.get('backup_count') or
+                                      os.environ.get('JBERRY_LOG_BACKUPS', DEFAULT_BACKUP_COUNT)))
+    logger = logging.getLogger(__package__)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    _stop()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler):
+            logger.removeHandler(handler)
+    file_handler = logging.handlers.RotatingFileHandler(_settings['log_file'], maxBytes=_settings['max_bytes'],
+                                                        backupCount=_settings['backup_count'])
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, file_handler)
+    _listener.start()
+    return logger
+
+
+def _stop():
+    global _listener
+    if _listener:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def _restart_in_child():
+    # the listener thread does not survive fork (eg: --shards), give the child its own
+    global _listener
+    if _listener:
+        _listener = None
+        setup_logging(logging.getLogger(__package__).level)
+
+
+atexit.register(_stop)
+os.register_at_fork(after_in_child=_restart_in_child)
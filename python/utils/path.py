@@ -1,9 +1,27 @@
-import os, time
+import glob, os, time
 
-def create_path(base_path, oper_name, device_list_file):
-    timestr = time.strftime("%Y-%m-%d-%H-%M-%S")
+def create_path(base_path, oper_name, device_list_file, timestr=None):
+    timestr = timestr or time.strftime("%Y-%m-%d-%H-%M-%S")
     dir_name = base_path + '/' + 'dumped_files/' + oper_name + '/' + \
         device_list_file + '_' + timestr + '/'
     os.makedirs(os.path.dirname(dir_name), exist_ok=True)
 
-    return dir_name
\ No newline at end of file
+    return dir_name
+
+def latest_backup(dump_path, device_list_file):
+    dirs = sorted(d for d in glob.glob(os.path.join(dump_path, 'dumped_files', 'config', os.path.basename(device_list_file) + '_*'))
+                  if os.path.isdir(d))
+    return dirs[-1] if dirs else None
+
+def find_config(directory, name, form):
+    '''<device name>.<format> in directory. Follows the marker get_config.py --incremental leaves for unchanged devices.'''
+    for form in [form] + [f for f in ('text', 'set', 'xml') if f != form]:
+        path = os.path.join(directory, name + '.' + form)
+        if os.path.exists(path):
+            return path
+        if os.path.exists(path + '.unchanged'):
+            with open(path + '.unchanged', 'r') as f:
+                last = f.read().rsplit('Last backup ', 1)[-1].strip()
+            if os.path.exists(last):
+                return last
+    return None
@@ -0,0 +1,74 @@
+import re
+from lxml import etree
+
+# named config hierarchies for get_config.py --preset. The presets section of the inventory adds to or overrides these
+CONFIG_PRESETS = {
+    'management': ['system/services', 'system/login', 'system/syslog', 'system/ntp', 'snmp'],
+    'routing': ['routing-options', 'protocols', 'policy-options'],
+    'interfaces': ['interfaces'],
+    'security': ['system/services', 'system/login', 'firewall', 'security'],
+}
+
+_SEGMENT = re.compile(r'([\w-]+)(?:\[([\w-]+)=([^\]]+)\])?')
+
+
+def preset_xpaths(data, names):
+    '''The config xpaths behind preset names. Raises KeyError for a preset that is not defined.'''
+    presets = dict(CONFIG_PRESETS, **(data.get('presets') or {}))
+    return [xpath for name in names for xpath in presets[name]]
+
+
+def parse_xpath(xpath):
+    '''
+    [(tag, key, value)] of a config xpath like system/services or interfaces/interface[name=ge-0/0/0]/unit[name=0].
+    key and value are None for a plain tag. Raises ValueError for anything else.
+    '''
+    segments, pos = [], 0
+    while True:
+        match = _SEGMENT.match(xpath, pos)
+        if not match:
+            raise ValueError(f'Invalid config xpath {xpath}')
+        segments.append(match.groups())
+        pos = match.end()
+        if pos == len(xpath):
+            return segments
+        if xpath[pos] != '/':
+            raise ValueError(f'Invalid config xpath {xpath}')
+        pos += 1
+
+
+def config_filter(xpaths):
+    '''
+    Merges config xpaths into one get-configuration filter, so that several hierarchies are fetched with a single
+    rpc and nothing outside them is sent by the device. Returns None for the whole config, a single plain xpath
+    unchanged, or otherwise a <configuration> filter string (PyEZ accepts both as filter_xml).
+    '''
+    xpaths = list(dict.fromkeys(xpath.strip('/') for xpath in xpaths or [] if xpath))
+    if not xpaths:
+        return None
+    trees = [parse_xpath(xpath) for xpath in xpaths]
+    if len(trees) == 1 and all(key is None for _, key, _ in trees[0]):
+        return xpaths[0]
+    # {segment: children}. None marks a hierarchy fetched as a whole, deeper xpaths below it add nothing
+    root = {}
+    for segments in trees:
+        node = root
+        for i, segment in enumerate(segments):
+            if i == len(segments) - 1:
+                node[segment] = None
+            elif node.setdefault(segment, {}) is None:
+                break
+            else:
+                node = node[segment]
+    configuration = etree.Element('configuration')
+    _build(configuration, root)
+    return etree.tostring(configuration, encoding='unicode')
+
+
+def _build(parent, node):
+    for (tag, key, value), children in node.items():
+        element = etree.SubElement(parent, tag)
+        if key:
+            etree.SubElement(element, key).text = value
+        if children:
+            _build(element, children)
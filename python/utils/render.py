@@ -0,0 +1,80 @@
+import concurrent.futures
+import logging, os, threading, time
+import jinja2, yaml
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_env_files = {}
+
+
+class _TemplateLoader(jinja2.BaseLoader):
+    # same lookup as PyEZ: relative paths from the current directory, absolute paths as they are
+    def get_source(self, environment, template):
+        if not os.path.exists(template):
+            raise jinja2.TemplateNotFound(template)
+        mtime = os.path.getmtime(template)
+        with open(template) as f:
+            source = f.read()
+        return source, template, lambda: mtime == os.path.getmtime(template)
+
+
+# auto_reload is off so that a compiled template is served without a stat() per device
+_environment = jinja2.Environment(loader=_TemplateLoader(), auto_reload=False)
+
+
+def get_template(template_path):
+    '''Returns the compiled template. Each template is read and compiled once per process.'''
+    return _environment.get_template(template_path)
+
+
+def load_env(env_file):
+    '''Returns the parsed variables of an environment file. Files shared by many devices (eg: common.yml)
+    are parsed once per process and re-read only when they change on disk.'''
+    mtime = os.path.getmtime(env_file)
+    with _lock:
+        cached = _env_files.get(env_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(env_file, 'r') as ef:
+        env = yaml.safe_load(ef)
+    with _lock:
+        _env_files[env_file] = (mtime, env)
+    return env
+
+
+def render(template_path, env_file):
+    return get_template(template_path).render(load_env(env_file) or {})
+
+
+def _render_chunk(template_path, jobs):
+    results = []
+    for name, env_file in jobs:
+        try:
+            results.append((name, render(template_path, env_file), None))
+        except Exception as err:
+            results.append((name, None, str(err)))
+    return results
+
+
+def render_all(template_path, env_files, workers=None, chunk_size=100):
+    '''
+    Renders the template for every device up front. env_files maps device name to its environment file.
+    Work is split in chunks across a process pool so that rendering uses all cores; every worker compiles
+    the template once. Returns {name: rendered config or None} and the elapsed seconds.
+    '''
+    start = time.monotonic()
+    jobs = list(env_files.items())
+    workers = workers or os.cpu_count() or 1
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    if workers > 1 and len(chunks) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+            results = [r for chunk in executor.map(_render_chunk, [template_path] * len(chunks), chunks) for r in chunk]
+    else:
+        results = _render_chunk(template_path, jobs)
+    rendered = {}
+    for name, contents, err in results:
+        if err:
+            logger.error(f'[{name}]: Failed to render {template_path} with {env_files[name]}. {err}')
+        rendered[name] = contents
+    return rendered, time.monotonic() - start
@@ -0,0 +1,141 @@
+import concurrent.futures
+import heapq, itertools, logging, time
+from jnpr.junos.exception import ConnectError, ConnectAuthError, RpcTimeoutError
+from .console import console_port, DEFAULT_MAX_SESSIONS_PER_SERVER
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_WORKERS = 32
+# JunosDevice return codes for ConnectError and RpcTimeoutError. Authentication failures (-1) are never
+# retried so that a bad password does not lock the account out on the AAA servers.
+RETRY_CODES = (-2, -12)
+RETRY_EXCEPTIONS = (ConnectError, RpcTimeoutError)
+
+
+def _console_of(fn, args):
+    # the JunosDevice of a bound method like JD.get_config, or passed first like show_config(JD, ...)
+    device = getattr(fn, '__self__', None) or (args[0] if args else None)
+    return console_port(getattr(device, 'ip', None) or getattr(device, 'console', None))
+
+
+class _Task:
+    def __init__(self, fn, args, kwargs, site, priority, name):
+        self.fn = fn
+        self.console = _console_of(fn, args)
+        self.args = args
+        self.kwargs = kwargs
+        self.site = site
+        self.priority = priority
+        self.name = name
+        self.attempt = 0
+        self.future = concurrent.futures.Future()
+
+
+class Scheduler:
+    '''
+    Runs device operations with a global concurrency limit, optional per-site limits, retry with
+    exponential backoff for connection and RPC timeout failures, and priority ordering (lower runs first).
+    Devices behind a terminal server are limited to console_limit sessions per terminal server and one per
+    console port; they wait in the queue for a slot instead of holding a worker.
+    Usage mirrors concurrent.futures:
+
+        scheduler = Scheduler.from_inventory(data)
+        scheduler.submit(JD.get_config, form, conf_xpath, site='dc1', priority=0)
+        for fu in scheduler.as_completed():
+            fu.result()
+    '''
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, site_limits=None, retries=2, backoff=5,
+                 console_limit=DEFAULT_MAX_SESSIONS_PER_SERVER):
+        self.max_workers = max_workers
+        self.site_limits = site_limits or {}
+        self.console_limit = console_limit
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_codes = RETRY_CODES
+        self._pending = []
+        self._counter = itertools.count()
+
+    @classmethod
+    def from_inventory(cls, data):
+        conf = data.get('concurrency') or {}
+        return cls(max_workers=conf.get('max_workers', DEFAULT_MAX_WORKERS), site_limits=conf.get('sites'),
+                   retries=conf.get('retries', 2), backoff=conf.get('backoff', 5),
+                   console_limit=(data.get('console') or {}).get('max_sessions_per_server', DEFAULT_MAX_SESSIONS_PER_SERVER))
+
+    def submit(self, fn, *args, site=None, priority=0, name=None, **kwargs):
+        task = _Task(fn, args, kwargs, site, priority, name or getattr(getattr(fn, '__self__', None), 'name', None))
+        heapq.heappush(self._pending, (priority, 0, next(self._counter), task))
+        return task.future
+
+    def should_retry(self, task, result=None, err=None):
+        if task.attempt > self.retries:
+            return False
+        if err is not None:
+            return isinstance(err, RETRY_EXCEPTIONS) and not isinstance(err, ConnectAuthError)
+        code = result[0] if isinstance(result, tuple) else result
+        return code in self.retry_codes
+
+    def _console_free(self, console, server_running, ports_running):
+        server, port = console
+        return port not in ports_running and not (self.console_limit and
+                                                  server_running.get(server, 0) >= self.console_limit)
+
+    def as_completed(self):
+        running = {}
+        site_running = {}
+        server_running = {}
+        ports_running = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while self._pending or running:
+                now = time.monotonic()
+                deferred = []
+                while self._pending and len(running) < self.max_workers:
+                    entry = heapq.heappop(self._pending)
+                    _, not_before, _, task = entry
+                    limit = self.site_limits.get(task.site)
+                    if not_before > now or (limit and site_running.get(task.site, 0) >= limit) or \
+                            (task.console and not self._console_free(task.console, server_running, ports_running)):
+                        deferred.append(entry)
+                        continue
+                    task.attempt += 1
+                    site_running[task.site] = site_running.get(task.site, 0) + 1
+                    if task.console:
+                        server_running[task.console[0]] = server_running.get(task.console[0], 0) + 1
+                        ports_running.add(task.console[1])
+                    running[executor.submit(task.fn, *task.args, **task.kwargs)] = task
+                for entry in deferred:
+                    heapq.heappush(self._pending, entry)
+                timeout = None
+                if self._pending:
+                    timeout = max(min(e[1] for e in self._pending) - now, 0.1)
+                if not running:
+                    time.sleep(timeout)
+                    continue
+                done, _ = concurrent.futures.wait(running, timeout=timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for fu in done:
+                    task = running.pop(fu)
+                    site_running[task.site] -= 1
+                    if task.console:
+                        server_running[task.console[0]] -= 1
+                        ports_running.discard(task.console[1])
+                    err = fu.exception()
+                    result = None if err else fu.result()
+                    if self.should_retry(task, result, err):
+                        delay = self.backoff * 2 ** (task.attempt - 1)
+                        logger.info(f'[{task.name}]: Retrying in {delay}s (attempt {task.attempt + 1}).')
+                        heapq.heappush(self._pending,
+                                       (task.priority, time.monotonic() + delay, next(self._counter), task))
+                        continue
+                    if err:
+                        task.future.set_exception(err)
+                    else:
+                        task.future.set_result(result)
+                    yield task.future
+
+
+def make_scheduler(data, engine='thread'):
+    if engine == 'asyncio':
+        from .async_engine import AsyncScheduler
+        return AsyncScheduler.from_inventory(data)
+    return Scheduler.from_inventory(data)
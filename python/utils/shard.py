@@ -0,0 +1,96 @@
+import concurrent.futures
+import copy, logging, math, time
+from .junosDevice import JunosDevice
+from .scheduler import make_scheduler, RETRY_CODES
+from .console import ConsoleManager, DEFAULT_MAX_SESSIONS_PER_SERVER
+from .utils import parse_device_data, parse_device_options
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+
+def shard_inventory(data, shards):
+    '''Splits the inventory round robin into shard sized inventories. Concurrency limits are divided
+    between the shards so that the fleet wide limits from the inventory still hold.'''
+    devices = list(data['devices'].keys())
+    shards = max(1, min(shards, len(devices)))
+    conf = data.get('concurrency') or {}
+    result = []
+    for i in range(shards):
+        shard = {k: v for k, v in data.items() if k not in ('devices', 'concurrency', 'console')}
+        shard['devices'] = {device: data['devices'][device] for device in devices[i::shards]}
+        shard_conf = copy.deepcopy(conf)
+        for key in ('max_workers', 'io_threads'):
+            if shard_conf.get(key):
+                shard_conf[key] = math.ceil(shard_conf[key] / shards)
+        shard_conf['sites'] = {site: math.ceil(n / shards) for site, n in (conf.get('sites') or {}).items()}
+        shard['concurrency'] = shard_conf
+        if data.get('console'):
+            # ports are locked across processes, the terminal server session limit is split between the shards
+            console = dict(data['console'])
+            console['max_sessions_per_server'] = math.ceil(
+                console.get('max_sessions_per_server', DEFAULT_MAX_SESSIONS_PER_SERVER) / shards)
+            shard['console'] = console
+        result.append(shard)
+    return result
+
+
+def _run_shard(data, op, op_args, device_arg, engine, dump_path, device_list_file, timestamp, timed=False,
+               retry_codes=RETRY_CODES):
+    if timed:
+        timing.enable()
+    JunosDevice.dump_path = dump_path
+    JunosDevice.device_list_file = device_list_file
+    JunosDevice.timestamp = timestamp
+    JunosDevice.console_manager = ConsoleManager.from_inventory(data, dump_path)
+    scheduler = make_scheduler(data, engine)
+    scheduler.retry_codes = retry_codes
+    names = {}
+    for device in data['devices'].keys():
+        name, ip, console, user, password = parse_device_data(data, device)
+        site, priority, timeout = parse_device_options(data, device)
+        JD = JunosDevice(name, user, password, ip, console, timeout)
+        args = (device_arg(name),) + op_args if device_arg else op_args
+        names[scheduler.submit(getattr(JD, op), *args, site=site, priority=priority)] = name
+    results = []
+    for fu in scheduler.as_completed():
+        try:
+            results.append((names[fu], fu.result()))
+        except Exception as err:
+            logger.error(f'[{names[fu]}]: {op} failed. {err}')
+            # the (ret, name, file name) shape of the JunosDevice operations, so callers can unpack every result
+            results.append((names[fu], (-99, names[fu], None)))
+    # spans recorded in this process are handed back to the parent's run report
+    return results, timing.collect() if timed else []
+
+
+def run_sharded(data, shards, op, *op_args, engine='thread', device_arg=None, retry_codes=RETRY_CODES):
+    '''
+    Runs JunosDevice.<op>(*op_args) for every device in the inventory across a pool of shards processes,
+    each with its own scheduler for the network I/O. device_arg is an optional module level function
+    of the device name whose result is passed before op_args. retry_codes are the return codes the
+    schedulers retry. Yields (device name, result).
+    '''
+    JunosDevice.timestamp = JunosDevice.timestamp or time.strftime("%Y-%m-%d-%H-%M-%S")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=shards) as executor:
+        results = [executor.submit(_run_shard, shard, op, op_args, device_arg, engine, JunosDevice.dump_path,
+                                   JunosDevice.device_list_file, JunosDevice.timestamp, timing.enabled(), retry_codes)
+                   for shard in shard_inventory(data, shards)]
+        for fu in concurrent.futures.as_completed(results):
+            shard_results, spans = fu.result()
+            timing.merge(spans)
+            for name, result in shard_results:
+                yield name, result
+
+
+def _failed(result):
+    code = result[0] if isinstance(result, tuple) else result
+    return code is not None and code < 0
+
+
+def exit_code(results):
+    failed = [name for name, result in results if _failed(result)]
+    print(f"{len(results)} devices completed. {len(results) - len(failed)} succeeded, {len(failed)} failed.")
+    if failed:
+        print("Failed: " + " ".join(sorted(failed)))
+    return 1 if failed else 0
@@ -0,0 +1,90 @@
+import csv, json
+from collections import Counter
+
+# row element and {column: child element} of the rpc replies show_config.py knows how to tabulate
+INTERFACES = ('physical-interface', {'name': 'name', 'admin_status': 'admin-status', 'oper_status': 'oper-status',
+                                     'speed': 'speed', 'mtu': 'mtu', 'description': 'description'})
+# show interfaces terse only has the state of every interface
+INTERFACES_TERSE = ('physical-interface', {'name': 'name', 'admin_status': 'admin-status', 'oper_status': 'oper-status'})
+BGP_PEERS = ('bgp-peer', {'peer_address': 'peer-address', 'peer_as': 'peer-as', 'state': 'peer-state',
+                          'flap_count': 'flap-count', 'elapsed_time': 'elapsed-time', 'description': 'description'})
+LLDP_NEIGHBORS = ('lldp-neighbor-information', {'local_port': 'lldp-local-port-id',
+                                                 'remote_chassis_id': 'lldp-remote-chassis-id',
+                                                 'remote_port': 'lldp-remote-port-id',
+                                                 'remote_system': 'lldp-remote-system-name'})
+ROUTE_SUMMARY = ('route-table', {'table': 'table-name', 'destinations': 'destination-count',
+                                 'total': 'total-route-count', 'active': 'active-route-count',
+                                 'holddown': 'holddown-route-count', 'hidden': 'hidden-route-count'})
+CHASSIS_ALARMS = ('alarm-detail', {'time': 'alarm-time', 'class': 'alarm-class', 'type': 'alarm-type',
+                                   'description': 'alarm-description'})
+
+
+class Table:
+    '''
+    Column oriented table: one list per column, all of the same length. A missing element in the rpc
+    reply becomes None in its column instead of shifting the rows that follow.
+    '''
+    def __init__(self, columns):
+        self.columns = {c: [] for c in columns}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def column(self, name):
+        return self.columns[name]
+
+    def rows(self, columns=None):
+        return list(zip(*(self.columns[c] for c in (columns or self.columns))))
+
+    def extend(self, other, **constants):
+        '''Appends the rows of other, filling the columns named in constants (eg: device=name) with one value.'''
+        n = len(other)
+        for name, values in self.columns.items():
+            if name in constants:
+                values.extend([constants[name]] * n)
+            else:
+                values.extend(other.columns.get(name, [None] * n))
+
+    def count(self, *columns):
+        '''Number of rows per distinct value (or tuple of values) of the given columns.'''
+        return Counter(zip(*(self.columns[c] for c in columns)) if len(columns) > 1 else self.columns[columns[0]])
+
+    def to_csv(self, file_name):
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(self.rows())
+
+    def to_jsonl(self, file_name):
+        names = list(self.columns)
+        with open(file_name, 'w') as f:
+            for row in self.rows():
+                f.write(json.dumps(dict(zip(names, row))) + '\n')
+
+    def to_parquet(self, file_name):
+        try:
+            import pyarrow, pyarrow.parquet
+        except ImportError:
+            raise ImportError('Parquet export needs pyarrow. Run "pip install pyarrow"')
+        pyarrow.parquet.write_table(pyarrow.table(self.columns), file_name)
+
+    def export(self, file_name, form):
+        getattr(self, 'to_' + form)(file_name)
+
+
+def _text(element, tag):
+    found = element.find(tag)
+    if found is None or found.text is None:
+        return None
+    return found.text.strip()
+
+
+def extract(root, spec):
+    '''Walks every row element of an rpc reply once, filling all columns in the same pass.'''
+    row_tag, fields = spec
+    table = Table(fields)
+    columns = [(table.columns[name], tag) for name, tag in fields.items()]
+    for element in root.iterfind(row_tag):
+        for values, tag in columns:
+            values.append(_text(element, tag))
+    return table
@@ -0,0 +1,233 @@
+import heapq, http.server, itertools, json, logging, random, threading, time
+import concurrent.futures
+from collections import Counter, deque
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60
+DEFAULT_JITTER = 0.1
+
+
+def snapshot(collector, table):
+    '''{row key: values of the tracked columns} of a collector's table. The tracked columns are the summary
+    columns other than the key; collectors without any (eg: route_summary) only report rows coming and going.'''
+    tracked = [c for c in collector.summary if c != collector.key]
+    return dict(zip(table.column(collector.key), table.rows(tracked) if tracked else itertools.repeat(())))
+
+
+def changes(old, new):
+    '''Yields (key, event, old values, new values) between two snapshots.'''
+    for key, values in new.items():
+        if key not in old:
+            yield key, 'added', None, values
+        elif old[key] != values:
+            yield key, 'changed', old[key], values
+    for key in old.keys() - new.keys():
+        yield key, 'removed', old[key], None
+
+
+def _up(value, up):
+    return 1 if value == up else 0
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# collector name: function of its table returning (metric, {label: value}, value) samples
+METRICS = {
+    'interfaces_list': lambda t: [s for name, admin, oper in t.rows(['name', 'admin_status', 'oper_status'])
+                                  for s in (('jberry_interface_admin_up', {'interface': name}, _up(admin, 'up')),
+                                            ('jberry_interface_oper_up', {'interface': name}, _up(oper, 'up')))],
+    'bgp_sessions': lambda t: [('jberry_bgp_peer_established', {'peer': peer}, _up(state, 'Established'))
+                               for peer, state in t.rows(['peer_address', 'state'])],
+    'lldp_neighbors': lambda t: [('jberry_lldp_neighbors', {}, len(t))],
+    'route_summary': lambda t: [('jberry_route_table_active_routes', {'table': table}, _int(active))
+                                for table, active in t.rows(['table', 'active'])],
+    'chassis_alarms': lambda t: [('jberry_chassis_alarms', {'class': cls}, count)
+                                 for cls, count in t.count('class').items()],
+}
+
+
+def _labels(labels):
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels.items()) + '}'
+
+
+class Poller:
+    '''
+    Polls collectors (see utils/collectors.py) on a fleet of JunosDevice objects, each collector on its own
+    interval with +-jitter so that polls of many devices do not line up. Collectors of a device that are
+    due together run over one session and sessions stay open in JunosDevice.session_pool between polls.
+    The previous result of every (device, collector) is kept and only differences are reported, through
+    on_event and the recent events list.
+    '''
+    def __init__(self, devices, collectors, intervals=None, jitter=DEFAULT_JITTER, workers=32, on_event=None,
+                 max_events=1000):
+        self.devices = {JD.name: JD for JD in devices}
+        self.collectors = {c.name: c for c in collectors}
+        intervals = dict(intervals or {})
+        default = intervals.pop('default', DEFAULT_INTERVAL)
+        self.intervals = {c.name: intervals.get(c.name, default) for c in collectors}
+        self.jitter = jitter
+        self.on_event = on_event
+        self.events = deque(maxlen=max_events)
+        self.snapshots = {}
+        self.tables = {}
+        self.stats = {}
+        self.up = {}
+        self._busy = set()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # spread the first polls over one interval instead of polling everything at start up
+        for name in self.devices:
+            for collector, interval in self.intervals.items():
+                self._push(time.monotonic() + random.uniform(0, interval), name, collector)
+
+    def _push(self, due, device, collector):
+        heapq.heappush(self._heap, (due, next(self._seq), device, collector))
+
+    def _next_due(self, collector):
+        interval = self.intervals[collector]
+        return time.monotonic() + interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def _due(self):
+        '''Pops everything that is due, grouped by device. Devices still being polled are retried shortly.'''
+        now = time.monotonic()
+        batches = {}
+        while self._heap and self._heap[0][0] <= now:
+            _, _, device, collector = heapq.heappop(self._heap)
+            if device in self._busy:
+                self._push(now + 1, device, collector)
+            else:
+                batches.setdefault(device, []).append(collector)
+        for device in batches:
+            self._busy.add(device)
+        return batches
+
+    def run(self):
+        logger.info(f'Polling {len(self.devices)} devices for {list(self.intervals)}')
+        while not self._stop.is_set():
+            with self._cond:
+                batches = self._due()
+                if not batches:
+                    wait = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(wait)
+                    continue
+            for device, collectors in batches.items():
+                self._executor.submit(self.poll, device, collectors)
+        self._executor.shutdown(wait=True)
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def poll(self, device, collectors):
+        start = time.monotonic()
+        try:
+            ret, tables = self.devices[device].collect([self.collectors[c] for c in collectors])
+            self._record(device, collectors, ret, tables, time.monotonic() - start)
+        except Exception as err:
+            logger.exception(f'[{device}]: Poll failed. {err}')
+        finally:
+            with self._cond:
+                self._busy.discard(device)
+                for collector in collectors:
+                    self._push(self._next_due(collector), device, collector)
+                self._cond.notify_all()
+
+    def _record(self, device, collectors, ret, tables, duration):
+        up = ret == 0
+        if self.up.get(device, up) != up:
+            self._event(device, None, None, 'up' if up else 'down', None, None)
+        self.up[device] = up
+        for name in collectors:
+            stats = self.stats.setdefault((device, name), Counter())
+            stats['duration'] = duration
+            stats['polls'] += 1
+            table = tables.get(name)
+            if table is None or isinstance(table, int):
+                stats['errors'] += 1
+                continue
+            collector = self.collectors[name]
+            new = snapshot(collector, table)
+            old = self.snapshots.get((device, name))
+            # the first poll is the baseline, only later polls report changes
+            if old is not None:
+                for key, event, before, after in changes(old, new):
+                    stats['changes'] += 1
+                    self._event(device, name, key, event, before, after)
+            self.snapshots[(device, name)] = new
+            self.tables[(device, name)] = table
+
+    def _event(self, device, collector, key, event, old, new):
+        entry = {'timestamp': time.strftime("%Y-%m-%d-%H-%M-%S"), 'device': device, 'collector': collector,
+                 'key': key, 'event': event, 'old': old, 'new': new}
+        self.events.append(entry)
+        logger.info(f'[{device}]: {collector} {key} {event}: {old} -> {new}')
+        if self.on_event:
+            self.on_event(entry)
+
+    def metrics(self):
+        '''Current state in the Prometheus text exposition format.'''
+        samples = {}
+        for device, up in list(self.up.items()):
+            samples.setdefault('jberry_device_up', []).append(({'device': device}, int(up)))
+        for (device, name), stats in list(self.stats.items()):
+            labels = {'device': device, 'collector': name}
+            samples.setdefault('jberry_poll_duration_seconds', []).append((labels, round(stats['duration'], 3)))
+            samples.setdefault('jberry_polls_total', []).append((labels, stats['polls']))
+            samples.setdefault('jberry_poll_errors_total', []).append((labels, stats['errors']))
+            samples.setdefault('jberry_changes_total', []).append((labels, stats['changes']))
+        for (device, name), table in list(self.tables.items()):
+            for metric, labels, value in METRICS.get(name, lambda t: [])(table):
+                if value is not None:
+                    samples.setdefault(metric, []).append((dict({'device': device}, **labels), value))
+        lines = []
+        for metric, values in samples.items():
+            kind = 'counter' if metric.endswith('_total') else 'gauge'
+            lines.append(f'# TYPE {metric} {kind}')
+            lines.extend(f'{metric}{_labels(labels)} {value}' for labels, value in values)
+        return '\n'.join(lines) + '\n'
+
+
+def serve(poller, port, address=''):
+    '''
+    Serves GET /metrics (Prometheus), /events (recent changes as json) and /state (latest tables as json)
+    from a background thread. Returns the server, shut it down with server.shutdown().
+    '''
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = poller.metrics(), 'text/plain; version=0.0.4'
+            elif self.path == '/events':
+                body, content_type = json.dumps(list(poller.events)), 'application/json'
+            elif self.path == '/state':
+                state = {}
+                for (device, name), table in list(poller.tables.items()):
+                    names = list(table.columns)
+                    state.setdefault(device, {})[name] = [dict(zip(names, row)) for row in table.rows()]
+                body, content_type = json.dumps(state), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            data = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = http.server.ThreadingHTTPServer((address, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
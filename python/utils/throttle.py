@@ -0,0 +1,32 @@
+import threading, time
+
+
+class Throttle:
+    '''
+    Token bucket shared by all concurrent file transfers so that together they stay under one bandwidth
+    cap (eg: the uplink of the jberry host). callback() returns an scp progress callback for a single
+    transfer; scp calls it from the sending thread after every chunk, so sleeping there paces the copy.
+    '''
+    def __init__(self, mbps):
+        self.rate = mbps * 1000 * 1000 / 8
+        self.tokens = 0.0
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self._lock:
+            now = time.monotonic()
+            # allow at most one second worth of burst
+            self.tokens = min(self.tokens + (now - self.last) * self.rate, self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def callback(self):
+        sent = [0]
+        def progress(path, total, xfrd):
+            self.consume(xfrd - sent[0])
+            sent[0] = xfrd
+        return progress
@@ -0,0 +1,232 @@
+import json, os, threading, time
+
+_lock = threading.Lock()
+_local = threading.local()
+_spans = None
+_started = None
+
+
+class Span:
+    __slots__ = ('name', 'device', 'trace_id', 'span_id', 'parent_id', 'start', 'end', 'wall', 'attributes')
+
+    def __init__(self, name, device, trace_id, parent_id, attributes):
+        self.name = name
+        self.device = device
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        # OpenTelemetry style span, one json object per line
+        return {'trace_id': self.trace_id, 'span_id': self.span_id, 'parent_span_id': self.parent_id,
+                'name': self.name, 'start_time_unix_nano': int(self.wall * 1e9),
+                'end_time_unix_nano': int((self.wall + self.duration) * 1e9),
+                'attributes': dict(self.attributes, device=self.device)}
+
+
+class _Null:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+_NULL = _Null()
+
+
+def enable():
+    '''Starts recording. Until then operation() and phase() cost next to nothing.'''
+    global _spans, _started
+    with _lock:
+        _spans = []
+        _started = time.time()
+
+
+def disable():
+    global _spans
+    with _lock:
+        _spans = None
+
+
+def enabled():
+    return _spans is not None
+
+
+def _record(span):
+    span.end = time.perf_counter()
+    with _lock:
+        if _spans is not None:
+            _spans.append(span)
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+class operation:
+    '''Span of one JunosDevice operation. Phases recorded in the same thread while it runs belong to it.'''
+    def __init__(self, device, name):
+        self.device = device
+        self.name = name
+        self.span = None
+
+    def __enter__(self):
+        if _spans is None:
+            return _NULL
+        stack = _stack()
+        parent = stack[-1] if stack else None
+        self.span = Span(self.name, self.device, parent.trace_id if parent else os.urandom(16).hex(),
+                         parent.span_id if parent else None, {'kind': 'operation'})
+        stack.append(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None:
+            _stack().pop()
+            if exc_type is not None:
+                self.span.set('error', exc_type.__name__)
+            _record(self.span)
+        return False
+
+
+def begin(name, **attributes):
+    '''Starts a phase of the current operation, eg: "lock". Returns None when not recording.'''
+    if _spans is None:
+        return None
+    stack = _stack()
+    parent = stack[-1] if stack else None
+    attributes['kind'] = 'phase'
+    return Span(name, parent.device if parent else None, parent.trace_id if parent else os.urandom(16).hex(),
+                parent.span_id if parent else None, attributes)
+
+
+def finish(span):
+    if span is not None:
+        _record(span)
+
+
+class phase:
+    '''with phase('rpc'): ... records how long the block took as a phase of the current operation.'''
+    def __init__(self, name, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.span = None
+
+    def __enter__(self):
+        self.span = begin(self.name, **self.attributes)
+        return self.span or _NULL
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.span is not None and exc_type is not None:
+            self.span.set('error', exc_type.__name__)
+        finish(self.span)
+        return False
+
+
+def collect():
+    '''Returns and forgets the spans recorded so far, eg: to hand them from a shard process to its parent.'''
+    global _spans
+    with _lock:
+        spans, _spans = _spans or [], ([] if _spans is not None else None)
+    return spans
+
+
+def merge(spans):
+    with _lock:
+        if _spans is not None:
+            _spans.extend(spans)
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda q: values[min(int(q * len(values)), len(values) - 1)]
+    return {'count': len(values), 'total': round(sum(values), 4), 'p50': round(pick(0.5), 4),
+            'p90': round(pick(0.9), 4), 'p99': round(pick(0.99), 4), 'max': round(values[-1], 4)}
+
+
+def report(spans=None, **run):
+    '''
+    Run report: per device the top level operations with their duration, return code and time per phase,
+    and fleet percentiles of every phase and operation across devices.
+    '''
+    spans = list(_spans or []) if spans is None else spans
+    by_id = {s.span_id: s for s in spans}
+    children = {}
+    for s in spans:
+        children.setdefault(s.parent_id, []).append(s)
+
+    def phases(span, totals):
+        for child in children.get(span.span_id, []):
+            if child.attributes.get('kind') == 'phase':
+                totals[child.name] = totals.get(child.name, 0) + child.duration
+            else:
+                phases(child, totals)
+        return totals
+
+    devices = {}
+    fleet_phases = {}
+    fleet_ops = {}
+    for s in spans:
+        if s.attributes.get('kind') != 'operation' or s.parent_id in by_id:
+            continue
+        totals = phases(s, {})
+        devices.setdefault(s.device, []).append({
+            'operation': s.name, 'ret': s.attributes.get('ret'), 'error': s.attributes.get('error'),
+            'start': s.wall, 'duration': round(s.duration, 4),
+            'phases': {name: round(value, 4) for name, value in totals.items()}})
+        fleet_ops.setdefault(s.name, []).append(s.duration)
+        for name, value in totals.items():
+            fleet_phases.setdefault(name, []).append(value)
+    run = dict(run, started=_started, duration=round(time.time() - _started, 3) if _started else None,
+               devices=len(devices))
+    return {'run': run, 'operations': {name: _percentiles(v) for name, v in fleet_ops.items()},
+            'phases': {name: _percentiles(v) for name, v in fleet_phases.items()}, 'devices': devices}
+
+
+def add_timing_args(parser):
+    parser.add_argument('--report', help='''Write a json run report with the time every device spent per phase (connect,
+                        lock, load, diff, commit, rpc, write...) and fleet percentiles to this file''', default=None)
+    parser.add_argument('--spans', help='Write every operation and phase as OpenTelemetry style spans (json lines) to this file',
+                        default=None)
+    return parser
+
+
+def start(args):
+    if getattr(args, 'report', None) or getattr(args, 'spans', None):
+        enable()
+
+
+def save(args, **run):
+    '''Writes the files asked for with --report and --spans.'''
+    if not enabled():
+        return
+    spans = list(_spans)
+    if getattr(args, 'report', None):
+        with open(args.report, 'w') as f:
+            json.dump(report(spans, **run), f, indent=2, default=str)
+        print("Run report written to {}".format(args.report))
+    if getattr(args, 'spans', None):
+        with open(args.spans, 'w') as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + '\n')
+        print("Spans written to {}".format(args.spans))
@@ -12,4 +12,11 @@ def parse_device_data(data, device):
         console = device
         user = data['user']
         password = data['password']
-    return name, ip, console, user, password
\ No newline at end of file
+    return name, ip, console, user, password
+
+def parse_device_options(data, device):
+    options = data['devices'][device] if type(data['devices'][device]) is dict else {}
+    site = options.get('site')
+    priority = options.get('priority', 0)
+    timeout = options.get('timeout') or (data.get('concurrency') or {}).get('timeout')
+    return site, priority, timeout
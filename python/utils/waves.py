@@ -0,0 +1,23 @@
+from .scheduler import Scheduler, RETRY_CODES
+
+
+def run_jobs(data, jobs, retry_codes=RETRY_CODES):
+    '''Runs (JunosDevice, site, priority, function, arguments) jobs through the scheduler. Returns {device name: result}.'''
+    scheduler = Scheduler.from_inventory(data)
+    scheduler.retry_codes = retry_codes
+    names = {scheduler.submit(fn, *fn_args, site=site, priority=priority): JD.name
+             for JD, site, priority, fn, fn_args in jobs}
+    results = {}
+    for fu in scheduler.as_completed():
+        results[names[fu]] = fu.result()
+    return results
+
+
+def make_waves(devices, canary, wave_size):
+    '''Splits devices in a canary wave of the first canary devices followed by waves of wave_size devices.'''
+    waves = []
+    if canary:
+        waves.append(devices[:canary])
+        devices = devices[canary:]
+    waves += [devices[i:i + wave_size] for i in range(0, len(devices), wave_size)]
+    return [wave for wave in waves if wave]